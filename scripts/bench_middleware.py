@@ -0,0 +1,140 @@
+"""
+Per-request cost of the quota and timing middleware.
+
+The same stack – timing outermost, then quota, then a route that reads the
+envelope the middleware parsed – is built twice: once from the pure ASGI
+classes the app uses, once from BaseHTTPMiddleware equivalents of the old
+ones (same checks, same metrics). A third app with no middleware at all is
+the floor. Requests are driven straight through the ASGI callable, `--rps`
+at a time, so the numbers are middleware overhead, not socket time. The
+quota script itself is swapped for an always-allow result so Redis is not
+needed and does not drown the difference, and info logs are muted.
+
+    SENDGRID_API_KEY=x PYTHONPATH=src python scripts/bench_middleware.py [--requests 20000] [--rps 200]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import structlog
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from emaillm.core.metrics import REQUEST_DURATION, REQUEST_IN_PROGRESS
+from emaillm.core.quota import QuotaResult
+from emaillm.middleware import quota_enforcement, request_timing
+from emaillm.middleware.quota_enforcement import QuotaMiddleware, check_inbound
+from emaillm.middleware.request_timing import RequestTimingMiddleware
+
+class LegacyQuotaMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if request.url.path != quota_enforcement.INBOUND_PATH:
+            return await call_next(request)
+        response = await check_inbound(request)
+        return response if response is not None else await call_next(request)
+
+class LegacyTimingMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        method, path = request.method, request.url.path
+        REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).inc()
+        start, status_code = time.time(), 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            request_timing.logger.info("Request completed", method=method, path=path,
+                                       status_code=status_code, duration_seconds=time.time() - start)
+            return response
+        finally:
+            REQUEST_DURATION.labels(method=method, endpoint=path, status_code=status_code).observe(time.time() - start)
+            REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).dec()
+
+def build(stack):
+    app = FastAPI()
+
+    @app.post("/webhook/inbound")
+    async def inbound(request: Request):
+        envelope = getattr(request.state, "envelope", None)
+        if envelope is None:
+            envelope = await quota_enforcement.get_envelope(request)
+        return {"status": "accepted", "from": envelope.from_addr}
+
+    for middleware in stack:
+        app.add_middleware(middleware)
+    return app
+
+def request(app, body, chunk=65536):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/webhook/inbound", "raw_path": b"/webhook/inbound",
+        "query_string": b"", "root_path": "", "client": ("203.0.113.5", 5000), "server": ("bench", 80),
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    parts = [body[i:i + chunk] for i in range(0, len(body), chunk)] or [b""]
+
+    async def receive():
+        if parts:
+            part = parts.pop(0)
+            return {"type": "http.request", "body": part, "more_body": bool(parts)}
+        await asyncio.sleep(3600)      # a real server only sends the disconnect later
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    async def one():
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        assert status == [200], status
+        return time.perf_counter() - start
+    return one()
+
+async def run(name, app, body, total, rps):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(0, total, rps):
+        latencies += await asyncio.gather(*(request(app, body) for _ in range(rps)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    per_request = elapsed / len(latencies) * 1e6
+    print(f"{name:6} rate={len(latencies) / elapsed:,.0f}/s cost={per_request:.0f}us/request "
+          f"p50={statistics.median(latencies) * 1000:.2f}ms p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+    return per_request
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rps", type=int, default=200, help="requests in flight at once")
+    parser.add_argument("--body-kb", type=int, default=16)
+    args = parser.parse_args()
+
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    async def allow(user_id, plan=None):
+        return QuotaResult(allowed=True, remaining=100, reset_at=0)
+    quota_enforcement.consume_async = allow
+    text = "x" * (args.body_kb * 1024)
+    body = f"from=bench%40example.com&to=ask%40emaillm.ai&subject=hi&text={text}".encode()
+
+    apps = {
+        "none": build([]),
+        "base": build([LegacyQuotaMiddleware, LegacyTimingMiddleware]),
+        "asgi": build([QuotaMiddleware, RequestTimingMiddleware]),
+    }
+
+    async def bench():
+        costs = {}
+        for name, app in apps.items():
+            await run(name, app, body, min(1000, args.requests), args.rps)     # warm-up
+            costs[name] = await run(name, app, body, args.requests, args.rps)
+        base, asgi = costs["base"] - costs["none"], costs["asgi"] - costs["none"]
+        print(f"middleware overhead: BaseHTTPMiddleware {base:.0f}us, ASGI {asgi:.0f}us "
+              f"({base - asgi:.0f}us/request saved)")
+
+    asyncio.run(bench())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare ZSET and bucketed quota modes.
+
+Accuracy is simulated offline: a bursty sender is replayed against an exact
+sliding window (what the ZSET mode computes) and against the weighted bucket
+estimate, and every allow/deny decision is compared. With --redis the same
+traffic is written to both key layouts and MEMORY USAGE is reported.
+
+    PYTHONPATH=src python scripts/bench_quota.py [--days 60] [--redis]
+"""
+import argparse
+import random
+import time
+from collections import deque
+
+from emaillm.config import pricing_loader
+from emaillm.core.quota import bucket_estimate
+
+def traffic(days, rate_per_day, seed):
+    rng = random.Random(seed)
+    t, end = 0, days * 86400
+    while t < end:
+        # bursts: a few mails in quick succession, then a quiet gap
+        for _ in range(rng.choice((1, 1, 2, 5))):
+            yield t
+            t += rng.randint(1, 120)
+        t += int(rng.expovariate(rate_per_day / 86400))
+
+def simulate(limit, window, size, events):
+    exact = deque()
+    buckets = {}
+    agree = total = 0
+    worst = 0.0
+    for now in events:
+        while exact and exact[0] <= now - window:
+            exact.popleft()
+        est = bucket_estimate(buckets, now, window, size)
+        worst = max(worst, abs(est - len(exact)))
+        zset_ok, bucket_ok = len(exact) < limit, est < limit
+        agree += zset_ok == bucket_ok
+        total += 1
+        if zset_ok:
+            exact.append(now)
+        if bucket_ok:
+            idx = now // size
+            buckets[idx] = buckets.get(idx, 0) + 1
+        buckets = {i: c for i, c in buckets.items() if i >= (now - window) // size}
+    return agree / total, worst, total
+
+def memory(plan, events, size):
+    import redis
+    from emaillm.core.quota import REDIS_URL
+    r = redis.Redis.from_url(REDIS_URL)
+    zkey, hkey = f"bench:zset:{plan}", f"bench:hash:{plan}"
+    r.delete(zkey, hkey)
+    pipe = r.pipeline()
+    for i, t in enumerate(events):
+        pipe.zadd(zkey, {f"{i:032x}": t})
+        pipe.hincrby(hkey, t // size, 1)
+    pipe.execute()
+    z, h = r.memory_usage(zkey), r.memory_usage(hkey)
+    r.delete(zkey, hkey)
+    return z, h
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--bucket", type=int, default=3600, help="bucket size in seconds")
+    parser.add_argument("--redis", action="store_true", help="also measure MEMORY USAGE on REDIS_URL")
+    args = parser.parse_args()
+
+    plans = pricing_loader.current()
+    windows = [(f"{tier}/{w.name}", w.limit, w.seconds) for tier, spec in plans.plans.items() for w in spec.windows]
+    for plan, limit, window in windows:
+        rate = limit / (window / 86400) * 1.3      # ~30% over quota
+        events = list(traffic(args.days, rate, seed=42))
+        start = time.perf_counter()
+        agreement, worst, total = simulate(limit, window, args.bucket, events)
+        line = (f"{plan:13} limit={limit:<6} events={total:<6} agreement={agreement:.4%} "
+                f"max_count_error={worst:.2f} sim={time.perf_counter() - start:.2f}s")
+        if args.redis:
+            live = [t for t in events if t > events[-1] - window][:limit]
+            z, h = memory(plan, live, args.bucket)
+            line += f" zset={z}B buckets={h}B"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Render cost per reply.
+
+Times the full markdown -> text + HTML render of a typical LLM answer
+(cold: render cache cleared before every call) against a render-cache hit.
+
+    PYTHONPATH=src python scripts/bench_render.py [--n 2000]
+"""
+import argparse
+import time
+
+from emaillm.core import render
+
+SAMPLE = """**Short answer:** Arsenal beat Chelsea 2-1 on Saturday.
+
+Key moments:
+
+1. Saka opened the scoring in the *23rd* minute.
+2. Chelsea equalised from a corner just before half time.
+3. Ødegaard's free kick won it late on.
+
+| Team    | Shots | xG  |
+|---------|-------|-----|
+| Arsenal | 17    | 2.1 |
+| Chelsea | 9     | 0.8 |
+
+More at [the match report](https://example.com/report). `Reply` to ask a follow-up.
+"""
+
+def bench(n, answer, cold):
+    start = time.perf_counter()
+    for _ in range(n):
+        if cold:
+            render._cache.clear()
+        render.render_reply(answer)
+    return (time.perf_counter() - start) / n * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure reply render cost.")
+    parser.add_argument('--n', type=int, default=2000, help='Renders per measurement')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    render.load_templates()
+    print(f"template compile (once per process): {(time.perf_counter() - t0) * 1e3:8.2f} ms")
+    render.render_reply(SAMPLE)   # warm-up
+
+    cold = bench(args.n, SAMPLE, cold=True)
+    hit = bench(args.n, SAMPLE, cold=False)
+    print(f"render, cache miss:                  {cold:8.1f} µs/reply")
+    print(f"render, cache hit:                   {hit:8.1f} µs/reply")
+    print(f"speed-up on hit:                     {cold / hit:8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Per-email routing cost: legacy `in`-scan chain vs the compiled rule engine.
+
+Runs both over short and long bodies, then shows how the engine scales with
+the number of rules (synthetic keyword rules, one compiled pattern).
+
+    PYTHONPATH=src python scripts/bench_routing.py [--n 2000]
+"""
+import argparse
+import random
+import string
+import time
+
+from emaillm.core.routing import RoutingEngine, Rule, get_engine
+
+def legacy_route_email(subject: str, body: str) -> str:
+    """The pre-engine implementation, kept here for comparison."""
+    text = (subject + " " + body).lower()
+    if "google" in text:
+        return "Gemini"
+    if "excel" in text or "office" in text:
+        return "Copilot"
+    if "aws" in text or "lambda" in text or "devops" in text:
+        return "Titan"
+    if "open source" in text or "linux" in text:
+        return "Mixtral"
+    if "legal" in text or "ethical" in text:
+        return "Claude 3"
+    if "twitter" in text or "x.com" in text:
+        return "Grok"
+    return "GPT-4 Turbo"
+
+def prose(rng, n_chars):
+    words = []
+    size = 0
+    while size < n_chars:
+        w = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+        words.append(w)
+        size += len(w) + 1
+    return " ".join(words)
+
+def per_call_us(fn, emails, n):
+    start = time.perf_counter()
+    for i in range(n):
+        subject, body = emails[i % len(emails)]
+        fn(subject, body)
+    return (time.perf_counter() - start) / n * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark e-mail routing.")
+    parser.add_argument('--n', type=int, default=2000, help='Routing calls per measurement')
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    engine = get_engine()
+    print(f"{'body':>10}  {'legacy µs':>10}  {'engine µs':>10}")
+    for size in (500, 8_000, 200_000):
+        emails = [("question", prose(rng, size)) for _ in range(20)]
+        legacy = per_call_us(legacy_route_email, emails, args.n)
+        new = per_call_us(engine.route, emails, args.n)
+        print(f"{size:>10}  {legacy:>10.1f}  {new:>10.1f}")
+
+    print(f"\n{'rules':>10}  {'compile ms':>10}  {'in-chain µs':>11}  {'engine µs':>10}   (8 KB body)")
+    emails = [("question", prose(rng, 8_000)) for _ in range(20)]
+    for n_rules in (6, 100, 1_000, 5_000):
+        rules = [Rule(f"m{i}", priority=i, keywords=(f"kw{i}x", f"phrase {i}x")) for i in range(n_rules)]
+        keywords = [kw for rule in rules for kw in rule.keywords]
+
+        def in_chain(subject, body):
+            # what growing the legacy if-chain to n_rules would cost
+            text = (subject + " " + body).lower()
+            return next((kw for kw in keywords if kw in text), None)
+
+        t0 = time.perf_counter()
+        big = RoutingEngine(rules, default="GPT-4 Turbo")
+        compile_ms = (time.perf_counter() - t0) * 1e3
+        n = max(args.n // 10, 20)
+        print(f"{n_rules:>10}  {compile_ms:>10.1f}  {per_call_us(in_chain, emails, n):>11.1f}  {per_call_us(big.route, emails, n):>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Thousands of team members hammering one pooled quota.
+
+Every member of one team sends questions from a thread pool; each question is
+checked against the member cap and the team pool. "atomic" is the real path
+(`quota.consume`: every level in one script); "per-level" checks the user key,
+then the team key, in two separate scripts – the extra round trip it costs,
+and the member quota it leaks when the pool then says no, are the point.
+
+    PYTHONPATH=src python scripts/bench_team_quota.py [--members 5000] [--threads 64]
+"""
+import argparse
+import statistics
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from emaillm.config import pricing_loader
+from emaillm.core import quota, teams
+
+def setup(members, member_cap):
+    teams.ENABLED = True
+    team_id = f"bench-{uuid.uuid4().hex[:8]}"
+    emails = [f"m{i}@{team_id}.example" for i in range(members)]
+    doc = types.SimpleNamespace(id=team_id, to_dict=lambda: {
+        "members": emails, "plan_tier": "team", "member_quota_week": member_cap,
+    })
+    teams.get_directory().apply_teams([doc])
+    return team_id, emails
+
+def per_level(email, now):
+    """The non-atomic alternative: one script per level."""
+    levels = quota.quota_levels(email)
+    for lv in levels:
+        allowed, *_ = quota._consume(keys=[quota._key(lv.plan, lv.owner)],
+                                     args=[now, uuid.uuid4().hex, *quota._level_args([lv])])
+        if not allowed:
+            return False
+    return True
+
+def run(name, fn, emails, per_member, threads):
+    latencies = []
+
+    def one(email):
+        start = time.perf_counter()
+        ok = fn(email)
+        latencies.append(time.perf_counter() - start)
+        return ok
+
+    work = [e for e in emails for _ in range(per_member)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        allowed = sum(pool.map(one, work))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{name:9} questions={len(work)} allowed={allowed} "
+          f"rate={len(work) / elapsed:,.0f}/s p50={statistics.median(latencies) * 1000:.2f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+    return allowed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--per-member", type=int, default=2, help="questions per member")
+    parser.add_argument("--member-cap", type=int, default=1, help="member_quota_week")
+    parser.add_argument("--threads", type=int, default=64)
+    args = parser.parse_args()
+
+    pool_limit = min(w.limit for w in pricing_loader.current().get("team").windows)
+    print(f"team pool limit={pool_limit} members={args.members} member cap={args.member_cap}/week")
+
+    for name, fn in (
+        ("atomic", lambda e: quota.consume(e).allowed),
+        ("per-level", lambda e: per_level(e, int(time.time()))),
+    ):
+        team_id, emails = setup(args.members, args.member_cap)
+        allowed = run(name, fn, emails, args.per_member, args.threads)
+        # members whose own counter moved although the pool refused them
+        charged = sum(quota.r.zcard(quota._key("team", e)) for e in emails)
+        print(f"{'':9} pool used={quota.r.zcard(quota._key('team', f'team:{team_id}'))} "
+              f"member quota charged={charged} (leaked {charged - allowed})")
+        quota.r.delete(quota._key("team", f"team:{team_id}"), *(quota._key("team", e) for e in emails))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Fold every ZSET quota key (quota:<plan>:<user>) into bucket counters.
+
+Run once before or after switching QUOTA_MODE=buckets; keys that are not
+migrated here are folded lazily on the user's next email.
+
+    PYTHONPATH=src python scripts/migrate_quota_buckets.py [--dry-run]
+"""
+import argparse
+
+from emaillm.config import pricing_loader
+from emaillm.core.quota import migrate_to_buckets, r
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate ZSET quota keys to bucket counters.")
+    parser.add_argument('--dry-run', action='store_true', help='Only count the keys that would be migrated')
+    args = parser.parse_args()
+
+    plans = pricing_loader.current()
+    keys = questions = 0
+    for raw in r.scan_iter(match="quota:*", count=1000):
+        _, plan, user = raw.decode().split(":", 2)
+        if plan not in plans or r.type(raw) != b"zset":
+            continue
+        keys += 1
+        if not args.dry_run:
+            questions += migrate_to_buckets(plan, user)
+
+    print(f"Migrated {keys} keys ({questions} questions)" if not args.dry_run else f"Would migrate {keys} keys")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import json
+import uuid
+
+from emaillm.core import http
+from emaillm.email import dlq
+
+def positive(kind):
+    def parse(value):
+        number = kind(value)
+        if number <= 0:
+            raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+        return number
+    return parse
+
+def main():
+    parser = argparse.ArgumentParser(description="Resend e-mails parked in the emails_dlq Firestore collection.")
+    parser.add_argument('--run-id', default=None, help='Checkpoint name; reuse it to resume an interrupted run')
+    parser.add_argument('--rate', type=positive(float), default=dlq.RATE, help='Max sends per second')
+    parser.add_argument('--concurrency', type=positive(int), default=dlq.CONCURRENCY, help='Max sends in flight')
+    parser.add_argument('--page-size', type=positive(int), default=dlq.PAGE_SIZE, help='DLQ documents read per page')
+    parser.add_argument('--limit', type=positive(int), default=None, help='Stop after this many documents')
+    parser.add_argument('--dry-run', action='store_true', help='Only count what would be resent')
+    args = parser.parse_args()
+
+    run_id = args.run_id or f"cli-{uuid.uuid4().hex[:8]}"
+    print(f"Replay run {run_id} (pass --run-id {run_id} to resume)")
+
+    async def run():
+        try:
+            return await dlq.replay(
+                run_id,
+                page_size=args.page_size,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                limit=args.limit,
+                dry_run=args.dry_run,
+            )
+        finally:
+            await http.aclose_all()
+
+    state = asyncio.run(run())
+    print(json.dumps(state.__dict__, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,8 @@ def main():
     collection = COLLECTIONS[args.env]
 
     for tier, plan in plans.items():
+        if plan.get('price_cents') is None or not plan.get('stripe_price_id'):
+            print(f"Warning: {tier} has no price / Stripe price id yet")
         db.collection(collection).document(tier).set(plan)
 
     print(f"Seeded {len(plans)} plans")
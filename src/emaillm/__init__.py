@@ -1,15 +1,16 @@
 import logging
-import time
-from typing import Callable
+from contextlib import asynccontextmanager
 
 import structlog
 from dotenv import load_dotenv, find_dotenv
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Response
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.types import ASGIApp
 
-from emaillm.core.metrics import REQUEST_DURATION, REQUEST_IN_PROGRESS, init_metrics
+from emaillm.config import pricing_loader
+from emaillm.core import cache, http, plan_resolver, quota, render, semantic, teams
+from emaillm.email import outbox
+from emaillm.core.metrics import init_metrics
+from emaillm.routes.admin import router as admin_router
 from emaillm.routes.inbound_email import router as inbound_email_router
 
 # Load environment variables
@@ -37,15 +38,42 @@ structlog.configure(
 # Get a logger
 logger = structlog.get_logger()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start/stop per-process resources."""
+    render.load_templates()
+    plan_resolver.start_listener()
+    teams.start_listener()
+    blocks = quota.start_block_listener()
+    plans_watcher = pricing_loader.start_watcher()
+    listener = cache.start_invalidation_listener()
+    dispatcher = outbox.start_dispatcher() if outbox.DISPATCHER_ENABLED else None
+    if semantic.ENABLED:
+        await semantic.rebuild(cache.get_redis())
+    yield
+    listener.cancel()
+    plans_watcher.cancel()
+    plan_resolver.stop_listener()
+    teams.stop_listener()
+    if blocks is not None:
+        blocks.cancel()
+    if dispatcher is not None:
+        dispatcher.cancel()
+    # Drain the pooled upstream HTTP clients
+    await http.aclose_all()
+
 # Create FastAPI app
-app = FastAPI(title="EMAILLM", version="0.1.0")
+app = FastAPI(title="EMAILLM", version="0.1.0", lifespan=lifespan)
 
 # Add middleware
 from emaillm.middleware.quota_enforcement import QuotaMiddleware
 app.add_middleware(QuotaMiddleware)
+from emaillm.middleware.abuse_guard import AbuseGuardMiddleware
+app.add_middleware(AbuseGuardMiddleware)
 
 # Include routers
 app.include_router(inbound_email_router)
+app.include_router(admin_router)
 
 # Add metrics endpoint
 @app.get("/metrics")
@@ -56,55 +84,9 @@ async def metrics():
         media_type=CONTENT_TYPE_LATEST
     )
 
-# Add request timing middleware
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next: Callable):
-    """Middleware to track request timing and metrics."""
-    method = request.method
-    path = request.url.path
-    
-    # Skip metrics endpoint
-    if path == "/metrics":
-        return await call_next(request)
-    
-    # Track in-progress requests
-    REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).inc()
-    
-    start_time = time.time()
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        
-        # Log the request
-        logger.info(
-            "Request completed",
-            method=method,
-            path=path,
-            status_code=status_code,
-            duration_seconds=time.time() - start_time
-        )
-        
-        return response
-    except Exception as e:
-        status_code = 500
-        logger.error(
-            "Request failed",
-            method=method,
-            path=path,
-            status_code=status_code,
-            error=str(e),
-            duration_seconds=time.time() - start_time
-        )
-        raise
-    finally:
-        # Record metrics
-        duration = time.time() - start_time
-        REQUEST_DURATION.labels(
-            method=method,
-            endpoint=path,
-            status_code=status_code
-        ).observe(duration)
-        REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).dec()
+# Add request timing middleware (outermost, so it times the guards too)
+from emaillm.middleware.request_timing import RequestTimingMiddleware
+app.add_middleware(RequestTimingMiddleware)
 
 # Add Prometheus instrumentation after all routes and middleware are registered
 from prometheus_fastapi_instrumentator import Instrumentator, metrics  # noqa: E402
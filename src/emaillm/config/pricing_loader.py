@@ -1,34 +1,188 @@
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+"""
+Pricing plans: one frozen snapshot shared by quota enforcement and feature gating.
+
+`pricing_plans.json` (PRICING_PLANS_PATH overrides) is parsed once into an
+immutable `PlanSnapshot` whose quota windows are precomputed, e.g. free is
+10 per 7 days *and* 40 per 30 days. Readers call `current()` and never touch
+the file. `start_watcher()` swaps in a new snapshot when the file's mtime
+changes or, with ENABLE_FIRESTORE, when the `pricing_plans` collection
+changes (Firestore wins while it has plans). A snapshot that fails to parse
+is logged and ignored, so the previous one stays in force.
+"""
+
+import asyncio
 import json
 import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Mapping, Optional, Tuple
+
+import structlog
+
+logger = structlog.get_logger()
+
+CONFIG_PATH = os.getenv("PRICING_PLANS_PATH") or os.path.join(os.path.dirname(__file__), "pricing_plans.json")
+FIRESTORE_COLLECTION = os.getenv("PRICING_PLANS_COLLECTION", "pricing_plans")
+FIRESTORE_ENABLED    = os.getenv("ENABLE_FIRESTORE", "false").lower() == "true"
+RELOAD_INTERVAL_S    = float(os.getenv("PRICING_RELOAD_INTERVAL_SECONDS", 5))
+DEFAULT_TIER         = os.getenv("DEFAULT_PLAN", "free")
+
+# quota_<name> fields and their rolling window lengths
+WINDOW_SECONDS = {
+    "day":   24 * 3600,
+    "week":  7 * 24 * 3600,
+    "month": 30 * 24 * 3600,
+}
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "pricing_plans.json")
+@dataclass(frozen=True)
+class QuotaWindow:
+    name: str
+    limit: int
+    seconds: int
 
-@dataclass
+@dataclass(frozen=True)
 class PricingPlan:
-    price_cents: int
+    price_cents: Optional[int]                  # None: not on sale yet (no Stripe price)
     quota_week: Optional[int] = None
     quota_month: Optional[int] = None
-    features: List[str] = None
-    stripe_price_id: str = None
-
-def load_pricing_plans() -> Dict[str, PricingPlan]:
-    with open(CONFIG_PATH, "r") as f:
-        data = json.load(f)
-    plans = {}
-    for tier, plan in data.items():
-        plans[tier] = PricingPlan(
-            price_cents=plan["price_cents"],
-            quota_week=plan.get("quota_week"),
-            quota_month=plan.get("quota_month"),
-            features=plan["features"],
-            stripe_price_id=plan["stripe_price_id"]
-        )
-    return plans
+    features: FrozenSet[str] = frozenset()
+    stripe_price_id: Optional[str] = None
+    tier: str = ""
+    windows: Tuple[QuotaWindow, ...] = ()
+
+    def has_feature(self, feature: str) -> bool:
+        return feature in self.features
+
+    @property
+    def longest_window(self) -> int:
+        return max((w.seconds for w in self.windows), default=0)
+
+@dataclass(frozen=True)
+class PlanSnapshot:
+    plans: Mapping[str, PricingPlan]
+    version: str = ""
+    source: str = "file"            # file | firestore
+    default: str = DEFAULT_TIER
+
+    def __contains__(self, tier: str) -> bool:
+        return tier in self.plans
+
+    def get(self, tier: str) -> PricingPlan:
+        if tier not in self.plans:
+            raise ValueError(f"Unknown pricing tier: {tier}")
+        return self.plans[tier]
+
+    def get_or_default(self, tier: Optional[str]) -> PricingPlan:
+        """The tier's plan; unknown tiers are held to the default plan's limits."""
+        return self.plans.get(tier or self.default) or self.plans[self.default]
+
+    def has_feature(self, tier: Optional[str], feature: str) -> bool:
+        plan = self.plans.get(tier or self.default)
+        return plan is not None and plan.has_feature(feature)
+
+def quota_windows(spec: Mapping[str, Any], prefix: str = "quota_") -> Tuple[QuotaWindow, ...]:
+    """Windows from `<prefix>day|week|month` fields of a plan, team or org document."""
+    return tuple(
+        QuotaWindow(name, int(spec[f"{prefix}{name}"]), seconds)
+        for name, seconds in WINDOW_SECONDS.items()
+        if spec.get(f"{prefix}{name}") is not None
+    )
+
+def _plan(tier: str, spec: Dict[str, Any]) -> PricingPlan:
+    windows = quota_windows(spec)
+    return PricingPlan(
+        price_cents=int(spec["price_cents"]) if spec.get("price_cents") is not None else None,
+        quota_week=spec.get("quota_week"),
+        quota_month=spec.get("quota_month"),
+        features=frozenset(spec.get("features") or ()),
+        stripe_price_id=spec.get("stripe_price_id"),
+        tier=tier,
+        windows=windows,
+    )
+
+def parse_plans(data: Mapping[str, Dict[str, Any]], *, version: str = "", source: str = "file") -> PlanSnapshot:
+    plans = {tier: _plan(tier, spec) for tier, spec in data.items()}
+    if DEFAULT_TIER not in plans:
+        raise ValueError(f"pricing plans must define the default tier {DEFAULT_TIER!r}")
+    return PlanSnapshot(MappingProxyType(plans), version=version, source=source)
+
+def _read_file(path: str) -> PlanSnapshot:
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, "r") as f:
+        return parse_plans(json.load(f), version=f"file:{mtime}")
+
+def load_pricing_plans(path: str = CONFIG_PATH) -> Dict[str, PricingPlan]:
+    """Parse the plans file afresh (scripts and tests; the app uses `current()`)."""
+    return dict(_read_file(path).plans)
+
+_snapshot: Optional[PlanSnapshot] = None
+
+def current() -> PlanSnapshot:
+    """The plan snapshot in force; loaded from disk on first use only."""
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = _read_file(CONFIG_PATH)
+    return _snapshot
+
+def install(snapshot: PlanSnapshot) -> None:
+    """Swap in a new snapshot; readers see the old or the new one, never a mix."""
+    global _snapshot
+    old, _snapshot = _snapshot, snapshot
+    if old is not None and old.version != snapshot.version:
+        logger.info("Pricing plans reloaded", version=snapshot.version, source=snapshot.source, tiers=sorted(snapshot.plans))
+
+def reload_if_changed(path: str = CONFIG_PATH) -> bool:
+    """Reload from the file when its mtime moved (not while Firestore is the source)."""
+    snap = current()
+    if snap.source != "file" or snap.version == f"file:{os.stat(path).st_mtime_ns}":
+        return False
+    try:
+        install(_read_file(path))
+    except Exception as e:
+        logger.error("Pricing plans reload failed, keeping previous", error=str(e), path=path)
+        return False
+    return True
 
 def get_plan(tier: str) -> PricingPlan:
-    plans = load_pricing_plans()
-    if tier not in plans:
-        raise ValueError(f"Unknown pricing tier: {tier}")
-    return plans[tier]
+    return current().get(tier)
+
+def has_feature(tier: Optional[str], feature: str) -> bool:
+    return current().has_feature(tier, feature)
+
+def _on_firestore(docs, changes, read_time) -> None:
+    data = {doc.id: doc.to_dict() for doc in docs}
+    if not data:
+        return
+    try:
+        install(parse_plans(data, version=f"firestore:{read_time}", source="firestore"))
+    except Exception as e:
+        logger.error("Pricing plans from Firestore rejected, keeping previous", error=str(e))
+
+async def _run_watcher() -> None:
+    watch = None
+    if FIRESTORE_ENABLED:
+        try:
+            from emaillm.email.outbox import get_firestore_client
+            watch = get_firestore_client().collection(FIRESTORE_COLLECTION).on_snapshot(_on_firestore)
+        except Exception as e:
+            logger.warning("Pricing plan listener unavailable, watching the file only", error=str(e))
+    try:
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL_S)
+            try:
+                reload_if_changed()
+            except OSError as e:
+                logger.warning("Pricing plans file unreadable", error=str(e))
+    finally:
+        if watch is not None:
+            watch.unsubscribe()
+
+_watcher: Optional["asyncio.Task[None]"] = None
+
+def start_watcher() -> "asyncio.Task[None]":
+    """Start (once per event loop) the task that hot-reloads the plans."""
+    global _watcher
+    current()
+    if _watcher is None or _watcher.done():
+        _watcher = asyncio.get_running_loop().create_task(_run_watcher())
+    return _watcher
@@ -0,0 +1,189 @@
+"""
+Heavy-hitter detection for `/webhook/inbound`.
+
+Floods are spotted on three keys known before the form is decoded: the
+client IP, the sender's domain (sniffed from the first body chunk) and the
+signed delivery – the signature timestamp and signature headers together, so
+only a re-posted identical delivery repeats it, not every post SendGrid
+signed in the same second. Each key is counted in a sliding window built
+from two fixed-window Space-Saving summaries, so memory stays at
+ABUSE_TRACKED_KEYS entries per key however many distinct IPs or domains
+show up. A post is refused once the guaranteed
+(lower-bound) count for any of its keys passes that key's limit; evicted
+keys carry an error term, so spraying many distinct keys can't get a
+legitimate sender blocked.
+
+Limits are per process and per ABUSE_WINDOW_SECONDS; 0 disables a key.
+SendGrid delivers every post from a few egress IPs, so keep ABUSE_IP_LIMIT
+above their peak rate. Domains in ABUSE_DOMAIN_ALLOWLIST (the big mailbox
+providers by default, whose users together easily pass any per-domain cap)
+are counted and listed but never refused.
+"""
+
+import hashlib
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+ENABLED          = os.getenv("ABUSE_GUARD_ENABLED", "true").lower() == "true"
+WINDOW_S         = float(os.getenv("ABUSE_WINDOW_SECONDS", 60))
+TRACKED_KEYS     = int(os.getenv("ABUSE_TRACKED_KEYS", 512))
+TRUSTED_PROXIES  = int(os.getenv("ABUSE_TRUSTED_PROXIES", 0))   # hops appended to X-Forwarded-For by our own proxies
+LIMITS = {
+    "ip":        int(os.getenv("ABUSE_IP_LIMIT", 1000)),
+    "domain":    int(os.getenv("ABUSE_DOMAIN_LIMIT", 600)),
+    "timestamp": int(os.getenv("ABUSE_TIMESTAMP_LIMIT", 5)),     # re-posts of one signed delivery
+}
+DOMAIN_ALLOWLIST = frozenset(
+    d.strip().lower() for d in os.getenv(
+        "ABUSE_DOMAIN_ALLOWLIST",
+        "gmail.com,googlemail.com,outlook.com,hotmail.com,live.com,msn.com,yahoo.com,icloud.com,me.com,aol.com,proton.me,protonmail.com",
+    ).split(",") if d.strip()
+)
+
+class SpaceSaving:
+    """
+    Space-Saving top-K summary (Metwally et al.): at most `capacity` counters.
+    A new key takes over the smallest counter and inherits its count as
+    `error`, so `count` never underestimates and `count - error` never
+    overestimates.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._counters: Dict[str, List[int]] = {}     # key -> [count, error]
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def add(self, key: str, n: int = 1) -> None:
+        counter = self._counters.get(key)
+        if counter is None:
+            floor = 0
+            if len(self._counters) >= self.capacity:
+                victim = min(self._counters, key=lambda k: self._counters[k][0])
+                floor = self._counters.pop(victim)[0]
+            counter = self._counters[key] = [floor, floor]
+        counter[0] += n
+
+    def count(self, key: str) -> Tuple[int, int]:
+        """(count, error) for `key`; (0, 0) if it isn't tracked."""
+        counter = self._counters.get(key)
+        return (counter[0], counter[1]) if counter else (0, 0)
+
+    def guaranteed(self, key: str) -> int:
+        count, error = self.count(key)
+        return count - error
+
+    def items(self):
+        return ((key, c[0], c[1]) for key, c in self._counters.items())
+
+class HeavyHitters:
+    """
+    Sliding-window counts over Space-Saving summaries: the current fixed
+    window plus the previous one weighted by how much of it still overlaps
+    the last `window_s` seconds.
+    """
+
+    def __init__(self, window_s: float = WINDOW_S, capacity: int = TRACKED_KEYS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.window_s = window_s
+        self.capacity = capacity
+        self._clock = clock
+        self._start = clock()
+        self._current = SpaceSaving(capacity)
+        self._previous = SpaceSaving(capacity)
+
+    def _roll(self, now: float) -> float:
+        """Advance the windows; returns the weight of the previous one."""
+        elapsed = now - self._start
+        if elapsed >= self.window_s:
+            windows = int(elapsed // self.window_s)
+            self._previous = self._current if windows == 1 else SpaceSaving(self.capacity)
+            self._current = SpaceSaving(self.capacity)
+            self._start += windows * self.window_s
+        return 1.0 - (now - self._start) / self.window_s
+
+    def hit(self, key: str) -> float:
+        """Count one post for `key`; returns its guaranteed sliding-window count."""
+        weight = self._roll(self._clock())
+        self._current.add(key)
+        return self._current.guaranteed(key) + weight * self._previous.guaranteed(key)
+
+    def top(self, k: int) -> List[Dict[str, object]]:
+        """The `k` heaviest keys with their estimated count and error bound."""
+        weight = self._roll(self._clock())
+        merged: Dict[str, List[float]] = {}
+        for key, count, error in self._current.items():
+            merged[key] = [count, error]
+        for key, count, error in self._previous.items():
+            entry = merged.setdefault(key, [0, 0])
+            entry[0] += weight * count
+            entry[1] += weight * error
+        ranked = sorted(merged.items(), key=lambda kv: kv[1][0], reverse=True)[:k]
+        return [{"key": key, "count": round(c, 1), "error": round(e, 1)} for key, (c, e) in ranked]
+
+@dataclass(frozen=True)
+class Verdict:
+    dimension: str              # ip | domain | timestamp (signed delivery)
+    key: str
+    count: float
+    retry_after: int
+
+class AbuseGuard:
+    def __init__(self, limits: Mapping[str, int] = LIMITS, *, window_s: float = WINDOW_S,
+                 capacity: int = TRACKED_KEYS, clock: Callable[[], float] = time.monotonic,
+                 exempt: Optional[Mapping[str, Iterable[str]]] = None):
+        self.limits = dict(limits)
+        # counted (and shown in top()) but never refused
+        self.exempt: Dict[str, FrozenSet[str]] = {
+            dim: frozenset(keys) for dim, keys in (exempt if exempt is not None else {"domain": DOMAIN_ALLOWLIST}).items()
+        }
+        self.window_s = window_s
+        self._hitters = {dim: HeavyHitters(window_s, capacity, clock) for dim in self.limits}
+
+    def check(self, dimension: str, key: Optional[str]) -> Optional[Verdict]:
+        """Count a post under `key`; a Verdict when that key is over its limit."""
+        if not key:
+            return None
+        count = self._hitters[dimension].hit(key)
+        limit = self.limits[dimension]
+        if limit > 0 and count > limit and key not in self.exempt.get(dimension, ()):
+            return Verdict(dimension, key, count, math.ceil(self.window_s))
+        return None
+
+    def top(self, k: int = 20) -> Dict[str, List[Dict[str, object]]]:
+        return {dim: hitters.top(k) for dim, hitters in self._hitters.items()}
+
+def client_ip(scope: Mapping) -> str:
+    """The caller's address: the X-Forwarded-For entry left by the outermost trusted proxy."""
+    if TRUSTED_PROXIES > 0:
+        for name, value in scope.get("headers") or ():
+            if name == b"x-forwarded-for":
+                hops = [h.strip() for h in value.decode("latin-1").split(",") if h.strip()]
+                if len(hops) >= TRUSTED_PROXIES:
+                    return hops[-TRUSTED_PROXIES]
+                break
+    client = scope.get("client")
+    return client[0] if client else ""
+
+def delivery_key(timestamp: str, signature: str) -> Optional[str]:
+    """One signed delivery: its timestamp plus a digest of its signature (None if unsigned)."""
+    if not (timestamp and signature):
+        return None
+    return f"{timestamp}:{hashlib.sha256(signature.encode()).hexdigest()[:16]}"
+
+def sender_domain(sender: Optional[str]) -> Optional[str]:
+    return sender.rpartition("@")[2] if sender and "@" in sender else None
+
+_guard: Optional[AbuseGuard] = None
+
+def get_guard() -> AbuseGuard:
+    global _guard
+    if _guard is None:
+        _guard = AbuseGuard()
+    return _guard
@@ -1,22 +1,87 @@
+import asyncio
 import hashlib
 import json
 import logging
 import os
 import re
 import time
-from typing import Any, Callable, Tuple, TypeVar
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
 
-import redis
+import redis.asyncio as aioredis
 import structlog
+from cachetools import Cache, TLRUCache
 
-from .metrics import CACHE_HITS, CACHE_MISSES
+from . import semantic
+from .metrics import CACHE_COALESCED, CACHE_HITS, CACHE_L1_HITS, CACHE_L2_HITS, CACHE_MISSES
 
 logger = structlog.get_logger()
 T = TypeVar('T')  # Generic type for the cached value
 
 _url   = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 _ttl   = int(os.getenv("CACHE_TTL_SECONDS", 604800))  # 7 days
-_redis = redis.Redis.from_url(_url, decode_responses=True)
+_redis = aioredis.Redis.from_url(_url, decode_responses=True)
+
+# single-flight: one computation per digest, everyone else waits for it.
+# The leader renews its lease every third of CACHE_LEASE_MS for as long as it
+# computes (a fallback chain can take several LLM timeouts), so the lease only
+# lapses when the leader dies; followers re-check it every CACHE_SINGLEFLIGHT_WAIT_SECONDS.
+_lease_ms = int(os.getenv("CACHE_LEASE_MS", 10_000))
+_wait_s   = float(os.getenv("CACHE_SINGLEFLIGHT_WAIT_SECONDS", 5))
+_inflight: Dict[str, "asyncio.Future[Any]"] = {}
+
+# delete the lease only if we still own it
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# extend the lease only if we still own it
+_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# L1: per-process copy of hot entries in front of Redis (L2)
+_l1_max_bytes   = int(os.getenv("CACHE_L1_MAX_BYTES", 64 * 1024 * 1024))
+_l1_max_entries = int(os.getenv("CACHE_L1_MAX_ENTRIES", 10_000))
+_INVALIDATE_CHANNEL = "cache:invalidate"
+
+class _L1Cache(TLRUCache):
+    """
+    TLRU cache bounded by total payload bytes *and* entry count.
+
+    Values are (json_string, ttl_seconds) so each entry expires together with
+    its Redis key.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        super().__init__(
+            maxsize=max_bytes,
+            ttu=lambda _key, value, now: now + value[1],
+            getsizeof=lambda value: len(value[0]),
+        )
+        self.max_entries = max_entries
+
+    def __setitem__(self, key, value, cache_setitem=Cache.__setitem__):
+        super().__setitem__(key, value, cache_setitem)
+        while len(self) > self.max_entries:
+            self.popitem()
+
+_l1 = _L1Cache(_l1_max_bytes, _l1_max_entries)
+_listener: "asyncio.Task[None] | None" = None
+
+def _l1_store(key: str, raw: str, ttl: float) -> None:
+    if ttl <= 0:
+        return
+    try:
+        _l1[key] = (raw, ttl)
+    except ValueError:  # single value larger than the whole L1
+        pass
 
 _NORMALISE_RE = re.compile(r"\s+")
 
@@ -30,46 +95,184 @@ def _normalise(prompt: str) -> str:
 def _digest(prompt: str) -> str:
     return hashlib.sha256(_normalise(prompt).encode("utf-8")).hexdigest()
 
-def get_or_set(prompt: str, compute_fn: Callable[[str], T], cache_name: str = "default") -> Tuple[T, bool]:
+async def get_or_set(prompt: str, compute_fn: Callable[[str], Awaitable[T]], cache_name: str = "default") -> Tuple[T, bool]:
     """
     Get a value from cache or compute and cache it if not found.
-    
+
+    Concurrent misses for the same digest are coalesced: one caller computes
+    while the others wait for its result, whether they live in this process
+    or in another worker. A follower only computes itself if the leader
+    fails, or dies and lets its lease lapse.
+
     Args:
         prompt: The input prompt to use as cache key
-        compute_fn: Function to compute the value if not in cache
+        compute_fn: Coroutine function to compute the value if not in cache
         cache_name: Name of the cache for metrics (e.g., 'llm_responses', 'embeddings')
-        
+
     Returns:
-        Tuple of (value, was_cached) where was_cached is True if the value came from cache
+        Tuple of (value, was_cached) where was_cached is True unless this call ran compute_fn
     """
     digest = _digest(prompt)
     key = f"cache:{cache_name}:{digest}"
-    
-    # Try to get from cache
+
+    # Try the in-process L1 first
+    local = _l1.get(key)
+    if local is not None:
+        CACHE_HITS.labels(cache_name=cache_name).inc()
+        CACHE_L1_HITS.labels(cache_name=cache_name).inc()
+        return json.loads(local[0]), True
+
+    # Then Redis; PTTL comes back in the same round trip so L1 expires with it
     start_time = time.time()
-    cached = _redis.get(key)
-    
+    pipe = _redis.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    cached, pttl = await pipe.execute()
+
     if cached is not None:
         # Cache hit
         duration = time.time() - start_time
         CACHE_HITS.labels(cache_name=cache_name).inc()
+        CACHE_L2_HITS.labels(cache_name=cache_name).inc()
         logger.debug(
             "Cache hit",
             cache_name=cache_name,
             key=digest[:12],
             duration_seconds=duration
         )
+        _l1_store(key, cached, pttl / 1000 if pttl and pttl > 0 else _ttl)
         return json.loads(cached), True
-    
+
+    # Near-duplicate of something already cached?
+    if semantic.ENABLED:
+        raw = await _semantic_lookup(prompt, digest, cache_name)
+        if raw is not None:
+            CACHE_HITS.labels(cache_name=cache_name).inc()
+            return json.loads(raw), True
+
     # Cache miss - compute and store
     logger.debug("Cache miss", cache_name=cache_name, key=digest[:12])
     CACHE_MISSES.labels(cache_name=cache_name).inc()
-    
-    reply = compute_fn(prompt)
-    
+
+    # Someone in this process is already computing it
+    pending = _inflight.get(key)
+    if pending is not None:
+        # the leader is in this process, so it always settles the future
+        await asyncio.wait({pending})
+        if not pending.cancelled() and pending.exception() is None:
+            CACHE_COALESCED.labels(cache_name=cache_name, scope="process").inc()
+            return pending.result(), True
+        # the leader failed or was cancelled; try for ourselves
+        return await _compute_and_store(prompt, compute_fn, key, digest, cache_name), False
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value, was_cached = await _single_flight(prompt, compute_fn, key, digest, cache_name)
+        future.set_result(value)
+        return value, was_cached
+    except BaseException as e:
+        if isinstance(e, Exception):
+            future.set_exception(e)
+            future.exception()  # followers compute themselves; don't log as unretrieved
+        else:
+            future.cancel()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+async def _semantic_lookup(prompt: str, digest: str, cache_name: str) -> "str | None":
+    match = semantic.lookup(cache_name, digest, _normalise(prompt))
+    if match is None:
+        return None
+    key = f"cache:{cache_name}:{match}"
+    local = _l1.get(key)
+    raw = local[0] if local is not None else await _redis.get(key)
+    if raw is None:  # reply expired before its index row
+        semantic.forget(cache_name, match)
+        return None
+    semantic.served(cache_name, digest, match)
+    logger.debug("Semantic cache hit", cache_name=cache_name, key=digest[:12], match=match[:12])
+    return raw
+
+async def _single_flight(prompt: str, compute_fn: Callable[[str], Awaitable[T]], key: str, digest: str, cache_name: str) -> Tuple[T, bool]:
+    """Compute under a cross-worker lease, or wait for the worker holding it."""
+    lease = f"{key}:lease"
+    token = uuid.uuid4().hex
+    try:
+        leader = await _redis.set(lease, token, nx=True, px=_lease_ms)
+    except Exception as e:
+        logger.error("Failed to take cache lease", cache_name=cache_name, key=digest[:12], error=str(e))
+        leader = True
+
+    if not leader:
+        value = await _wait_for_leader(key)
+        if value is not None:
+            CACHE_COALESCED.labels(cache_name=cache_name, scope="cluster").inc()
+            return value, True
+        logger.warning("Cache lease lapsed before a value was stored", cache_name=cache_name, key=digest[:12])
+        return await _compute_and_store(prompt, compute_fn, key, digest, cache_name), False
+
+    renewer = asyncio.get_running_loop().create_task(_renew_lease(lease, token))
+    try:
+        return await _compute_and_store(prompt, compute_fn, key, digest, cache_name), False
+    finally:
+        renewer.cancel()
+        try:
+            await _redis.eval(_RELEASE_LUA, 1, lease, token)
+            await _redis.publish(f"{key}:ready", "1")
+        except Exception as e:
+            logger.error("Failed to release cache lease", cache_name=cache_name, key=digest[:12], error=str(e))
+
+async def _renew_lease(lease: str, token: str) -> None:
+    """Keep extending our lease while the computation runs; cancelled when it ends."""
+    while True:
+        await asyncio.sleep(_lease_ms / 3000)
+        try:
+            if not await _redis.eval(_RENEW_LUA, 1, lease, token, _lease_ms):
+                return      # lost it (expired or taken over); nothing left to renew
+        except Exception as e:
+            logger.error("Failed to renew cache lease", lease=lease, error=str(e))
+
+async def _wait_for_leader(key: str) -> Any:
+    """Block until the lease holder publishes `key`; None once its lease lapses or on failure."""
+    pubsub = _redis.pubsub()
+    try:
+        await pubsub.subscribe(f"{key}:ready")
+        deadline = time.monotonic() + _wait_s
+        while True:
+            # re-check after subscribing so a publish we missed is not waited on
+            cached = await _redis.get(key)
+            if cached is not None:
+                _l1_store(key, cached, _ttl)
+                return json.loads(cached)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # a live leader keeps renewing its lease; only give up once it's gone
+                if not await _redis.exists(f"{key}:lease"):
+                    return None
+                deadline = time.monotonic() + _wait_s
+                continue
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                cached = await _redis.get(key)
+                if cached is None:
+                    return None
+                _l1_store(key, cached, _ttl)
+                return json.loads(cached)
+    finally:
+        await pubsub.aclose()
+
+async def _compute_and_store(prompt: str, compute_fn: Callable[[str], Awaitable[T]], key: str, digest: str, cache_name: str) -> T:
+    reply = await compute_fn(prompt)
+
     # Store in cache
+    raw = json.dumps(reply)
+    _l1_store(key, raw, _ttl)
     try:
-        _redis.setex(key, _ttl, json.dumps(reply))
+        await _redis.setex(key, _ttl, raw)
+        if semantic.ENABLED:
+            await semantic.remember(_redis, cache_name, digest, _normalise(prompt), _ttl)
     except Exception as e:
         logger.error(
             "Failed to store in cache",
@@ -77,8 +280,48 @@ def get_or_set(prompt: str, compute_fn: Callable[[str], T], cache_name: str = "d
             key=digest[:12],
             error=str(e)
         )
-    
-    return reply, False
-def get_redis() -> "redis.Redis":
+
+    return reply
+
+async def invalidate(prompt: str, cache_name: str = "default") -> None:
+    """
+    Drop a cached value from Redis and from every worker's L1.
+
+    If the value was a semantic (near-duplicate) answer, it is also counted
+    as a false positive and the prompt stops using the semantic layer.
+    """
+    digest = _digest(prompt)
+    key = f"cache:{cache_name}:{digest}"
+    semantic.report_false_positive(digest)
+    _l1.pop(key, None)
+    await _redis.delete(key)
+    await _redis.publish(_INVALIDATE_CHANNEL, key)
+
+async def _listen_invalidations() -> None:
+    while True:
+        pubsub = _redis.pubsub()
+        try:
+            await pubsub.subscribe(_INVALIDATE_CHANNEL)
+            # anything published while we were not subscribed is lost
+            _l1.clear()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _l1.pop(message["data"], None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Cache invalidation listener failed", error=str(e))
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+def start_invalidation_listener() -> "asyncio.Task[None]":
+    """Start (once per event loop) the task that applies peer invalidations to L1."""
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.get_running_loop().create_task(_listen_invalidations())
+    return _listener
+
+def get_redis() -> "aioredis.Redis":
     from emaillm.core.cache import _redis
     return _redis
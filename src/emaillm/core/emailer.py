@@ -1,37 +1,165 @@
 """
 Very small SendGrid wrapper for EMAILLM MVP.
 Requires SENDGRID_API_KEY in environment or .env.
+
+Replies go out over one pooled keep-alive client per worker process
+(`emaillm.core.http`), so the TLS handshake is paid once, not per message.
+
+With SENDGRID_COALESCE_WINDOW_MS > 0, sends with an identical subject and
+body are held for that window (or until SENDGRID_COALESCE_MAX recipients)
+and go out as one /v3/mail/send call with a personalization per recipient;
+every caller still gets its own result.
 """
 
-import os, json, logging, http.client
-from typing import Final
+import asyncio, os, json, logging, time
+from dataclasses import dataclass, field
+from typing import Dict, Final, List, Optional, Sequence, Set, Tuple
+
+from emaillm.core import http
+from emaillm.core.metrics import EMAILS_SENT, EMAIL_BATCH_SIZE, EMAIL_SEND_DURATION
 
 # Use a dummy key during testing
 import sys
 SENDGRID_KEY: Final[str] = (
-    os.getenv("SENDGRID_API_KEY") or 
-    os.getenv("SENDGRID_SIGNING_KEY") or 
+    os.getenv("SENDGRID_API_KEY") or
+    os.getenv("SENDGRID_SIGNING_KEY") or
     ("dummy_key" if "pytest" in sys.modules else None)
 )
 if not SENDGRID_KEY and not "pytest" in sys.modules:
     raise RuntimeError("No SendGrid key configured (neither SENDGRID_API_KEY nor SENDGRID_SIGNING_KEY found in environment)")
 
-def send_email(*, to_addr: str, subject: str, body_text: str) -> None:
+SENDGRID_BASE_URL = os.getenv("SENDGRID_BASE_URL", "https://api.sendgrid.com")
+SENDGRID_TIMEOUT  = float(os.getenv("SENDGRID_TIMEOUT_SECONDS", 10))
+# in-flight sends per worker process; also the size of the keep-alive pool
+SENDGRID_MAX_CONCURRENCY = int(os.getenv("SENDGRID_MAX_CONCURRENCY", 10))
+SENDGRID_HTTP2    = os.getenv("SENDGRID_HTTP2", "false").lower() == "true"   # needs the `h2` extra
+FROM_ADDR         = os.getenv("EMAIL_FROM_ADDR", "noreply@emaillm.com")
+COALESCE_WINDOW_MS = float(os.getenv("SENDGRID_COALESCE_WINDOW_MS", 0))   # 0 = one call per reply
+# SendGrid accepts at most 1000 personalizations per request
+COALESCE_MAX      = min(int(os.getenv("SENDGRID_COALESCE_MAX", 1000)), 1000)
+
+_slots: Optional[asyncio.Semaphore] = None
 
-    payload = {
-        "personalizations": [{"to": [{"email": to_addr}]}],
-        "from": {"email": "noreply@emaillm.com"},
+def _limit() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(SENDGRID_MAX_CONCURRENCY)
+    return _slots
+
+def _client():
+    return http.get_client(
+        "sendgrid",
+        base_url=SENDGRID_BASE_URL,
+        timeout=SENDGRID_TIMEOUT,
+        max_connections=SENDGRID_MAX_CONCURRENCY,
+        headers={"Authorization": f"Bearer {SENDGRID_KEY}"},
+        http2=SENDGRID_HTTP2,
+    )
+
+class SendGridError(RuntimeError):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(f"SendGrid {status_code} {reason}")
+        self.status_code = status_code
+
+def build_payload(recipients: Sequence[str], subject: str, body_text: str, body_html: Optional[str] = None,
+                  from_addr: Optional[str] = None) -> dict:
+    content = [{"type": "text/plain", "value": body_text}]
+    if body_html:
+        content.append({"type": "text/html", "value": body_html})
+    return {
+        # one personalization each, so recipients never see one another
+        "personalizations": [{"to": [{"email": addr}]} for addr in recipients],
+        "from": {"email": from_addr or FROM_ADDR},
         "subject": subject,
-        "content": [{"type": "text/plain", "value": body_text}],
-    }
-    conn = http.client.HTTPSConnection("api.sendgrid.com", 443, timeout=10)
-    headers = {
-        "Authorization": f"Bearer {SENDGRID_API_KEY}",
-        "Content-Type": "application/json",
+        "content": content,
     }
-    conn.request("POST", "/v3/mail/send", body=json.dumps(payload), headers=headers)
-    resp = conn.getresponse()
-    if resp.status >= 400:
-        logging.getLogger("emaillm").error("SendGrid error %s %s", resp.status, resp.reason)
-        raise RuntimeError(f"SendGrid {resp.status} {resp.reason}")
-    logging.getLogger("emaillm").info("SendGrid accepted email to %s", to_addr)
+
+async def _post(recipients: Sequence[str], subject: str, body_text: str, body_html: Optional[str],
+                from_addr: Optional[str] = None) -> None:
+    payload = build_payload(recipients, subject, body_text, body_html, from_addr)
+    logger = logging.getLogger("emaillm")
+    EMAIL_BATCH_SIZE.observe(len(recipients))
+    start = time.perf_counter()
+    try:
+        async with _limit():
+            resp = await _client().post(
+                "/v3/mail/send",
+                content=json.dumps(payload),
+                headers={"Content-Type": "application/json"},
+            )
+    except Exception:
+        EMAILS_SENT.labels(status="error").inc(len(recipients))
+        raise
+    finally:
+        EMAIL_SEND_DURATION.observe(time.perf_counter() - start)
+    if resp.status_code >= 400:
+        EMAILS_SENT.labels(status="error").inc(len(recipients))
+        logger.error("SendGrid error %s %s", resp.status_code, resp.reason_phrase)
+        raise SendGridError(resp.status_code, resp.reason_phrase)
+    EMAILS_SENT.labels(status="success").inc(len(recipients))
+    logger.info("SendGrid accepted email to %s", recipients[0] if len(recipients) == 1 else f"{len(recipients)} recipients")
+
+_BatchKey = Tuple[str, str, str, str]     # subject, text, html, from
+
+@dataclass
+class _Batch:
+    recipients: List[str] = field(default_factory=list)
+    waiters: "List[asyncio.Future[None]]" = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+_pending: Dict[_BatchKey, _Batch] = {}
+_flushing: "Set[asyncio.Task[None]]" = set()
+
+async def _send_batch(key: _BatchKey, batch: _Batch) -> None:
+    subject, body_text, body_html, from_addr = key
+    try:
+        await _post(batch.recipients, subject, body_text, body_html or None, from_addr or None)
+        results: List[Optional[BaseException]] = [None] * len(batch.recipients)
+    except SendGridError as e:
+        if e.status_code != 400 or len(batch.recipients) == 1:
+            results = [e] * len(batch.recipients)
+        else:
+            # one bad address rejects the whole request – find out who it was
+            results = await asyncio.gather(
+                *(_post([addr], subject, body_text, body_html or None, from_addr or None) for addr in batch.recipients),
+                return_exceptions=True,
+            )
+    except Exception as e:
+        results = [e] * len(batch.recipients)
+    for waiter, result in zip(batch.waiters, results):
+        if waiter.done():
+            continue
+        if isinstance(result, BaseException):
+            waiter.set_exception(result)
+        else:
+            waiter.set_result(None)
+
+def _flush(key: _BatchKey) -> None:
+    batch = _pending.pop(key, None)
+    if batch is None:
+        return
+    if batch.timer is not None:
+        batch.timer.cancel()
+    task = asyncio.get_running_loop().create_task(_send_batch(key, batch))
+    _flushing.add(task)
+    task.add_done_callback(_flushing.discard)
+
+async def send_email(*, to_addr: str, subject: str, body_text: str, body_html: Optional[str] = None,
+                     from_addr: Optional[str] = None) -> None:
+    """Send one message; `from_addr` defaults to EMAIL_FROM_ADDR."""
+    if COALESCE_WINDOW_MS <= 0:
+        await _post([to_addr], subject, body_text, body_html, from_addr)
+        return
+
+    loop = asyncio.get_running_loop()
+    key = (subject, body_text, body_html or "", from_addr or "")
+    batch = _pending.get(key)
+    if batch is None:
+        batch = _pending[key] = _Batch()
+        batch.timer = loop.call_later(COALESCE_WINDOW_MS / 1000, _flush, key)
+    waiter = loop.create_future()
+    batch.recipients.append(to_addr)
+    batch.waiters.append(waiter)
+    if len(batch.recipients) >= COALESCE_MAX:
+        _flush(key)
+    await waiter
@@ -0,0 +1,332 @@
+"""
+Single parsing stage for `/webhook/inbound`.
+
+The request body is read and decoded once into an immutable
+`InboundEnvelope`, kept on `request.state`, and shared by QuotaMiddleware,
+routing and the LLM stage. Raw MIME, SendGrid form-data (parsed fields or
+raw `email`), urlencoded and JSON posts all end up in the same shape.
+
+With INBOUND_STREAMING=true, raw MIME and form-data bodies are parsed
+chunk by chunk as they arrive (see `mime_stream`): only text parts stay in
+memory, attachments are spooled to temp files and the body is rejected with
+413 as soon as it passes INBOUND_MAX_BYTES.
+"""
+
+import base64
+import email.message
+import email.utils
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import urllib.parse
+from dataclasses import dataclass
+from email import policy
+from email.message import Message
+from email.parser import BytesHeaderParser, BytesParser, HeaderParser
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+
+from emaillm.core import mime_stream
+
+logger = logging.getLogger("emaillm")
+
+STREAMING = os.getenv("INBOUND_STREAMING", "false").lower() == "true"
+MAX_BYTES = int(os.getenv("INBOUND_MAX_BYTES", 30 * 1024 * 1024))
+PEEK_BYTES = 64 * 1024
+
+# the value of a form-data field, e.g. name="from"
+_FORM_FIELD_RE = r'content-disposition:[^\r\n]*\bname="{}"[^\r\n]*\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)'
+_FORM_FROM_RE = re.compile(_FORM_FIELD_RE.format("from").encode(), re.IGNORECASE)
+_FORM_ENVELOPE_RE = re.compile(_FORM_FIELD_RE.format("envelope").encode(), re.IGNORECASE)
+
+@dataclass(frozen=True)
+class Attachment:
+    filename: str
+    content_type: str
+    size: int
+    path: Optional[str] = None   # spooled copy (streaming mode only)
+
+@dataclass(frozen=True)
+class InboundEnvelope:
+    from_addr: str            # bare address, "Name <a@b>" already stripped
+    to_addr: str
+    subject: str = ""
+    text: str = ""
+    html: str = ""
+    message_id: str = ""
+    attachments: Tuple[Attachment, ...] = ()
+
+    @property
+    def sender(self) -> str:
+        """Lower-cased sender address used as the quota / plan key."""
+        return self.from_addr.lower()
+
+    def as_payload(self) -> Dict[str, str]:
+        """The subject/text mapping `call_llm` expects."""
+        return {"subject": self.subject, "text": self.text}
+
+    def discard(self) -> None:
+        """Delete spooled attachment files; safe to call more than once."""
+        mime_stream.discard([(a.filename, a.content_type, a.size, a.path) for a in self.attachments if a.path])
+
+    def to_job(self) -> Dict[str, str]:
+        """Compact form queued for the worker (no html, no attachments)."""
+        return {
+            "from": self.from_addr,
+            "to": self.to_addr,
+            "subject": self.subject,
+            "text": self.text,
+            "message_id": self.message_id,
+        }
+
+    @classmethod
+    def from_job(cls, job: Mapping[str, Any]) -> "InboundEnvelope":
+        return cls(
+            from_addr=job["from"],
+            to_addr=job["to"],
+            subject=job.get("subject", ""),
+            text=job.get("text", ""),
+            message_id=job.get("message_id", ""),
+        )
+
+def _addr(value: Any) -> str:
+    value = str(value or "")
+    return email.utils.parseaddr(value)[1] or value
+
+def _decode_part(part: Message) -> str:
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:  # unknown charset
+        return payload.decode("utf-8", errors="replace")
+
+def envelope_from_message(msg: Message) -> InboundEnvelope:
+    """Build an envelope from a parsed RFC 822 message."""
+    text = html = ""
+    attachments: List[Attachment] = []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        ctype = part.get_content_type()
+        filename = part.get_filename()
+        if filename or part.get_content_disposition() == "attachment":
+            attachments.append(Attachment(filename or "", ctype, len(part.get_payload(decode=True) or b"")))
+        elif ctype == "text/html":
+            html = html or _decode_part(part)
+        elif ctype == "text/plain" or not msg.is_multipart():
+            text = text or _decode_part(part)
+    return InboundEnvelope(
+        from_addr=_addr(msg.get("from", "")),
+        to_addr=_addr(msg.get("to", "")),
+        subject=str(msg.get("subject", "") or ""),
+        text=text,
+        html=html,
+        message_id=str(msg.get("message-id", "") or "").strip(),
+        attachments=tuple(attachments),
+    )
+
+def parse_mime(raw: bytes) -> InboundEnvelope:
+    return envelope_from_message(BytesParser(policy=policy.default).parsebytes(raw))
+
+def _message_id_from_headers(headers: str) -> str:
+    if not headers:
+        return ""
+    return str(HeaderParser().parsestr(headers).get("message-id", "") or "").strip()
+
+def envelope_from_fields(fields: Mapping[str, Any], attachments: Tuple[Attachment, ...] = ()) -> InboundEnvelope:
+    """Build an envelope from already-decoded fields (SendGrid parsed form or JSON)."""
+    def field(name: str) -> str:
+        value = fields.get(name, "")
+        if isinstance(value, (bytes, bytearray)):
+            return value.decode(errors="replace")
+        return "" if value is None else str(value)
+
+    return InboundEnvelope(
+        from_addr=_addr(field("from")),
+        to_addr=_addr(field("to")),
+        subject=field("subject"),
+        text=field("text"),
+        html=field("html"),
+        message_id=field("message_id") or field("message-id") or _message_id_from_headers(field("headers")),
+        attachments=attachments,
+    )
+
+async def _from_form(request: Request) -> InboundEnvelope:
+    form = await request.form()
+    raw = form.get("email")
+    if isinstance(raw, UploadFile):
+        return parse_mime(await raw.read())
+    if isinstance(raw, str) and raw:
+        return parse_mime(raw.encode())
+
+    fields: Dict[str, Any] = {}
+    attachments: List[Attachment] = []
+    for k, v in form.multi_items():
+        if isinstance(v, UploadFile):
+            attachments.append(Attachment(v.filename or k, v.content_type or "", v.size or 0))
+        else:
+            fields.setdefault(k.lower(), v)
+    if not fields:
+        raise HTTPException(status_code=422, detail="No recognised e-mail fields in form-data")
+    return envelope_from_fields(fields, tuple(attachments))
+
+async def parse_inbound(request: Request) -> InboundEnvelope:
+    """Read the request body once and decode it according to its content type."""
+    content_type = request.headers.get("content-type", "").lower()
+    body = await request.body()
+
+    try:
+        if "message/rfc822" in content_type:
+            return parse_mime(body)
+        if "multipart/form-data" in content_type or "application/x-www-form-urlencoded" in content_type:
+            return await _from_form(request)
+        if "application/json" in content_type:
+            payload = json.loads(body.decode() or "{}")
+            if not isinstance(payload, dict):
+                raise HTTPException(status_code=422, detail="Invalid JSON data")
+            return envelope_from_fields(payload)
+    except HTTPException:
+        raise
+    except json.JSONDecodeError as e:
+        logger.error("Error parsing JSON: %s", str(e))
+        raise HTTPException(status_code=422, detail="Invalid JSON data")
+    except Exception as e:
+        logger.error("Error parsing %s body: %s", content_type, str(e), exc_info=True)
+        raise HTTPException(status_code=422, detail=f"Error processing {content_type or 'request'} body: {e}")
+
+    # Unknown content type: last try as a raw message
+    try:
+        return parse_mime(body)
+    except Exception as e:
+        logger.error("Unsupported content type %s: %s", content_type, e)
+        raise HTTPException(status_code=400, detail=f"Unsupported content type: {content_type}")
+
+def sniff_sender(content_type: str, body: bytes) -> Optional[str]:
+    """
+    Sender address read straight off the raw body – the form's `from` (or
+    SendGrid's `envelope`) field, or the From header of a raw message –
+    without decoding the form or the MIME tree. None when it is not found
+    in the first PEEK_BYTES.
+    """
+    head = body[:PEEK_BYTES]
+    value: Any = None
+    if "multipart/form-data" in content_type:
+        match = _FORM_FROM_RE.search(head)
+        if match:
+            value = match.group(1).decode("utf-8", errors="replace")
+        else:
+            match = _FORM_ENVELOPE_RE.search(head)
+            try:
+                value = json.loads(match.group(1)).get("from") if match else None
+            except (ValueError, AttributeError):
+                value = None
+    elif "application/x-www-form-urlencoded" in content_type:
+        value = urllib.parse.parse_qs(head.decode("latin-1")).get("from", [None])[0]
+    elif "message/rfc822" in content_type:
+        end = head.find(b"\r\n\r\n")
+        if end < 0:
+            end = head.find(b"\n\n")
+        if end >= 0:
+            value = BytesHeaderParser().parsebytes(head[:end]).get("from")
+    sender = _addr(value).lower() if value else ""
+    return sender if "@" in sender else None
+
+def _body_mac(request: Request) -> "Optional[hmac.HMAC]":
+    """HMAC over timestamp + body, fed chunk by chunk while streaming."""
+    key = os.getenv("SENDGRID_SIGNING_KEY", "")
+    timestamp = request.headers.get("X-Twilio-Email-Event-Webhook-Timestamp")
+    if not (key and timestamp):
+        return None
+    try:
+        return hmac.new(base64.b64decode(key), timestamp.encode(), hashlib.sha256)
+    except Exception:
+        return None
+
+def _from_small_body(content_type: str, body: bytes) -> InboundEnvelope:
+    if "application/json" in content_type:
+        payload = json.loads(body.decode() or "{}")
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=422, detail="Invalid JSON data")
+        return envelope_from_fields(payload)
+    fields = dict(urllib.parse.parse_qsl(body.decode("latin-1")))
+    if fields.get("email"):
+        return parse_mime(fields["email"].encode())
+    return envelope_from_fields({k.lower(): v for k, v in fields.items()})
+
+async def parse_inbound_streaming(request: Request) -> InboundEnvelope:
+    """Parse the body as it arrives, never holding more than the text parts in memory."""
+    content_type = request.headers.get("content-type", "").lower()
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Inbound message too large")
+
+    small = "application/json" in content_type or "application/x-www-form-urlencoded" in content_type
+    if small:
+        collector = None
+        buf = bytearray()
+    elif "multipart/form-data" in content_type:
+        boundary = email.message.Message()
+        boundary["content-type"] = request.headers.get("content-type", "")
+        if not boundary.get_boundary():
+            raise HTTPException(status_code=422, detail="Missing boundary in multipart")
+        collector = mime_stream.FormCollector(boundary.get_boundary())
+    else:
+        collector = mime_stream.MimeCollector()
+
+    mac = _body_mac(request)
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Inbound message too large")
+            if mac is not None:
+                mac.update(chunk)
+            if collector is None:
+                buf += chunk
+            else:
+                collector.write(chunk)
+        if collector is None:
+            envelope = _from_small_body(content_type, bytes(buf))
+        else:
+            collector.close()
+            fields = collector.fields()
+            attachments = tuple(Attachment(*part) for part in collector.spooled)
+            envelope = envelope_from_fields(fields, attachments)
+    except HTTPException:
+        if collector is not None:
+            mime_stream.discard(collector.spooled)
+        raise
+    except Exception as e:
+        if collector is not None:
+            mime_stream.discard(collector.spooled)
+        logger.error("Error streaming %s body: %s", content_type, str(e), exc_info=True)
+        raise HTTPException(status_code=422, detail=f"Error processing {content_type or 'request'} body: {e}")
+
+    request.state.body_signature = base64.b64encode(mac.digest()).decode() if mac is not None else None
+    logger.info("Streamed inbound body: %d bytes, %d spooled attachments", received, len(envelope.attachments))
+    return envelope
+
+async def get_envelope(request: Request) -> InboundEnvelope:
+    """
+    Parsed envelope for this request, parsing it on first use. A parse error
+    is kept and raised again to later callers: in streaming mode the body is
+    gone by then, and parsing the leftovers would report the wrong error.
+    """
+    envelope: Optional[InboundEnvelope] = getattr(request.state, "envelope", None)
+    if envelope is None:
+        error: Optional[HTTPException] = getattr(request.state, "envelope_error", None)
+        if error is not None:
+            raise error
+        try:
+            envelope = await (parse_inbound_streaming(request) if STREAMING else parse_inbound(request))
+        except HTTPException as e:
+            request.state.envelope_error = e
+            raise
+        request.state.envelope = envelope
+    return envelope
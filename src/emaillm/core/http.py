@@ -0,0 +1,43 @@
+"""
+Process-wide pooled HTTP clients.
+
+One keep-alive `httpx.AsyncClient` per upstream, created on first use and
+shared by every request in the worker so TLS sessions are reused.
+"""
+
+from typing import Dict, Optional
+
+import httpx
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_client(
+    name: str,
+    *,
+    base_url: str,
+    timeout: float = 20.0,
+    max_connections: int = 20,
+    headers: Optional[Dict[str, str]] = None,
+    http2: bool = False,
+) -> httpx.AsyncClient:
+    """Return the shared client registered under `name`, creating it if needed."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            http2=http2,
+        )
+        _clients[name] = client
+    return client
+
+async def aclose_all() -> None:
+    """Close every pooled client (FastAPI shutdown / worker exit)."""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
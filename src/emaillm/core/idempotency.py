@@ -0,0 +1,113 @@
+"""
+Idempotent inbound processing keyed on Message-ID.
+
+SendGrid re-posts a webhook whenever our response is slow or fails. The first
+delivery claims a Redis marker (SET NX) and records how it ended; retries of
+the same message return that outcome instead of calling the LLM and mailing
+the user again. Messages without a Message-ID are keyed on a digest of
+sender, subject and body.
+
+Marker states:
+    in_progress – short TTL so a crashed handler does not block retries forever;
+                  retries get a 409 meanwhile, so SendGrid keeps retrying
+    done        – holds the original response, kept for IDEMPOTENCY_TTL_SECONDS
+    failed      – the next retry takes the marker over and processes again
+"""
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import redis.asyncio as aioredis
+import structlog
+from starlette.responses import JSONResponse
+
+from .envelope import InboundEnvelope
+from .metrics import INBOUND_DUPLICATES
+
+logger = structlog.get_logger()
+
+_url     = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+TTL      = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 3 * 24 * 3600))
+LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 120))
+
+IN_PROGRESS, DONE, FAILED = "in_progress", "done", "failed"
+
+_redis = aioredis.Redis.from_url(_url, decode_responses=True)
+
+# replace the marker only if it still holds the failed record we read
+_TAKEOVER_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+@dataclass(frozen=True)
+class Claim:
+    owned: bool                       # True: caller must process and then complete()/fail()
+    state: str = IN_PROGRESS
+    outcome: Dict[str, Any] = field(default_factory=dict)
+
+def key_for(envelope: InboundEnvelope) -> str:
+    message_id = envelope.message_id.strip().strip("<>").lower()
+    if message_id:
+        basis = f"mid:{message_id}"
+    else:
+        raw = "\0".join((envelope.sender, envelope.subject, envelope.text))
+        basis = "sha:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"idem:inbound:{basis}"
+
+def replay_response(claim: Claim) -> JSONResponse:
+    """
+    Response for a retried delivery: the original one, or 409 while the first
+    is still running. Any 2xx would tell SendGrid the message was delivered,
+    and it would be lost if the first handler then died.
+    """
+    if claim.state == DONE and claim.outcome:
+        return JSONResponse(claim.outcome.get("body", {}), status_code=claim.outcome.get("status_code", 200))
+    return JSONResponse({"status": IN_PROGRESS}, status_code=409, headers={"Retry-After": str(LOCK_TTL)})
+
+def _record(state: str, **extra: Any) -> str:
+    return json.dumps({"state": state, "at": int(time.time()), **extra})
+
+async def claim(key: str) -> Claim:
+    """Take the marker for `key`, or report what the first delivery did with it."""
+    if await _redis.set(key, _record(IN_PROGRESS), nx=True, ex=LOCK_TTL):
+        return Claim(owned=True)
+
+    raw = await _redis.get(key)
+    if raw is None:                                  # expired between SET and GET
+        return await claim(key)
+    record = json.loads(raw)
+    if record.get("state") == FAILED:
+        if await _redis.eval(_TAKEOVER_LUA, 1, key, raw, _record(IN_PROGRESS), LOCK_TTL):
+            logger.info("Retrying failed inbound message", key=key)
+            return Claim(owned=True)
+        return await claim(key)
+
+    INBOUND_DUPLICATES.labels(state=record.get("state", "unknown")).inc()
+    logger.info("Duplicate inbound message", key=key, state=record.get("state"))
+    return Claim(owned=False, state=record.get("state", IN_PROGRESS), outcome=record.get("outcome") or {})
+
+async def _store(key: str, record: str) -> None:
+    # best effort: the work is already done, a lost marker only costs a repeat
+    try:
+        await _redis.set(key, record, ex=TTL)
+    except Exception as e:
+        logger.error("Failed to record idempotency marker", key=key, error=str(e))
+
+async def complete(key: str, outcome: Dict[str, Any]) -> None:
+    """Record the response of a successful delivery for replay to retries."""
+    await _store(key, _record(DONE, outcome=outcome))
+
+async def fail(key: str, error: str) -> None:
+    """Mark the delivery failed so the next retry processes it again."""
+    await _store(key, _record(FAILED, error=error[:500]))
+
+def get_redis() -> "aioredis.Redis":
+    return _redis
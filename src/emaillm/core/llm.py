@@ -6,18 +6,11 @@ from prometheus_client import Histogram
 
 from emaillm.core.cache import get_or_set
 from emaillm.core.metrics import LLM_REQUESTS, LLM_TOKENS, LLM_REQUEST_DURATION
-from emaillm.core.providers import GPT41
+from emaillm.core import registry, scheduler
 
 logger = structlog.get_logger()
 
-# Map routing strings to provider instances
-PROVIDERS = {
-    "GPT-4-class": GPT41(),
-    "GPT-4.1":     GPT41(),
-    "GPT-4 Turbo": GPT41(),   # legacy router string
-}
-
-def call_llm(model: str, payload: dict, user_id: Optional[str] = None) -> str:
+async def call_llm(model: str, payload: dict, user_id: Optional[str] = None, plan: Optional[str] = None) -> str:
     """
     Call the LLM with the given payload and return the response.
     
@@ -25,22 +18,24 @@ def call_llm(model: str, payload: dict, user_id: Optional[str] = None) -> str:
         model: The model to use (e.g., 'GPT-4.1')
         payload: Dictionary containing the prompt and other parameters
         user_id: Optional user ID for tracking and rate limiting
+        plan: The sender's pricing plan; upstream calls queue for a slot by plan tier
         
     Returns:
         The generated text response from the LLM
     """
     prompt = payload.get("text") or payload.get("subject", "")
-    provider = PROVIDERS.get(model) or PROVIDERS["GPT-4.1"]
-    
     # Track request start time for duration metrics
     start_time = time.time()
     
     try:
-        def _call(_):  # compute_fn arg ignored
-            return provider.chat(prompt)
+        async def _call(_):  # compute_fn arg ignored
+            # only real upstream calls wait for a slot; cache hits skip the queue
+            async with scheduler.slot(plan):
+                # the model's fallback chain, skipping tripped providers
+                return await registry.complete(model, prompt)
         
         # Get or set from cache
-        reply, was_cached = get_or_set(
+        reply, was_cached = await get_or_set(
             prompt=prompt,
             compute_fn=_call,
             cache_name=f"llm_{model.lower().replace(' ', '_')}"
@@ -14,6 +14,122 @@ CACHE_MISSES = Counter(
     ['cache_name']
 )
 
+CACHE_L1_HITS = Counter(
+    'emaillm_cache_l1_hit_total',
+    'Cache hits served from the in-process L1',
+    ['cache_name']
+)
+
+CACHE_L2_HITS = Counter(
+    'emaillm_cache_l2_hit_total',
+    'Cache hits served from Redis',
+    ['cache_name']
+)
+
+CACHE_COALESCED = Counter(
+    'emaillm_cache_coalesced_total',
+    'Cache misses served by another caller\'s in-flight computation',
+    ['cache_name', 'scope']  # scope: process|cluster
+)
+
+SEMANTIC_HITS = Counter(
+    'emaillm_cache_semantic_hit_total',
+    'Cache misses answered by a near-duplicate prompt',
+    ['cache_name']
+)
+
+SEMANTIC_FALSE_POSITIVES = Counter(
+    'emaillm_cache_semantic_false_positive_total',
+    'Semantic cache answers later reported as wrong',
+    ['cache_name']
+)
+
+SEMANTIC_INDEX_SIZE = Gauge(
+    'emaillm_cache_semantic_index_entries',
+    'Prompts held in the in-memory semantic index',
+    ['cache_name'],
+    multiprocess_mode='livesum'
+)
+
+# Inbound metrics
+INBOUND_DUPLICATES = Counter(
+    'emaillm_inbound_duplicates_total',
+    'Webhook deliveries answered from an earlier delivery of the same message',
+    ['state']  # state: in_progress|done
+)
+
+ABUSE_REJECTED = Counter(
+    'emaillm_abuse_rejected_total',
+    'Inbound posts refused by the pre-parse abuse guard',
+    ['dimension']  # dimension: ip|domain|timestamp
+)
+
+# Provider metrics
+PROVIDER_REQUESTS = Counter(
+    'emaillm_provider_requests_total',
+    'LLM provider calls by outcome',
+    ['provider', 'outcome']  # outcome: success|error|skipped|ratelimited
+)
+
+PROVIDER_LATENCY = Histogram(
+    'emaillm_provider_latency_seconds',
+    'LLM provider call latency in seconds',
+    ['provider'],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+)
+
+PROVIDER_CIRCUIT_STATE = Gauge(
+    'emaillm_provider_circuit_state',
+    'Provider circuit breaker state (0 closed, 1 half-open, 2 open)',
+    ['provider'],
+    multiprocess_mode='livemax'
+)
+
+PROVIDER_FALLBACKS = Counter(
+    'emaillm_provider_fallbacks_total',
+    'Requests answered by a provider other than the first in the chain',
+    ['model', 'provider']
+)
+
+RATELIMIT_HEADROOM = Gauge(
+    'emaillm_provider_ratelimit_headroom',
+    'Budget left in the shared provider rate-limit bucket',
+    ['provider', 'budget'],  # budget: requests|tokens
+    multiprocess_mode='livemin'
+)
+
+RATELIMIT_WAITS = Counter(
+    'emaillm_provider_ratelimit_waits_total',
+    'LLM calls delayed or refused by the provider rate limiter',
+    ['provider', 'outcome']  # outcome: waited|timeout
+)
+
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    'emaillm_scheduler_queue_depth',
+    'LLM calls waiting for a scheduler slot',
+    ['tier'],
+    multiprocess_mode='livesum'
+)
+
+SCHEDULER_WAIT = Histogram(
+    'emaillm_scheduler_wait_seconds',
+    'Time LLM calls waited for a scheduler slot',
+    ['tier'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+)
+
+PLAN_LOOKUPS = Counter(
+    'emaillm_plan_lookups_total',
+    'Sender plan resolutions by source',
+    ['result']  # result: hit|negative|fetched|unknown|error
+)
+
+PLAN_LOOKUP_BATCH = Histogram(
+    'emaillm_plan_lookup_batch_size',
+    'Senders resolved per Firestore get_all',
+    buckets=(1, 2, 5, 10, 25, 50, 100, float('inf'))
+)
+
 # Quota metrics
 QUOTA_EXCEEDED = Counter(
     'emaillm_quota_exceeded_total',
@@ -21,6 +137,18 @@ QUOTA_EXCEEDED = Counter(
     ['user_id', 'quota_type']
 )
 
+QUOTA_SHED = Counter(
+    'emaillm_quota_shed_total',
+    'Requests from senders already known to be over quota, rejected without a quota check',
+    ['stage']  # stage: pre_parse|post_parse
+)
+
+QUOTA_NOTICES = Counter(
+    'emaillm_quota_notices_total',
+    'Over-quota notice e-mails',
+    ['outcome']  # outcome: sent|suppressed|error
+)
+
 # LLM metrics
 LLM_TOKENS = Counter(
     'emaillm_llm_tokens_total',
@@ -63,12 +191,37 @@ EMAILS_SENT = Counter(
     ['status']  # status: success|error
 )
 
+OUTBOX_ATTEMPTS = Counter(
+    'emaillm_outbox_attempts_total',
+    'Outbox delivery attempts by outcome',
+    ['outcome']  # outcome: sent|retry|dead
+)
+
+RENDER_CACHE_HITS = Counter(
+    'emaillm_render_cache_hits_total',
+    'Reply bodies served from the render cache'
+)
+
+EMAIL_BATCH_SIZE = Histogram(
+    'emaillm_email_batch_recipients',
+    'Recipients per SendGrid /v3/mail/send request',
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, float('inf'))
+)
+
+EMAIL_SEND_DURATION = Histogram(
+    'emaillm_email_send_duration_seconds',
+    'Duration of outbound SendGrid requests in seconds',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+)
+
 # Initialize metrics
 def init_metrics():
     """Initialize all metrics with default values."""
     # Initialize cache metrics with zero values
     CACHE_HITS.labels(cache_name='default')._value.set(0)
     CACHE_MISSES.labels(cache_name='default')._value.set(0)
+    CACHE_L1_HITS.labels(cache_name='default')._value.set(0)
+    CACHE_L2_HITS.labels(cache_name='default')._value.set(0)
     
     # Initialize quota metrics with zero values
     QUOTA_EXCEEDED.labels(user_id='unknown', quota_type='unknown')._value.set(0)
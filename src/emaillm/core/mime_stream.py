@@ -0,0 +1,315 @@
+"""
+Incremental MIME / form-data parsing with bounded memory.
+
+Chunks are pushed through `write()` as they arrive from the socket. Headers
+are parsed per entity, text/plain and text/html bodies are kept in memory up
+to a cap, and every other part (attachments, forwarded messages, images) is
+decoded straight into a temp file. Peak memory per request is therefore
+bounded by the caps, not by the size of the message.
+
+`FormCollector` handles SendGrid's multipart/form-data posts: parsed fields
+are buffered, file fields are spooled, and a raw `email` field is streamed
+into a nested `MimeCollector`.
+"""
+
+import base64
+import binascii
+import os
+import quopri
+import re
+import tempfile
+from email import policy
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import Dict, List, Optional, Tuple
+
+MAX_HEADER_BYTES = int(os.getenv("INBOUND_MAX_HEADER_BYTES", 256 * 1024))
+MAX_TEXT_BYTES   = int(os.getenv("INBOUND_MAX_TEXT_BYTES", 1024 * 1024))
+SPOOL_DIR        = os.getenv("INBOUND_SPOOL_DIR") or None   # None = system temp dir
+
+# (filename, content_type, size, path)
+SpooledPart = Tuple[str, str, int, str]
+
+_WS_RE = re.compile(rb"\s+")
+
+class MimeError(ValueError):
+    """Malformed or oversized MIME structure."""
+
+def _header_end(buf: bytearray) -> Tuple[int, int]:
+    """(end of header block, start of body) or (-1, -1) if not complete yet."""
+    if buf.startswith(b"\r\n"):
+        return 0, 2
+    if buf.startswith(b"\n"):
+        return 0, 1
+    crlf, lf = buf.find(b"\r\n\r\n"), buf.find(b"\n\n")
+    if crlf >= 0 and (lf < 0 or crlf < lf):
+        return crlf + 2, crlf + 4
+    if lf >= 0:
+        return lf + 1, lf + 2
+    return -1, -1
+
+class _Decoder:
+    """Incremental Content-Transfer-Encoding decoder."""
+
+    def __init__(self, cte: str):
+        self.cte = (cte or "").lower()
+        self._rest = b""
+
+    def feed(self, data: bytes) -> bytes:
+        if self.cte == "base64":
+            data = self._rest + _WS_RE.sub(b"", data)
+            cut = len(data) - len(data) % 4
+            self._rest = data[cut:]
+            try:
+                return base64.b64decode(data[:cut])
+            except binascii.Error as e:
+                raise MimeError(f"bad base64: {e}")
+        if self.cte == "quoted-printable":
+            data = self._rest + data
+            cut = data.rfind(b"\n") + 1
+            self._rest = data[cut:]
+            return quopri.decodestring(data[:cut])
+        return data
+
+    def flush(self) -> bytes:
+        rest, self._rest = self._rest, b""
+        if not rest:
+            return b""
+        if self.cte == "base64":
+            return base64.b64decode(rest + b"=" * (-len(rest) % 4))
+        if self.cte == "quoted-printable":
+            return quopri.decodestring(rest)
+        return rest
+
+class _TextSink:
+    """Keeps a text body in memory, truncated at MAX_TEXT_BYTES."""
+
+    def __init__(self, on_close, cte: str = "", charset: str = "utf-8"):
+        self._on_close = on_close
+        self._decoder = _Decoder(cte)
+        self._charset = charset or "utf-8"
+        self._buf = bytearray()
+
+    def write(self, data: bytes) -> None:
+        room = MAX_TEXT_BYTES - len(self._buf)
+        if room > 0:
+            self._buf += self._decoder.feed(data)[:room]
+
+    def close(self) -> None:
+        if len(self._buf) < MAX_TEXT_BYTES:
+            self._buf += self._decoder.flush()
+        raw = bytes(self._buf[:MAX_TEXT_BYTES])
+        try:
+            text = raw.decode(self._charset, errors="replace")
+        except LookupError:  # unknown charset
+            text = raw.decode("utf-8", errors="replace")
+        self._on_close(text)
+
+class _SpoolSink:
+    """Decodes a part straight into a temp file."""
+
+    def __init__(self, spooled: List[SpooledPart], filename: str, content_type: str, cte: str = ""):
+        self._spooled = spooled
+        self._filename = filename
+        self._content_type = content_type
+        self._decoder = _Decoder(cte)
+        self._file = tempfile.NamedTemporaryFile(prefix="emaillm-", dir=SPOOL_DIR, delete=False)
+        self._size = 0
+        # registered up front so a failed parse still cleans the file up
+        self._spooled.append((filename, content_type, 0, self._file.name))
+        self._index = len(self._spooled) - 1
+
+    def write(self, data: bytes) -> None:
+        out = self._decoder.feed(data)
+        self._size += len(out)
+        self._file.write(out)
+
+    def close(self) -> None:
+        out = self._decoder.flush()
+        self._size += len(out)
+        self._file.write(out)
+        self._file.close()
+        self._spooled[self._index] = (self._filename, self._content_type, self._size, self._file.name)
+
+class _NullSink:
+    def write(self, data: bytes) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class Entity:
+    """One MIME entity: buffers its header block, then streams the body to a sink."""
+
+    def __init__(self, collector: "MimeCollector | FormCollector"):
+        self._collector = collector
+        self._head: Optional[bytearray] = bytearray()
+        self._sink = None
+        self.headers: Optional[Message] = None
+
+    def _start(self, header_bytes: bytes) -> None:
+        self.headers = BytesHeaderParser(policy=policy.default).parsebytes(header_bytes)
+        self._sink = self._collector.sink_for(self.headers, self)
+
+    def write(self, data: bytes) -> None:
+        if self._sink is None:
+            self._head += data
+            end, body = _header_end(self._head)
+            if end < 0:
+                if len(self._head) > MAX_HEADER_BYTES:
+                    raise MimeError("header block too large")
+                return
+            head, self._head = self._head, None
+            self._start(bytes(head[:end]))
+            data = bytes(head[body:])
+            if not data:
+                return
+        self._sink.write(data)
+
+    def close(self) -> None:
+        if self._sink is None:  # headers without a body
+            head, self._head = self._head, None
+            self._start(bytes(head))
+        self._sink.close()
+
+class MultipartSink:
+    """Splits a multipart body on its boundary and feeds each part to a new Entity."""
+
+    def __init__(self, boundary: str, collector: "MimeCollector | FormCollector"):
+        self._collector = collector
+        self._delim = b"\n--" + boundary.encode("latin-1")
+        # a virtual newline so a delimiter on the very first line is found too
+        self._buf = bytearray(b"\n")
+        self._part: Optional[Entity] = None
+        self._done = False
+
+    def _emit(self, data: bytes) -> None:
+        if self._part is not None and data:
+            self._part.write(data)
+
+    def write(self, data: bytes) -> None:
+        if self._done:
+            return
+        self._buf += data
+        while True:
+            at = self._buf.find(self._delim)
+            if at < 0:
+                # keep a tail that may hold the start of a delimiter
+                keep = len(self._delim) + 1
+                if len(self._buf) > keep:
+                    self._emit(bytes(self._buf[:-keep]))
+                    del self._buf[:-keep]
+                return
+            after = at + len(self._delim)
+            if len(self._buf) < after + 2:
+                return                                   # need to see what follows
+            is_close = self._buf[after:after + 2] == b"--"
+            eol = self._buf.find(b"\n", after)
+            if not is_close and eol < 0:
+                return                                   # delimiter line not finished
+            end = at - 1 if at > 0 and self._buf[at - 1:at] == b"\r" else at
+            self._emit(bytes(self._buf[:end]))
+            if self._part is not None:
+                self._part.close()
+                self._part = None
+            if is_close:
+                self._done = True
+                self._buf = bytearray()
+                return
+            del self._buf[:eol + 1]
+            self._part = Entity(self._collector)
+
+    def close(self) -> None:
+        if not self._done:
+            if self._part is not None:
+                self._emit(bytes(self._buf))
+                self._part.close()
+                self._part = None
+            self._done = True
+        self._buf = bytearray()
+
+class MimeCollector:
+    """Collects envelope fields from a streamed RFC 822 message."""
+
+    def __init__(self, spooled: Optional[List[SpooledPart]] = None):
+        self.root = Entity(self)
+        self.spooled: List[SpooledPart] = [] if spooled is None else spooled
+        self.text: Optional[str] = None
+        self.html: Optional[str] = None
+
+    def _set(self, attr: str, value: str) -> None:
+        if getattr(self, attr) is None:
+            setattr(self, attr, value)
+
+    def sink_for(self, headers: Message, entity: Entity):
+        ctype = headers.get_content_type()
+        cte = str(headers.get("content-transfer-encoding", "") or "").strip()
+        filename = headers.get_filename()
+        if ctype.startswith("multipart/") and headers.get_boundary():
+            return MultipartSink(headers.get_boundary(), self)
+        if filename or headers.get_content_disposition() == "attachment":
+            return _SpoolSink(self.spooled, filename or "", ctype, cte)
+        charset = headers.get_content_charset() or "utf-8"
+        if ctype == "text/html" and self.html is None:
+            return _TextSink(lambda v: self._set("html", v), cte, charset)
+        if (ctype == "text/plain" or entity is self.root) and self.text is None:
+            return _TextSink(lambda v: self._set("text", v), cte, charset)
+        return _SpoolSink(self.spooled, "", ctype, cte)
+
+    def write(self, data: bytes) -> None:
+        self.root.write(data)
+
+    def close(self) -> None:
+        self.root.close()
+
+    def fields(self) -> Dict[str, str]:
+        headers = self.root.headers
+        get = (lambda name: str(headers.get(name, "") or "").strip()) if headers is not None else (lambda name: "")
+        return {
+            "from": get("from"),
+            "to": get("to"),
+            "subject": get("subject"),
+            "message_id": get("message-id"),
+            "text": self.text or "",
+            "html": self.html or "",
+        }
+
+class FormCollector:
+    """Collects a multipart/form-data post; a raw `email` field is parsed as MIME."""
+
+    def __init__(self, boundary: str):
+        self.spooled: List[SpooledPart] = []
+        self.values: Dict[str, str] = {}
+        self.mime: Optional[MimeCollector] = None
+        self._body = MultipartSink(boundary, self)
+
+    def sink_for(self, headers: Message, entity: Entity):
+        name = headers.get_param("name", header="content-disposition") or ""
+        filename = headers.get_filename()
+        if name == "email" and self.mime is None:
+            self.mime = MimeCollector(self.spooled)
+            return self.mime.root
+        if filename:
+            return _SpoolSink(self.spooled, filename, headers.get_content_type())
+        if not name:
+            return _NullSink()
+        return _TextSink(lambda v: self.values.setdefault(name.lower(), v))
+
+    def write(self, data: bytes) -> None:
+        self._body.write(data)
+
+    def close(self) -> None:
+        self._body.close()
+
+    def fields(self) -> Dict[str, str]:
+        if self.mime is not None:
+            return self.mime.fields()
+        return dict(self.values)
+
+def discard(spooled: List[SpooledPart]) -> None:
+    """Remove spooled temp files."""
+    for _, _, _, path in spooled:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,266 @@
+"""
+Sender → pricing-plan resolution.
+
+Plans come from the PRD's Firestore collections: `users/<email>` carries the
+`tier` (and optionally a `stripe_cust_id`), and `subscriptions/<cust_id>`,
+when present, overrides it with the billed tier. A Firestore read on every
+e-mail would add 50–150 ms, so:
+
+* answers are cached in-process for PLAN_CACHE_TTL_SECONDS; senders with no
+  user document are cached (as the default plan) for the shorter
+  PLAN_CACHE_NEGATIVE_TTL_SECONDS;
+* misses arriving within PLAN_LOOKUP_BATCH_MS of each other share one
+  `get_all` round trip;
+* `start_listener()` watches both collections and pushes tier changes into
+  the cache, so upgrades apply within seconds rather than after the TTL.
+  The initial snapshot (every existing document) is skipped, so it does
+  not fill the cache with senders that never write.
+
+With ENABLE_FIRESTORE unset every sender resolves to the default plan.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import structlog
+from cachetools import TTLCache
+
+from .metrics import PLAN_LOOKUP_BATCH, PLAN_LOOKUPS
+
+logger = structlog.get_logger()
+
+ENABLED          = os.getenv("ENABLE_FIRESTORE", "false").lower() == "true"
+DEFAULT_PLAN     = os.getenv("DEFAULT_PLAN", "free")
+USERS_COLLECTION = "users"
+SUBSCRIPTIONS_COLLECTION = "subscriptions"
+TTL_S            = float(os.getenv("PLAN_CACHE_TTL_SECONDS", 300))
+NEGATIVE_TTL_S   = float(os.getenv("PLAN_CACHE_NEGATIVE_TTL_SECONDS", 60))
+CACHE_SIZE       = int(os.getenv("PLAN_CACHE_SIZE", 50_000))
+BATCH_MS         = float(os.getenv("PLAN_LOOKUP_BATCH_MS", 5))
+BATCH_MAX        = int(os.getenv("PLAN_LOOKUP_BATCH_MAX", 100))
+
+def _normalise(email: str) -> str:
+    return (email or "").strip().lower()
+
+def _changes_only(callback):
+    """`on_snapshot` callback that ignores the first call – the initial snapshot, every document as ADDED."""
+    initial = True
+
+    def on_snapshot(docs, changes, read_time):
+        nonlocal initial
+        if initial:
+            initial = False
+            return
+        callback(docs, changes, read_time)
+    return on_snapshot
+
+class PlanResolver:
+    def __init__(
+        self,
+        db=None,
+        *,
+        ttl_s: float = TTL_S,
+        negative_ttl_s: float = NEGATIVE_TTL_S,
+        maxsize: int = CACHE_SIZE,
+        batch_ms: float = BATCH_MS,
+        batch_max: int = BATCH_MAX,
+        default: str = DEFAULT_PLAN,
+    ):
+        self._db = db
+        self.default = default
+        self.batch_ms = batch_ms
+        self.batch_max = batch_max
+        # listener callbacks arrive on Firestore's threads
+        self._lock = threading.Lock()
+        self._plans: TTLCache = TTLCache(maxsize, ttl_s)
+        self._unknown: TTLCache = TTLCache(maxsize, negative_ttl_s)
+        self._customers: Dict[str, Set[str]] = {}     # stripe_cust_id -> emails
+        self._pending: Dict[str, "asyncio.Future[str]"] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._watches: List = []
+
+    def _client(self):
+        if self._db is None:
+            from emaillm.email.outbox import get_firestore_client
+            self._db = get_firestore_client()
+        return self._db
+
+    # -- cache -------------------------------------------------------------
+
+    def cached(self, email: str) -> Optional[str]:
+        key = _normalise(email)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                PLAN_LOOKUPS.labels(result="hit").inc()
+                return plan
+            if key in self._unknown:
+                PLAN_LOOKUPS.labels(result="negative").inc()
+                return self.default
+        return None
+
+    def _store(self, email: str, plan: Optional[str], cust_id: Optional[str] = None) -> None:
+        with self._lock:
+            if plan:
+                self._plans[email] = plan
+                self._unknown.pop(email, None)
+            else:
+                self._unknown[email] = True
+                self._plans.pop(email, None)
+            if cust_id:
+                self._customers.setdefault(cust_id, set()).add(email)
+
+    def invalidate(self, email: str) -> None:
+        key = _normalise(email)
+        with self._lock:
+            self._plans.pop(key, None)
+            self._unknown.pop(key, None)
+
+    # -- lookups -----------------------------------------------------------
+
+    async def resolve(self, email: str) -> str:
+        """Plan slug for `email`; the default plan for unknown senders or on errors."""
+        if not email:
+            return self.default
+        plan = self.cached(email)
+        if plan is not None:
+            return plan
+        key = _normalise(email)
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.batch_max:
+                self._flush_now()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_ms / 1000, self._flush_now)
+        return await asyncio.shield(future)
+
+    async def resolve_many(self, emails: Iterable[str]) -> Dict[str, str]:
+        emails = list(emails)
+        plans = await asyncio.gather(*(self.resolve(e) for e in emails))
+        return dict(zip(emails, plans))
+
+    def _flush_now(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.get_running_loop().create_task(self._flush(batch))
+
+    async def _flush(self, batch: Dict[str, "asyncio.Future[str]"]) -> None:
+        PLAN_LOOKUP_BATCH.observe(len(batch))
+        try:
+            found = await asyncio.to_thread(self._fetch, list(batch))
+        except Exception as e:
+            # fail open on the default plan, but don't cache the outage
+            logger.warning("Plan lookup failed", error=str(e), senders=len(batch))
+            PLAN_LOOKUPS.labels(result="error").inc(len(batch))
+            found = None
+        for email, future in batch.items():
+            if found is None:
+                plan = self.default
+            else:
+                plan = found.get(email)
+                PLAN_LOOKUPS.labels(result="fetched" if plan else "unknown").inc()
+                self._store(email, plan)
+            if not future.done():
+                future.set_result(plan or self.default)
+
+    def _fetch(self, emails: List[str]) -> Dict[str, str]:
+        """One `get_all` for the users, one more for any linked subscriptions."""
+        db = self._client()
+        users = db.collection(USERS_COLLECTION)
+        found: Dict[str, str] = {}
+        customers: Dict[str, str] = {}
+        for snap in db.get_all([users.document(e) for e in emails]):
+            if not snap.exists:
+                continue
+            data = snap.to_dict() or {}
+            if data.get("tier"):
+                found[snap.id] = data["tier"]
+            if data.get("stripe_cust_id"):
+                customers[snap.id] = data["stripe_cust_id"]
+        if customers:
+            subs = db.collection(SUBSCRIPTIONS_COLLECTION)
+            billed = {
+                snap.id: (snap.to_dict() or {}).get("tier")
+                for snap in db.get_all([subs.document(c) for c in set(customers.values())])
+                if snap.exists
+            }
+            for email, cust_id in customers.items():
+                if billed.get(cust_id):
+                    found[email] = billed[cust_id]
+                with self._lock:
+                    self._customers.setdefault(cust_id, set()).add(email)
+        return found
+
+    # -- change feed -------------------------------------------------------
+
+    def _on_users(self, docs, changes, read_time) -> None:
+        for change in changes:
+            email = _normalise(change.document.id)
+            data = change.document.to_dict() or {}
+            if change.type.name == "REMOVED":
+                self._store(email, None)
+            elif data.get("stripe_cust_id"):
+                # the subscription decides; look it up again on next use
+                self.invalidate(email)
+                with self._lock:
+                    self._customers.setdefault(data["stripe_cust_id"], set()).add(email)
+            else:
+                self._store(email, data.get("tier"))
+
+    def _on_subscriptions(self, docs, changes, read_time) -> None:
+        for change in changes:
+            with self._lock:
+                emails = list(self._customers.get(change.document.id, ()))
+            tier = None if change.type.name == "REMOVED" else (change.document.to_dict() or {}).get("tier")
+            for email in emails:
+                if tier:
+                    self._store(email, tier)
+                else:
+                    self.invalidate(email)
+
+    def start_listener(self) -> None:
+        if self._watches:
+            return
+        db = self._client()
+        self._watches = [
+            db.collection(USERS_COLLECTION).on_snapshot(_changes_only(self._on_users)),
+            db.collection(SUBSCRIPTIONS_COLLECTION).on_snapshot(_changes_only(self._on_subscriptions)),
+        ]
+
+    def stop_listener(self) -> None:
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+_resolver: Optional[PlanResolver] = None
+
+def get_resolver() -> PlanResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = PlanResolver()
+    return _resolver
+
+async def resolve(email: str) -> str:
+    if not ENABLED:
+        return DEFAULT_PLAN
+    return await get_resolver().resolve(email)
+
+def start_listener() -> None:
+    """Keep cached plans in step with Firestore (no-op without ENABLE_FIRESTORE)."""
+    if not ENABLED:
+        return
+    try:
+        get_resolver().start_listener()
+    except Exception as e:
+        logger.warning("Plan change listener unavailable, relying on cache TTL", error=str(e))
+
+def stop_listener() -> None:
+    if _resolver is not None:
+        _resolver.stop_listener()
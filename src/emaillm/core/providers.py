@@ -1,20 +1,175 @@
-import os, openai, logging
+import asyncio, os, logging, random
+from typing import Dict, Optional, Protocol, Sequence
 
-openai.api_key = os.getenv("OPENAI_API_KEY", "")
-PREMIUM_MODEL = os.getenv("OPENAI_PREMIUM_MODEL", "gpt-4.1")
+from emaillm.core import http
+from emaillm.core.ratelimit import DistributedRateLimiter, estimate_tokens, parse_reset
 
-class GPT41:
+OPENAI_API_KEY  = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+PREMIUM_MODEL   = os.getenv("OPENAI_PREMIUM_MODEL", "gpt-4.1")
+LLM_TIMEOUT     = float(os.getenv("LLM_TIMEOUT_SECONDS", 20))
+# in-flight LLM calls per worker process; also the size of the keep-alive pool
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+# account-wide OpenAI budgets shared by all workers (0 = not enforced)
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", 0))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", 0))
+
+class LLMProvider(Protocol):
+    """Anything `call_llm` can route a prompt to."""
+    MODEL: str
+
+    async def chat(self, prompt: str) -> str: ...
+
+class OpenAICompatible:
+    """
+    Any /chat/completions endpoint (OpenAI, xAI, Gemini's OpenAI surface,
+    Together, …). Cost is declared per 1k tokens; `max_concurrency` bounds
+    in-flight calls and the keep-alive pool; `rpm` and/or `tpm` enable the
+    shared Redis rate limiter (each budget on its own when > 0), which also
+    tracks the provider's x-ratelimit headers.
+    """
     MODEL = PREMIUM_MODEL
     PRICE_IN  = 0.002   # $ per 1k input tokens
     PRICE_OUT = 0.008   # $ per 1k output tokens
 
-    def chat(self, prompt: str) -> str:
-        resp = openai.ChatCompletion.create(
-            model=self.MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            timeout=20,
+    def __init__(
+        self,
+        name: str = "openai",
+        *,
+        model: Optional[str] = None,
+        base_url: str = OPENAI_BASE_URL,
+        api_key: str = OPENAI_API_KEY,
+        price_in: Optional[float] = None,
+        price_out: Optional[float] = None,
+        timeout: float = LLM_TIMEOUT,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        rpm: float = 0,
+        tpm: float = 0,
+    ):
+        self.name = name
+        self.MODEL = model or self.MODEL
+        self.PRICE_IN = self.PRICE_IN if price_in is None else price_in
+        self.PRICE_OUT = self.PRICE_OUT if price_out is None else price_out
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.ratelimit: Optional[DistributedRateLimiter] = (
+            DistributedRateLimiter(name, rpm, tpm) if rpm > 0 or tpm > 0 else None
+        )
+
+    def _limit(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    def _client(self):
+        return http.get_client(
+            self.name,
+            base_url=self.base_url,
+            timeout=self.timeout,
+            max_connections=self.max_concurrency,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        )
+
+    async def chat(self, prompt: str) -> str:
+        if self.ratelimit is not None:
+            # waits its turn (up to LLM_RATELIMIT_MAX_WAIT_SECONDS) rather than drawing a 429
+            await self.ratelimit.acquire(estimate_tokens(prompt))
+        async with self._limit():
+            resp = await self._client().post(
+                "/chat/completions",
+                json={
+                    "model": self.MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                },
+            )
+        if self.ratelimit is not None:
+            await self.ratelimit.observe(resp.headers)
+            if resp.status_code == 429:
+                await self.ratelimit.throttled(
+                    parse_reset(resp.headers.get("retry-after"))
+                    or parse_reset(resp.headers.get("x-ratelimit-reset-requests"))
+                )
+        resp.raise_for_status()
+        data = resp.json()
+        usage = data.get("usage") or {}
+        cost = (usage.get("prompt_tokens", 0)/1000)*self.PRICE_IN + \
+               (usage.get("completion_tokens", 0)/1000)*self.PRICE_OUT
+        logging.getLogger("emaillm").info("%s cost $%.4f", self.name, cost)
+        return data["choices"][0]["message"]["content"].strip()
+
+class GPT41(OpenAICompatible):
+    """The default OpenAI provider (pooled client registered as "openai")."""
+
+    def __init__(self, name: str = "openai", **kwargs):
+        kwargs.setdefault("rpm", OPENAI_RPM)
+        kwargs.setdefault("tpm", OPENAI_TPM)
+        super().__init__(name, **kwargs)
+
+class StubProvider:
+    """
+    Offline stand-in with a configurable latency and error distribution:
+    latency is gaussian(`latency_ms`, `jitter_ms`), and each call fails with
+    probability `error_rate` (or per the `errors` script when given).
+    """
+    PRICE_IN = PRICE_OUT = 0.0
+
+    def __init__(
+        self,
+        name: str = "stub",
+        *,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        errors: Optional[Sequence[bool]] = None,
+        reply: str = "stub reply",
+        seed: Optional[int] = None,
+    ):
+        self.name = self.MODEL = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.reply = reply
+        self.calls = 0
+        self._errors = list(errors) if errors is not None else None
+        self._rng = random.Random(seed)
+
+    async def chat(self, prompt: str) -> str:
+        n, self.calls = self.calls, self.calls + 1
+        delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        fail = self._errors[n % len(self._errors)] if self._errors else self._rng.random() < self.error_rate
+        if fail:
+            raise RuntimeError(f"{self.name}: simulated upstream error")
+        return self.reply
+
+def build_provider(name: str, spec: Dict) -> Optional[LLMProvider]:
+    """Provider from a `providers.json` entry; None when its API key is not set."""
+    kind = spec.get("type", "openai")
+    if kind == "stub":
+        return StubProvider(
+            name,
+            latency_ms=spec.get("latency_ms", 50.0),
+            jitter_ms=spec.get("jitter_ms", 0.0),
+            error_rate=spec.get("error_rate", 0.0),
+            reply=spec.get("reply", "stub reply"),
+        )
+    if kind == "openai":
+        api_key = os.getenv(spec.get("api_key_env", "OPENAI_API_KEY"), "")
+        if not api_key:
+            return None
+        return OpenAICompatible(
+            name,
+            model=spec.get("model"),
+            base_url=spec.get("base_url", OPENAI_BASE_URL),
+            api_key=api_key,
+            price_in=spec.get("price_in"),
+            price_out=spec.get("price_out"),
+            timeout=spec.get("timeout", LLM_TIMEOUT),
+            max_concurrency=spec.get("max_concurrency", LLM_MAX_CONCURRENCY),
+            rpm=spec.get("rpm", 0),
+            tpm=spec.get("tpm", 0),
         )
-        cost = (resp.usage.prompt_tokens/1000)*self.PRICE_IN + \
-               (resp.usage.completion_tokens/1000)*self.PRICE_OUT
-        logging.getLogger("emaillm").info("OpenAI cost $%.4f", cost)
-        return resp.choices[0].message.content.strip()
+    raise ValueError(f"Unknown provider type {kind!r} for {name}")
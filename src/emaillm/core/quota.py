@@ -1,36 +1,365 @@
 """
 Very-first cut: rolling token bucket stored in Redis ZSETs.
 All numbers are *questions* (1 Q = 1 inbound email), not tokens.
+
+Trim, count, conditional add and expiry run as one Lua script, so a check is
+a single atomic round trip and concurrent emails cannot overshoot the limit.
+
+Senders that hit their quota are remembered in-process as "blocked until
+T" (see `blocked()`), so repeat offenders are turned away before the body
+is decoded, the plan is looked up or Redis is asked again. With
+QUOTA_BLOCK_SHARE=true blocks are broadcast to every worker over pub/sub.
+
+QUOTA_MODE=buckets swaps the ZSET (one member per question) for a hash of
+fixed sub-window counters, e.g. hourly, with a weighted sliding-window
+estimate – memory is O(buckets) instead of O(usage). Existing ZSET keys are
+folded into buckets the first time a user is seen in bucket mode.
 """
 
-import os, time, uuid, redis
+import asyncio, json, os, time, uuid, redis
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import redis.asyncio as aioredis
+import structlog
+from cachetools import TLRUCache
+
+from emaillm.config import pricing_loader as pricing
+from emaillm.config.pricing_loader import QuotaWindow
+from emaillm.core import teams
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 r = redis.Redis.from_url(REDIS_URL)
+# the same scripts over asyncio, for request handlers (see consume_async)
+ar = aioredis.Redis.from_url(REDIS_URL)
 
-PLANS = {
-    # plan : (max_questions, window_seconds)
-    "free":  (30,  7 * 24 * 3600),     # 30 Q / 7-day rolling
-    "pro":   (300, 30 * 24 * 3600),
-    "team":  (10_000, 30 * 24 * 3600), # pooled, soft cap
-}
+QUOTA_MODE     = os.getenv("QUOTA_MODE", "zset").lower()      # zset | buckets
+BUCKET_SECONDS = int(os.getenv("QUOTA_BUCKET_SECONDS", 3600))
+BLOCK_CACHE_SIZE  = int(os.getenv("QUOTA_BLOCK_CACHE_SIZE", 100_000))
+# upper bound on a cached block, so a plan upgrade is noticed within this time
+BLOCK_MAX_SECONDS = int(os.getenv("QUOTA_BLOCK_MAX_SECONDS", 300))
+BLOCK_SHARE       = os.getenv("QUOTA_BLOCK_SHARE", "false").lower() == "true"
+_BLOCK_CHANNEL    = "quota:blocked"
+
+logger = structlog.get_logger()
+
+# Limits come from the pricing-plan snapshot: every plan may have several
+# rolling windows (e.g. 10 / 7 days and 40 / 30 days). A question may also
+# count against a team pool and an org cap (core/teams). All levels are
+# checked and consumed in one script: a question is only counted when every
+# window of every level has room. The binding window – the one that reopens
+# last when blocked, else the one with least headroom – supplies `remaining`,
+# `reset_at` and the `level` reported back.
+UNLIMITED = 2**31 - 1
+
+# KEYS    = one quota key per level
+# ARGV    = now, member, then per level: n_windows, window_1, limit_1, ...
+# returns {allowed (0|1), remaining, reset_at, binding level (1-based)}
+_CONSUME_LUA = """
+local now = tonumber(ARGV[1])
+local pos = 3
+local levels, allowed = {}, 1
+for k = 1, #KEYS do
+    local lv = {key = KEYS[k], windows = {}, limits = {}, usage = {}, longest = 0}
+    local n = tonumber(ARGV[pos])
+    pos = pos + 1
+    for i = 1, n do
+        lv.windows[i] = tonumber(ARGV[pos])
+        lv.limits[i]  = tonumber(ARGV[pos + 1])
+        lv.longest    = math.max(lv.longest, lv.windows[i])
+        pos = pos + 2
+    end
+    redis.call('ZREMRANGEBYSCORE', lv.key, 0, now - lv.longest)
+    for i = 1, n do
+        lv.usage[i] = redis.call('ZCOUNT', lv.key, '(' .. (now - lv.windows[i]), '+inf')
+        if lv.usage[i] >= lv.limits[i] then allowed = 0 end
+    end
+    levels[k] = lv
+end
+
+local remaining, reset, level = nil, now, 1
+for k, lv in ipairs(levels) do
+    if allowed == 1 then
+        redis.call('ZADD', lv.key, now, ARGV[2])
+        for i = 1, #lv.windows do lv.usage[i] = lv.usage[i] + 1 end
+    end
+    redis.call('EXPIRE', lv.key, lv.longest)
+    for i = 1, #lv.windows do
+        local left = math.max(lv.limits[i] - lv.usage[i], 0)
+        -- the question whose expiry brings this window back under its limit
+        local nth   = math.max(lv.usage[i] - lv.limits[i], 0)
+        local entry = redis.call('ZRANGEBYSCORE', lv.key, '(' .. (now - lv.windows[i]), '+inf', 'WITHSCORES', 'LIMIT', nth, 1)
+        local at    = entry[2] and tonumber(entry[2]) + lv.windows[i] or now + lv.windows[i]
+        if remaining == nil or left < remaining or (left == remaining and at > reset) then
+            remaining, reset, level = left, at, k
+        end
+    end
+end
+return {allowed, remaining, reset, level}
+"""
+_consume = r.register_script(_CONSUME_LUA)
+_aconsume = ar.register_script(_CONSUME_LUA)
+
+# KEYS    = per level: bucket hash, legacy ZSET key (migrated and deleted if present)
+# ARGV    = now, bucket_seconds, then per level: n_windows, window_1, limit_1, ...
+# returns {allowed (0|1), remaining, reset_at, binding level (1-based)}
+_CONSUME_BUCKETS_LUA = """
+local now  = tonumber(ARGV[1])
+local size = tonumber(ARGV[2])
+local current = math.floor(now / size)
+local pos = 3
+local levels, allowed = {}, 1
+for k = 1, #KEYS / 2 do
+    local lv = {key = KEYS[2 * k - 1], windows = {}, limits = {}, oldest = {}, weight = {}, total = {}, first = {}, longest = 0}
+    local n = tonumber(ARGV[pos])
+    pos = pos + 1
+    for i = 1, n do
+        lv.windows[i] = tonumber(ARGV[pos])
+        lv.limits[i]  = tonumber(ARGV[pos + 1])
+        lv.longest    = math.max(lv.longest, lv.windows[i])
+        pos = pos + 2
+        local start = now - lv.windows[i]
+        lv.oldest[i] = math.floor(start / size)
+        -- share of the oldest bucket that still lies inside the window
+        lv.weight[i] = ((lv.oldest[i] + 1) * size - start) / size
+        lv.total[i]  = 0
+    end
+
+    local legacy_key = KEYS[2 * k]
+    if redis.call('EXISTS', legacy_key) == 1 then
+        local legacy = redis.call('ZRANGEBYSCORE', legacy_key, now - lv.longest + 1, '+inf', 'WITHSCORES')
+        for i = 2, #legacy, 2 do
+            redis.call('HINCRBY', lv.key, math.floor(tonumber(legacy[i]) / size), 1)
+        end
+        redis.call('DEL', legacy_key)
+    end
+
+    local horizon = math.floor((now - lv.longest) / size)
+    local fields  = redis.call('HGETALL', lv.key)
+    for f = 1, #fields, 2 do
+        local idx   = tonumber(fields[f])
+        local count = tonumber(fields[f + 1])
+        if idx < horizon then
+            redis.call('HDEL', lv.key, fields[f])
+        else
+            for i = 1, n do
+                if idx >= lv.oldest[i] then
+                    lv.total[i] = lv.total[i] + (idx == lv.oldest[i] and count * lv.weight[i] or count)
+                    if lv.first[i] == nil or idx < lv.first[i] then lv.first[i] = idx end
+                end
+            end
+        end
+    end
+    for i = 1, n do
+        if lv.total[i] >= lv.limits[i] then allowed = 0 end
+    end
+    levels[k] = lv
+end
+
+local remaining, reset, level = nil, now, 1
+for k, lv in ipairs(levels) do
+    if allowed == 1 then
+        redis.call('HINCRBY', lv.key, current, 1)
+        for i = 1, #lv.windows do
+            lv.total[i] = lv.total[i] + 1
+            if lv.first[i] == nil then lv.first[i] = current end
+        end
+    end
+    redis.call('EXPIRE', lv.key, lv.longest + size)
+    for i = 1, #lv.windows do
+        local left = math.max(math.floor(lv.limits[i] - lv.total[i]), 0)
+        local at   = (lv.first[i] or current) * size + size + lv.windows[i]
+        if remaining == nil or left < remaining or (left == remaining and at > reset) then
+            remaining, reset, level = left, at, k
+        end
+    end
+end
+return {allowed, remaining, reset, level}
+"""
+_consume_buckets = r.register_script(_CONSUME_BUCKETS_LUA)
+_aconsume_buckets = ar.register_script(_CONSUME_BUCKETS_LUA)
+
+@dataclass(frozen=True)
+class QuotaResult:
+    allowed: bool
+    remaining: int   # questions left in the binding window
+    reset_at: int    # epoch seconds when the oldest counted question expires
+    level: str = "user"   # user|team|org – whose window binds (the blocker when denied)
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds until another question would be accepted (0 when allowed)."""
+        return 0 if self.allowed else max(self.reset_at - int(time.time()), 1)
 
 def _key(plan: str, user_or_team: str) -> str:
     return f"quota:{plan}:{user_or_team.lower()}"
 
+def _bucket_key(plan: str, user_or_team: str) -> str:
+    return f"qbucket:{plan}:{user_or_team.lower()}"
+
+def bucket_estimate(counts: Dict[int, int], now: int, window: int, size: int = BUCKET_SECONDS) -> float:
+    """
+    Weighted sliding-window usage from per-bucket counts (mirrors the Lua).
+
+    Buckets fully inside [now - window, now] count in full; the bucket that
+    straddles the window start counts in proportion to its overlap.
+    """
+    start = now - window
+    oldest = start // size
+    weight = ((oldest + 1) * size - start) / size
+    return sum(
+        count * weight if idx == oldest else count
+        for idx, count in counts.items()
+        if idx >= oldest
+    )
+
+@dataclass(frozen=True)
+class QuotaLevel:
+    name: str                          # user|team|org
+    plan: str                          # key namespace
+    owner: str                         # user e-mail, "team:<id>" or org id
+    windows: Tuple[QuotaWindow, ...]
+
+def quota_levels(user_email: str, plan: str = "free") -> List[QuotaLevel]:
+    """
+    What one question from `user_email` counts against. Team members draw
+    from the team pool (with an optional per-member cap) and, when the team
+    belongs to an org with a cap, from the org as well.
+    """
+    plans = pricing.current()
+    team = teams.membership(user_email)
+    if team is None:
+        spec = plans.get_or_default(plan)
+        levels = [QuotaLevel("user", spec.tier, user_email, spec.windows)]
+    else:
+        pool = plans.get_or_default(team.plan)
+        levels = [
+            QuotaLevel("user", pool.tier, user_email, team.member_windows),
+            QuotaLevel("team", pool.tier, f"team:{team.team_id}", pool.windows),
+            QuotaLevel("org", "org", team.org_id or "", team.org_windows),
+        ]
+    return [lv for lv in levels if lv.windows]
+
+def _level_args(levels: List[QuotaLevel]) -> List[int]:
+    args: List[int] = []
+    for lv in levels:
+        args.append(len(lv.windows))
+        args.extend(n for w in lv.windows for n in (w.seconds, w.limit))
+    return args
+
+def _script_call(levels: List[QuotaLevel]) -> Tuple[List[str], List[Any]]:
+    """KEYS and ARGV of the consume script for the current QUOTA_MODE."""
+    now = int(time.time())
+    if QUOTA_MODE == "buckets":
+        keys = [k for lv in levels for k in (_bucket_key(lv.plan, lv.owner), _key(lv.plan, lv.owner))]
+        return keys, [now, BUCKET_SECONDS, *_level_args(levels)]
+    return [_key(lv.plan, lv.owner) for lv in levels], [now, uuid.uuid4().hex, *_level_args(levels)]
+
+def _result(levels: List[QuotaLevel], keys: List[str], reply: Sequence[Any]) -> QuotaResult:
+    allowed, remaining, reset_at, level = reply
+    result = QuotaResult(bool(allowed), int(remaining), int(reset_at), levels[int(level) - 1].name)
+    logger.debug("Quota checked", key=keys[0], allowed=result.allowed, remaining=result.remaining, level=result.level)
+    return result
+
+def consume(user_email: str, plan: str = "free") -> QuotaResult:
+    """Atomically check and, if allowed, consume one question at every level (user, team, org)."""
+    levels = quota_levels(user_email, plan)
+    if not levels:
+        return QuotaResult(True, UNLIMITED, 0)
+    keys, args = _script_call(levels)
+    script = _consume_buckets if QUOTA_MODE == "buckets" else _consume
+    return _result(levels, keys, script(keys=keys, args=args))
+
+async def consume_async(user_email: str, plan: str = "free") -> QuotaResult:
+    """`consume` over the asyncio client, so request handlers don't block the event loop."""
+    levels = quota_levels(user_email, plan)
+    if not levels:
+        return QuotaResult(True, UNLIMITED, 0)
+    keys, args = _script_call(levels)
+    script = _aconsume_buckets if QUOTA_MODE == "buckets" else _aconsume
+    return _result(levels, keys, await script(keys=keys, args=args))
+
 def check_and_consume(user_email: str, plan: str = "free") -> bool:
     """Return True iff the caller is **allowed** to proceed."""
-    limit, window = PLANS[plan]
-    now  = int(time.time())
-    key  = _key(plan, user_email)
+    return consume(user_email, plan).allowed
+
+def migrate_to_buckets(plan: str, user_or_team: str) -> int:
+    """
+    Fold one ZSET quota key into bucket counters and delete it.
+    Returns the number of questions carried over.
+    """
+    window = pricing.current().get(plan).longest_window
+    now = int(time.time())
+    src, dst = _key(plan, user_or_team), _bucket_key(plan, user_or_team)
+    counts: Dict[int, int] = {}
+    for _, score in r.zrangebyscore(src, now - window + 1, "+inf", withscores=True):
+        idx = int(score) // BUCKET_SECONDS
+        counts[idx] = counts.get(idx, 0) + 1
     pipe = r.pipeline()
-    pipe.zremrangebyscore(key, 0, now - window)   # drop expired
-    pipe.zcard(key)                               # current usage
+    for idx, count in counts.items():
+        pipe.hincrby(dst, idx, count)
+    if counts:
+        pipe.expire(dst, window + BUCKET_SECONDS)
+    pipe.delete(src)
     pipe.execute()
-    usage = r.zcard(key)
-    if usage >= limit:
-        print(f"quota_block {key}")
-        return False
-    r.zadd(key, {uuid.uuid4().hex: now})
-    print(f"quota_hit {key}")
-    return True
+    return sum(counts.values())
+
+# ---------------------------------------------------------------------------
+# Blocked-sender cache
+# ---------------------------------------------------------------------------
+
+def _block_expiry(_sender: str, result: "QuotaResult", now: float) -> float:
+    return min(result.reset_at, now + BLOCK_MAX_SECONDS)
+
+_blocked: "TLRUCache[str, QuotaResult]" = TLRUCache(maxsize=BLOCK_CACHE_SIZE, ttu=_block_expiry, timer=time.time)
+
+def blocked(user_email: str) -> Optional[QuotaResult]:
+    """The denial still in force for this sender, if any (no I/O)."""
+    return _blocked.get(user_email.lower()) if user_email else None
+
+async def remember_block(user_email: str, result: QuotaResult) -> None:
+    """Cache a denial until its window reopens (and tell the other workers)."""
+    if result.allowed or not user_email:
+        return
+    _blocked[user_email.lower()] = result
+    if BLOCK_SHARE:
+        try:
+            await ar.publish(_BLOCK_CHANNEL, json.dumps([user_email.lower(), result.reset_at, result.level]))
+        except Exception as e:
+            logger.warning("Quota block broadcast failed", error=str(e))
+
+def forget_block(user_email: str) -> None:
+    _blocked.pop(user_email.lower(), None)
+
+async def _listen_blocks() -> None:
+    client = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+    while True:
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(_BLOCK_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    sender, reset_at, level = json.loads(message["data"])
+                    _blocked[sender] = QuotaResult(False, 0, int(reset_at), level)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Quota block listener failed", error=str(e))
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+_block_listener: Optional["asyncio.Task[None]"] = None
+
+def start_block_listener() -> Optional["asyncio.Task[None]"]:
+    """Start (once per event loop) the task that applies peer blocks; None unless QUOTA_BLOCK_SHARE."""
+    global _block_listener
+    if not BLOCK_SHARE:
+        return None
+    if _block_listener is None or _block_listener.done():
+        _block_listener = asyncio.get_running_loop().create_task(_listen_blocks())
+    return _block_listener
+
+async def claim_notice(user_email: str, result: QuotaResult) -> bool:
+    """True for the first denial of this sender in the current window (across workers)."""
+    return bool(await ar.set(f"quota:notice:{user_email.lower()}", 1, nx=True, ex=max(result.retry_after, 1)))
@@ -0,0 +1,220 @@
+"""
+Rate limiting primitives.
+
+`TokenBucket` paces work inside one process. `DistributedRateLimiter`
+holds per-provider request and token budgets in Redis so every worker draws
+from the same buckets; callers reserve capacity and wait their turn up to a
+deadline instead of hitting the provider's 429s.
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Mapping, Optional
+
+from .metrics import RATELIMIT_HEADROOM, RATELIMIT_WAITS
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+RATELIMIT_MAX_WAIT_S    = float(os.getenv("LLM_RATELIMIT_MAX_WAIT_SECONDS", 10))
+ESTIMATED_OUTPUT_TOKENS = int(os.getenv("LLM_ESTIMATED_OUTPUT_TOKENS", 512))
+
+class TokenBucket:
+    """
+    In-process token bucket: refills at `rate` tokens per second and holds at
+    most `capacity`, so short bursts pass and the long-run rate is capped.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until `tokens` are available and take them (FIFO between waiters)."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+# ---------------------------------------------------------------------------
+# Distributed request + token budgets (shared by every worker through Redis)
+# ---------------------------------------------------------------------------
+
+# KEYS[1] = request bucket hash, KEYS[2] = token bucket hash
+# ARGV    = req_per_ms, req_capacity, tok_per_ms, tok_capacity, tokens, max_wait_ms
+# returns {reserved (0|1), wait_ms, requests_left, tokens_left}
+#
+# A budget with a rate of 0 is not enforced: its bucket is left alone and
+# reported as -1 left. Callers reserve in arrival order: the balance may go negative and the
+# caller sleeps until its reservation is covered, so waiting is FIFO across
+# workers without polling. The Redis clock is used so worker skew cannot
+# mint tokens.
+_RESERVE_LUA = """
+local t   = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local function level(key, rate, cap)
+    local v   = redis.call('HMGET', key, 'level', 'ts')
+    local lvl = tonumber(v[1]) or cap
+    local ts  = tonumber(v[2]) or now
+    return math.min(cap, lvl + math.max(now - ts, 0) * rate)
+end
+
+local req_rate, req_cap = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tok_rate, tok_cap = tonumber(ARGV[3]), tonumber(ARGV[4])
+local need, max_wait    = tonumber(ARGV[5]), tonumber(ARGV[6])
+
+local req_on, tok_on = req_rate > 0, tok_rate > 0
+local req = req_on and level(KEYS[1], req_rate, req_cap) or -1
+local tok = tok_on and level(KEYS[2], tok_rate, tok_cap) or -1
+local wait = 0
+if req_on and req < 1 then wait = math.max(wait, (1 - req) / req_rate) end
+if tok_on and tok < need then wait = math.max(wait, (need - tok) / tok_rate) end
+if wait > max_wait then
+    return {0, math.ceil(wait), math.floor(req), math.floor(tok)}
+end
+
+if req_on then
+    req = req - 1
+    redis.call('HSET', KEYS[1], 'level', tostring(req), 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(req_cap / req_rate) * 2)
+end
+if tok_on then
+    tok = tok - need
+    redis.call('HSET', KEYS[2], 'level', tostring(tok), 'ts', now)
+    redis.call('PEXPIRE', KEYS[2], math.ceil(tok_cap / tok_rate) * 2)
+end
+return {1, math.ceil(wait), math.floor(req), math.floor(tok)}
+"""
+
+# KEYS[1] = bucket hash; ARGV = remaining (cap the level at what the provider reports)
+_SYNC_LUA = """
+local t   = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cur = tonumber(redis.call('HGET', KEYS[1], 'level'))
+local remaining = tonumber(ARGV[1])
+if cur == nil or remaining < cur then
+    redis.call('HSET', KEYS[1], 'level', tostring(remaining), 'ts', now)
+end
+return 1
+"""
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_S = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """OpenAI-style reset durations ("1s", "6m0s", "250ms") in seconds."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNIT_S[unit] for n, unit in parts)
+
+class RateLimitTimeout(Exception):
+    """The provider budget cannot cover this call before the caller's deadline."""
+
+class DistributedRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets for one provider,
+    kept in Redis so all workers draw from the same buckets. Either budget
+    may be 0 (not enforced); only the other one is then drawn from.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float, *, max_wait_s: float = RATELIMIT_MAX_WAIT_S, redis=None):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait_s = max_wait_s
+        self._redis = redis
+        self._req_key = f"ratelimit:{name}:requests"
+        self._tok_key = f"ratelimit:{name}:tokens"
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = _get_redis()
+        return self._redis
+
+    async def acquire(self, tokens: int, deadline_s: Optional[float] = None) -> None:
+        """Reserve one request and `tokens`; sleep until the reservation is due."""
+        max_wait = self.max_wait_s if deadline_s is None else deadline_s
+        reserved, wait_ms, req_left, tok_left = await self._client().eval(
+            _RESERVE_LUA, 2, self._req_key, self._tok_key,
+            self.rpm / 60_000, self.rpm, self.tpm / 60_000, self.tpm,
+            tokens, int(max_wait * 1000),
+        )
+        if self.rpm > 0:
+            RATELIMIT_HEADROOM.labels(provider=self.name, budget="requests").set(req_left)
+        if self.tpm > 0:
+            RATELIMIT_HEADROOM.labels(provider=self.name, budget="tokens").set(tok_left)
+        if not reserved:
+            RATELIMIT_WAITS.labels(provider=self.name, outcome="timeout").inc()
+            raise RateLimitTimeout(f"{self.name}: rate limit budget needs {wait_ms / 1000:.1f}s, deadline {max_wait:.1f}s")
+        if wait_ms > 0:
+            RATELIMIT_WAITS.labels(provider=self.name, outcome="waited").inc()
+            await asyncio.sleep(wait_ms / 1000)
+
+    async def observe(self, headers: Mapping[str, str]) -> None:
+        """Adapt to x-ratelimit-* response headers (limits and remaining budget)."""
+        # only budgets we enforce follow the headers; a 0 budget stays off
+        limit_req = headers.get("x-ratelimit-limit-requests")
+        limit_tok = headers.get("x-ratelimit-limit-tokens")
+        if self.rpm > 0 and limit_req and limit_req.isdigit():
+            self.rpm = float(limit_req)
+        if self.tpm > 0 and limit_tok and limit_tok.isdigit():
+            self.tpm = float(limit_tok)
+
+        pipe = self._client().pipeline(transaction=False)
+        synced = False
+        for key, budget, limit in ((self._req_key, "requests", self.rpm), (self._tok_key, "tokens", self.tpm)):
+            if limit <= 0:
+                continue
+            remaining = headers.get(f"x-ratelimit-remaining-{budget}")
+            if remaining and remaining.isdigit():
+                pipe.eval(_SYNC_LUA, 1, key, int(remaining))
+                RATELIMIT_HEADROOM.labels(provider=self.name, budget=budget).set(int(remaining))
+                synced = True
+        if synced:
+            await pipe.execute()
+
+    async def throttled(self, retry_after_s: Optional[float]) -> None:
+        """A 429 came back: drain the request budget (the token one without it) so callers back off for `retry_after_s`."""
+        key, budget, limit = ((self._req_key, "requests", self.rpm) if self.rpm > 0
+                              else (self._tok_key, "tokens", self.tpm))
+        deficit = (retry_after_s or 1.0) * limit / 60
+        await self._client().eval(_SYNC_LUA, 1, key, -deficit)
+        RATELIMIT_HEADROOM.labels(provider=self.name, budget=budget).set(0)
+
+def estimate_tokens(prompt: str, max_output: int = ESTIMATED_OUTPUT_TOKENS) -> int:
+    """Rough token cost of a call: ~4 characters per prompt token plus the expected reply."""
+    return len(prompt) // 4 + max_output
+
+_redis = None
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis.asyncio as aioredis
+        _redis = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
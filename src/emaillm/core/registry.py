@@ -0,0 +1,226 @@
+"""
+LLM provider registry with health tracking and failover.
+
+Providers and the fallback chain for every routing string come from
+`config/providers.json` (LLM_PROVIDERS_PATH overrides; providers whose API
+key is not set are skipped). Each provider keeps a rolling window of call
+latencies and outcomes; its circuit breaker opens when the window's error
+rate or the run of consecutive failures crosses a threshold, stays open for
+a cool-down, then lets a single probe through (half-open) before closing.
+
+`complete(model, prompt)` walks the model's chain, skipping providers
+whose breaker is open or whose shared rate-limit budget can't cover the
+call in time (that is not counted against the breaker), and raises `ProviderUnavailableError` when none
+answered. Providers whose rolling p95 latency is over their budget
+(LLM_LATENCY_BUDGET_SECONDS, or `latency_budget_s` in providers.json; 0
+turns it off) are tried after the rest of the chain; with no traffic their
+window empties and they move back to their place.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import structlog
+
+from emaillm.exceptions import ProviderUnavailableError
+from .metrics import PROVIDER_CIRCUIT_STATE, PROVIDER_FALLBACKS, PROVIDER_LATENCY, PROVIDER_REQUESTS
+from .providers import GPT41, LLMProvider, build_provider
+from .ratelimit import RateLimitTimeout
+
+logger = structlog.get_logger()
+
+CONFIG_PATH = os.getenv("LLM_PROVIDERS_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "config", "providers.json"
+)
+WINDOW_S         = float(os.getenv("LLM_HEALTH_WINDOW_SECONDS", 60))
+MIN_REQUESTS     = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", 10))
+ERROR_THRESHOLD  = float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5))
+MAX_CONSECUTIVE  = int(os.getenv("LLM_BREAKER_CONSECUTIVE_FAILURES", 5))
+COOLDOWN_S       = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", 30))
+LATENCY_BUDGET_S = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", 10))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+@dataclass
+class ProviderHealth:
+    """Rolling latency / error window plus the circuit breaker for one provider."""
+    name: str
+    window_s: float = WINDOW_S
+    state: str = CLOSED
+    opened_at: float = 0.0
+    consecutive_failures: int = 0
+    probing: bool = False
+    latency_budget_s: float = LATENCY_BUDGET_S
+    _calls: Deque[Tuple[float, float, bool]] = field(default_factory=deque)  # (at, latency, ok)
+
+    def _prune(self, now: float) -> None:
+        while self._calls and self._calls[0][0] <= now - self.window_s:
+            self._calls.popleft()
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        self._prune(time.monotonic() if now is None else now)
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, _, ok in self._calls if not ok) / len(self._calls)
+
+    def latency_quantile(self, q: float, now: Optional[float] = None) -> Optional[float]:
+        self._prune(time.monotonic() if now is None else now)
+        latencies = sorted(lat for _, lat, _ in self._calls)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def over_budget(self, now: Optional[float] = None) -> bool:
+        """Is the rolling p95 latency over budget (with at least MIN_REQUESTS calls to go on)?"""
+        if self.latency_budget_s <= 0:
+            return False
+        p95 = self.latency_quantile(0.95, now)
+        return p95 is not None and len(self._calls) >= MIN_REQUESTS and p95 > self.latency_budget_s
+
+    def _set_state(self, state: str, now: float) -> None:
+        if state != self.state:
+            logger.warning("Provider circuit state changed", provider=self.name, old=self.state, new=state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = now
+        PROVIDER_CIRCUIT_STATE.labels(provider=self.name).set(_STATE_VALUE[state])
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """May a call go to this provider now? Claims the probe when half-open."""
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now - self.opened_at >= COOLDOWN_S:
+            self._set_state(HALF_OPEN, now)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Give the half-open probe back, e.g. when the call was cancelled before it was recorded."""
+        self.probing = False
+
+    def record(self, latency: float, ok: bool, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._calls.append((now, latency, ok))
+        self._prune(now)
+        self.probing = False
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED, now)
+            return
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._set_state(OPEN, now)
+        elif self.state == CLOSED and (
+            self.consecutive_failures >= MAX_CONSECUTIVE
+            or (len(self._calls) >= MIN_REQUESTS and self.error_rate(now) >= ERROR_THRESHOLD)
+        ):
+            self._set_state(OPEN, now)
+
+class ProviderRegistry:
+    def __init__(self, default_chain: Optional[List[str]] = None):
+        self._providers: Dict[str, LLMProvider] = {}
+        self._health: Dict[str, ProviderHealth] = {}
+        self._routes: Dict[str, List[str]] = {}
+        self.default_chain: List[str] = list(default_chain or [])
+
+    def register(self, name: str, provider: LLMProvider, latency_budget_s: Optional[float] = None) -> None:
+        self._providers[name] = provider
+        self._health[name] = ProviderHealth(name)
+        if latency_budget_s is not None:
+            self._health[name].latency_budget_s = latency_budget_s
+        PROVIDER_CIRCUIT_STATE.labels(provider=name).set(0)
+
+    def route(self, model: str, chain: List[str]) -> None:
+        self._routes[model] = list(chain)
+
+    def health(self, name: str) -> ProviderHealth:
+        return self._health[name]
+
+    def chain(self, model: str) -> List[str]:
+        """Registered providers for `model`, in fallback order."""
+        names = self._routes.get(model) or self.default_chain
+        return [n for n in names if n in self._providers]
+
+    def ordered(self, model: str) -> List[str]:
+        """The chain for this call: providers over their latency budget go last, otherwise in order."""
+        chain = self.chain(model)
+        now = time.monotonic()
+        slow = [n for n in chain if self._health[n].over_budget(now)]
+        return [n for n in chain if n not in slow] + slow if slow else chain
+
+    async def complete(self, model: str, prompt: str) -> str:
+        chain = self.ordered(model)
+        first = self.chain(model)[:1]
+        errors: List[str] = []
+        for name in chain:
+            health = self._health[name]
+            if not health.allow():
+                PROVIDER_REQUESTS.labels(provider=name, outcome="skipped").inc()
+                errors.append(f"{name}: circuit {health.state}")
+                continue
+            start = time.monotonic()
+            try:
+                reply = await self._providers[name].chat(prompt)
+            except RateLimitTimeout as e:
+                # our own budget ran out before the call was made; the provider is not at fault
+                PROVIDER_REQUESTS.labels(provider=name, outcome="ratelimited").inc()
+                logger.warning("Provider budget exhausted", provider=name, model=model, error=str(e))
+                errors.append(f"{name}: {e}")
+                continue
+            except Exception as e:
+                latency = time.monotonic() - start
+                health.record(latency, ok=False)
+                PROVIDER_REQUESTS.labels(provider=name, outcome="error").inc()
+                PROVIDER_LATENCY.labels(provider=name).observe(latency)
+                logger.warning("Provider call failed", provider=name, model=model, error=str(e))
+                errors.append(f"{name}: {e}")
+                continue
+            finally:
+                # a cancelled probe is never recorded; don't leave the provider half-open for good
+                health.release()
+            latency = time.monotonic() - start
+            health.record(latency, ok=True)
+            PROVIDER_REQUESTS.labels(provider=name, outcome="success").inc()
+            PROVIDER_LATENCY.labels(provider=name).observe(latency)
+            if [name] != first:
+                PROVIDER_FALLBACKS.labels(model=model, provider=name).inc()
+            return reply
+        raise ProviderUnavailableError(f"No provider answered for {model!r}: " + "; ".join(errors or ["none configured"]))
+
+def load_registry(path: str = CONFIG_PATH) -> ProviderRegistry:
+    with open(path, "r") as f:
+        data = json.load(f)
+    registry = ProviderRegistry(default_chain=data.get("default"))
+    for name, spec in data.get("providers", {}).items():
+        provider = build_provider(name, spec)
+        if provider is None:
+            logger.info("Provider disabled (no API key)", provider=name)
+            continue
+        registry.register(name, provider, spec.get("latency_budget_s"))
+    for model, chain in data.get("routes", {}).items():
+        registry.route(model, chain)
+    if not registry.chain("__default__"):
+        # nothing configured (e.g. local dev without keys): keep the old behaviour
+        registry.register("openai", GPT41())
+        registry.default_chain = ["openai"]
+    return registry
+
+_registry: Optional[ProviderRegistry] = None
+
+def get_registry() -> ProviderRegistry:
+    global _registry
+    if _registry is None:
+        _registry = load_registry()
+    return _registry
+
+async def complete(model: str, prompt: str) -> str:
+    return await get_registry().complete(model, prompt)
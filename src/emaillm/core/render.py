@@ -0,0 +1,69 @@
+"""
+Reply rendering: LLM markdown -> multipart text + HTML body.
+
+The Jinja2 templates in `templates/` are compiled once per process. The
+reply's markdown is turned into HTML by markdown-it with raw HTML disabled
+(tags in the model output are escaped, unsafe link schemes are dropped) and
+wrapped in `email_reply.html`; the plain-text part uses `email_reply.txt`.
+Rendered bodies are cached by reply digest, so a reply served from the LLM
+cache is never rendered twice.
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Tuple
+
+from cachetools import LRUCache
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from markdown_it import MarkdownIt
+from markupsafe import Markup
+
+from .metrics import RENDER_CACHE_HITS
+
+TEMPLATE_DIR = os.getenv("EMAIL_TEMPLATE_DIR") or str(Path(__file__).resolve().parents[3] / "templates")
+CACHE_SIZE   = int(os.getenv("RENDER_CACHE_SIZE", 2048))
+
+@dataclass(frozen=True)
+class RenderedReply:
+    text: str
+    html: str
+
+# "html": False escapes any raw HTML the model emits
+_md = MarkdownIt("commonmark", {"html": False, "linkify": False}).enable("table").enable("strikethrough")
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    keep_trailing_newline=True,
+)
+_cache: "LRUCache[str, RenderedReply]" = LRUCache(maxsize=CACHE_SIZE)
+
+@lru_cache(maxsize=None)
+def load_templates() -> Tuple[Template, Template]:
+    """Compile the reply templates (called at startup; cached afterwards)."""
+    return _env.get_template("email_reply.txt"), _env.get_template("email_reply.html")
+
+def render_template(name: str, **context) -> str:
+    """Render any other e-mail template from TEMPLATE_DIR (e.g. `overquota_email.html`)."""
+    return _env.get_template(name).render(**context)
+
+def markdown_to_html(answer: str) -> str:
+    return _md.render(answer)
+
+def render_reply(answer: str) -> RenderedReply:
+    """Text and HTML bodies for an LLM answer, from cache when seen before."""
+    digest = hashlib.sha256(answer.encode("utf-8")).hexdigest()
+    cached = _cache.get(digest)
+    if cached is not None:
+        RENDER_CACHE_HITS.inc()
+        return cached
+    text_tpl, html_tpl = load_templates()
+    rendered = RenderedReply(
+        text=text_tpl.render(answer_text=answer),
+        html=html_tpl.render(answer_html=Markup(markdown_to_html(answer))),
+    )
+    _cache[digest] = rendered
+    return rendered
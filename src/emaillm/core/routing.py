@@ -1,16 +1,139 @@
+"""
+Keyword / regex model routing.
+
+Rules live in `config/routing_rules.json` (ROUTING_RULES_PATH overrides):
+
+    {"default": "GPT-4 Turbo", "scan_bytes": 8192,
+     "rules": [{"model": "Titan", "priority": 40,
+                "keywords": ["aws", "lambda"], "patterns": ["\\bec2-\\d+"]}]}
+
+Keywords match whole words only ("aws" does not match "laws"), case-insensitively,
+with any run of whitespace inside a phrase. All keywords are folded into one
+trie-shaped alternation, so a scan costs one pass over the text however many
+rules there are. Only the subject and the first `scan_bytes` of the body are
+scanned. The highest-priority match wins; ties go to the rule listed first.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONFIG_PATH = os.getenv("ROUTING_RULES_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "config", "routing_rules.json"
+)
+
+_WS_RE = re.compile(r"\s+")
+
+@dataclass(frozen=True)
+class Rule:
+    model: str
+    priority: int = 0
+    keywords: Tuple[str, ...] = ()
+    patterns: Tuple[str, ...] = ()
+
+def _normalise(phrase: str) -> str:
+    return _WS_RE.sub(" ", phrase.strip().lower())
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex matching any of `words`, factored by common prefix."""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: Dict) -> str:
+        optional = "" in node
+        branches = [
+            (r"\s+" if ch == " " else re.escape(ch)) + emit(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # a word ending here: what follows is optional
+        return f"(?:{body})?" if optional else body
+
+    return emit(trie)
+
+class RoutingEngine:
+    def __init__(self, rules: List[Rule], default: str, scan_bytes: int = 8192):
+        self.default = default
+        self.scan_bytes = scan_bytes
+        # (priority, -position) so ties go to the earlier rule
+        self._rank: List[Tuple[int, int]] = []
+        self._models: List[str] = []
+        self._keyword_rule: Dict[str, int] = {}
+        regex_groups: List[str] = []
+        for idx, rule in enumerate(rules):
+            self._rank.append((rule.priority, -idx))
+            self._models.append(rule.model)
+            for kw in rule.keywords:
+                kw = _normalise(kw)
+                best = self._keyword_rule.get(kw)
+                if kw and (best is None or self._rank[idx] > self._rank[best]):
+                    self._keyword_rule[kw] = idx
+            for pattern in rule.patterns:
+                # the scanned text is lower-cased; keep user patterns case-blind
+                regex_groups.append(f"(?P<r{idx}_{len(regex_groups)}>(?i:{pattern}))")
+
+        alternatives = []
+        if self._keyword_rule:
+            alternatives.append(r"(?<!\w)" + _trie_pattern(self._keyword_rule) + r"(?!\w)")
+        alternatives.extend(regex_groups)
+        # no re.IGNORECASE: lower-casing the text once is much cheaper than
+        # case-folding at every position of the scan
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+        self._top = max(self._rank) if self._rank else None
+
+    @classmethod
+    def from_config(cls, data: Dict) -> "RoutingEngine":
+        rules = [
+            Rule(
+                model=r["model"],
+                priority=int(r.get("priority", 0)),
+                keywords=tuple(r.get("keywords", ())),
+                patterns=tuple(r.get("patterns", ())),
+            )
+            for r in data.get("rules", ())
+        ]
+        return cls(rules, default=data.get("default", "GPT-4 Turbo"), scan_bytes=int(data.get("scan_bytes", 8192)))
+
+    def _rule_for(self, match: "re.Match[str]") -> Optional[int]:
+        if match.lastgroup is None:
+            return self._keyword_rule.get(_normalise(match.group(0)))
+        return int(match.lastgroup[1:].split("_", 1)[0])
+
+    def route(self, subject: str, body: str) -> str:
+        if self._regex is None:
+            return self.default
+        text = (subject + "\n" + body[:self.scan_bytes]).lower()
+        best: Optional[int] = None
+        for match in self._regex.finditer(text):
+            idx = self._rule_for(match)
+            if idx is None:
+                continue
+            if best is None or self._rank[idx] > self._rank[best]:
+                best = idx
+                if self._rank[idx] == self._top:
+                    break
+        return self.default if best is None else self._models[best]
+
+def load_rules(path: str = CONFIG_PATH) -> RoutingEngine:
+    with open(path, "r") as f:
+        return RoutingEngine.from_config(json.load(f))
+
+_engine: Optional[RoutingEngine] = None
+
+def get_engine() -> RoutingEngine:
+    global _engine
+    if _engine is None:
+        _engine = load_rules()
+    return _engine
+
 def route_email(subject: str, body: str) -> str:
-    """Very small rule set matching the spec."""
-    text = (subject + " " + body).lower()
-    if "google" in text:
-        return "Gemini"
-    if "excel" in text or "office" in text:
-        return "Copilot"
-    if "aws" in text or "lambda" in text or "devops" in text:
-        return "Titan"
-    if "open source" in text or "linux" in text:
-        return "Mixtral"
-    if "legal" in text or "ethical" in text:
-        return "Claude 3"
-    if "twitter" in text or "x.com" in text:
-        return "Grok"
-    return "GPT-4 Turbo"
+    """Model name for an e-mail, per the configured routing rules."""
+    return get_engine().route(subject, body)
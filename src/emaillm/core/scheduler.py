@@ -0,0 +1,149 @@
+"""
+Plan-aware admission in front of the LLM.
+
+Upstream LLM calls take a slot from a per-process scheduler. Waiting calls
+queue per tier and are released by weighted fair queuing: each gets a
+virtual finish time `max(vtime, tier's last finish) + 1 / weight`, and the
+smallest one whose tier pool has room goes next. Every tier also has its own
+concurrency cap below the global one, so a free-tier flood can never hold
+all the slots. A call that has waited longer than SCHEDULER_MAX_WAIT_SECONDS
+jumps the order (starvation protection), so free traffic still drains.
+
+SCHEDULER_TIERS (JSON) overrides the defaults:
+    {"premium": {"weight": 8, "max_concurrency": 16}, ...}
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from emaillm.config import pricing_loader
+from .metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT
+
+CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", os.getenv("LLM_MAX_CONCURRENCY", 16)))
+MAX_WAIT_S  = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", 20))
+DEFAULT_TIER = "free"
+PRIORITY_TIER = "premium"
+
+_DEFAULT_TIERS = {
+    # plan: (weight, share of CONCURRENCY it may hold)
+    "premium": (8, 1.0),
+    "team":    (8, 1.0),
+    "pro":     (4, 0.75),
+    "starter": (4, 0.75),
+    "free":    (1, 0.5),
+}
+
+@dataclass
+class Tier:
+    name: str
+    weight: float
+    max_concurrency: int
+    running: int = 0
+    last_finish: float = 0.0
+    queue: "Deque[_Waiter]" = field(default_factory=deque)
+
+@dataclass
+class _Waiter:
+    future: "asyncio.Future[None]"
+    finish: float
+    enqueued: float
+
+def _tiers_from_env(concurrency: int) -> Dict[str, Tier]:
+    raw = os.getenv("SCHEDULER_TIERS")
+    if raw:
+        return {
+            name: Tier(name, float(spec.get("weight", 1)), int(spec.get("max_concurrency", concurrency)))
+            for name, spec in json.loads(raw).items()
+        }
+    return {
+        name: Tier(name, weight, max(1, int(concurrency * share)))
+        for name, (weight, share) in _DEFAULT_TIERS.items()
+    }
+
+class FairScheduler:
+    def __init__(self, concurrency: int = CONCURRENCY, tiers: Optional[Dict[str, Tier]] = None, max_wait_s: float = MAX_WAIT_S):
+        self.concurrency = concurrency
+        self.max_wait_s = max_wait_s
+        self.tiers = tiers if tiers is not None else _tiers_from_env(concurrency)
+        self.running = 0
+        self._vtime = 0.0
+
+    def tier_for(self, plan: Optional[str]) -> Tier:
+        tier = self.tiers.get(plan or DEFAULT_TIER)
+        if tier is None and PRIORITY_TIER in self.tiers and pricing_loader.has_feature(plan, "priority_queue"):
+            # plans added to pricing_plans.json later still get the priority lane
+            tier = self.tiers[PRIORITY_TIER]
+        return tier or self.tiers[DEFAULT_TIER]
+
+    def _pick(self, now: float) -> Optional[Tier]:
+        best: Optional[Tier] = None
+        starving: Optional[Tier] = None
+        for tier in self.tiers.values():
+            if not tier.queue or tier.running >= tier.max_concurrency:
+                continue
+            head = tier.queue[0]
+            if now - head.enqueued >= self.max_wait_s:
+                if starving is None or head.enqueued < starving.queue[0].enqueued:
+                    starving = tier
+            if best is None or head.finish < best.queue[0].finish:
+                best = tier
+        return starving or best
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self.running < self.concurrency:
+            tier = self._pick(now)
+            if tier is None:
+                return
+            waiter = tier.queue.popleft()
+            SCHEDULER_QUEUE_DEPTH.labels(tier=tier.name).set(len(tier.queue))
+            if waiter.future.done():          # cancelled while queued
+                continue
+            self._vtime = max(self._vtime, waiter.finish)
+            tier.running += 1
+            self.running += 1
+            SCHEDULER_WAIT.labels(tier=tier.name).observe(now - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def _release(self, tier: Tier) -> None:
+        tier.running -= 1
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, plan: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold one LLM slot for the duration of the block, queued by plan tier."""
+        tier = self.tier_for(plan)
+        finish = max(self._vtime, tier.last_finish) + 1.0 / tier.weight
+        tier.last_finish = finish
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), finish, time.monotonic())
+        tier.queue.append(waiter)
+        SCHEDULER_QUEUE_DEPTH.labels(tier=tier.name).set(len(tier.queue))
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(tier)           # granted just as we were cancelled
+            raise
+        try:
+            yield
+        finally:
+            self._release(tier)
+
+_scheduler: Optional[FairScheduler] = None
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler()
+    return _scheduler
+
+def slot(plan: Optional[str] = None):
+    return get_scheduler().slot(plan)
@@ -0,0 +1,231 @@
+"""
+Near-duplicate lookup for the reply cache.
+
+Each prompt gets a cheap local embedding – signed feature hashing of its
+words and character trigrams – and lives in a per-`cache_name` matrix index.
+A miss on the exact digest is answered by the closest stored prompt when
+their cosine similarity clears SEMANTIC_CACHE_THRESHOLD.
+
+The normalised prompt text is kept in Redis next to the cached reply (same
+TTL) so every worker can rebuild its index on startup.
+"""
+
+import os
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import structlog
+from cachetools import LRUCache
+
+try:
+    import numpy as np
+except ImportError:               # semantic layer is optional
+    np = None
+
+from .metrics import SEMANTIC_FALSE_POSITIVES, SEMANTIC_HITS, SEMANTIC_INDEX_SIZE
+
+logger = structlog.get_logger()
+
+ENABLED     = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true" and np is not None
+THRESHOLD   = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85))
+DIM         = int(os.getenv("SEMANTIC_CACHE_DIM", 256))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 20_000))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# filler that carries no topic; "what's the score" ≈ "score"
+_STOPWORDS = frozenset(
+    "a an and are at be can could do does for from give how i in is it me "
+    "my of on or please s tell the there this to what whats when where which "
+    "who why will with you your".split()
+)
+
+def _features(text: str) -> List[str]:
+    words = [w for w in _TOKEN_RE.findall(text.lower()) if w not in _STOPWORDS]
+    feats = list(words)
+    for w in words:
+        padded = f"#{w}#"
+        feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return feats
+
+def embed(text: str, dim: int = DIM) -> "np.ndarray":
+    """Unit-length hashed n-gram vector (float32) for `text`."""
+    vec = np.zeros(dim, dtype=np.float32)
+    feats = _features(text)
+    if not feats:
+        return vec
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in feats), dtype=np.uint32, count=len(feats))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vec, hashes % dim, signs)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+class SemanticIndex:
+    """
+    Dense (n, dim) matrix of prompt vectors with per-row expiry.
+
+    Rows are kept contiguous – removal swaps the last row in – so a lookup
+    is one matrix-vector product over the live rows.
+    """
+
+    def __init__(self, dim: int = DIM, max_entries: int = MAX_ENTRIES):
+        self.dim = dim
+        self.max_entries = max_entries
+        self._vecs = np.zeros((min(max_entries, 1024), dim), dtype=np.float32)
+        self._expires = np.zeros(len(self._vecs), dtype=np.float64)
+        self._digests: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._rows
+
+    def add(self, digest: str, vec: "np.ndarray", expires_at: float) -> None:
+        row = self._rows.get(digest)
+        if row is None:
+            if len(self) >= self.max_entries:
+                self.evict_expired()
+            if len(self) >= self.max_entries:
+                # full of live entries: drop the one that expires first
+                self.remove(self._digests[int(np.argmin(self._expires[:len(self)]))])
+            if len(self) == len(self._vecs):
+                self._grow()
+            row = len(self)
+            self._digests.append(digest)
+            self._rows[digest] = row
+        self._vecs[row] = vec
+        self._expires[row] = expires_at
+
+    def remove(self, digest: str) -> None:
+        row = self._rows.pop(digest, None)
+        if row is None:
+            return
+        last = len(self._digests) - 1
+        if row != last:
+            moved = self._digests[last]
+            self._vecs[row] = self._vecs[last]
+            self._expires[row] = self._expires[last]
+            self._digests[row] = moved
+            self._rows[moved] = row
+        self._digests.pop()
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        expired = [d for d, t in zip(self._digests, self._expires[:len(self)]) if t <= now]
+        for digest in expired:
+            self.remove(digest)
+        return len(expired)
+
+    def search(self, vec: "np.ndarray", threshold: float = THRESHOLD, now: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        return self.search_many(vec[None, :], threshold, now)[0]
+
+    def search_many(self, vecs: "np.ndarray", threshold: float = THRESHOLD, now: Optional[float] = None) -> List[Optional[Tuple[str, float]]]:
+        """Best live match above `threshold` for every row of `vecs` in one product."""
+        n = len(self)
+        if n == 0:
+            return [None] * len(vecs)
+        now = time.time() if now is None else now
+        scores = vecs @ self._vecs[:n].T                      # (q, n) cosine, rows are unit length
+        scores[:, self._expires[:n] <= now] = -1.0
+        best = scores.argmax(axis=1)
+        out: List[Optional[Tuple[str, float]]] = []
+        for q, row in enumerate(best):
+            score = float(scores[q, row])
+            out.append((self._digests[row], score) if score >= threshold else None)
+        return out
+
+    def _grow(self) -> None:
+        size = min(len(self._vecs) * 2, self.max_entries)
+        vecs = np.zeros((size, self.dim), dtype=np.float32)
+        vecs[:len(self._vecs)] = self._vecs
+        expires = np.zeros(size, dtype=np.float64)
+        expires[:len(self._expires)] = self._expires
+        self._vecs, self._expires = vecs, expires
+
+_indexes: Dict[str, SemanticIndex] = {}
+# digest -> digest it was answered from, to attribute false positives
+_served: "LRUCache[str, Tuple[str, str]]" = LRUCache(maxsize=10_000)
+# prompts reported as wrongly matched skip the semantic layer from then on
+_opt_out: "LRUCache[str, bool]" = LRUCache(maxsize=10_000)
+
+def _index(cache_name: str) -> SemanticIndex:
+    index = _indexes.get(cache_name)
+    if index is None:
+        index = _indexes[cache_name] = SemanticIndex()
+    return index
+
+def _key(cache_name: str, digest: str) -> str:
+    return f"semantic:{cache_name}:{digest}"
+
+def lookup(cache_name: str, digest: str, prompt: str) -> Optional[str]:
+    """Digest of the closest cached prompt, or None."""
+    if digest in _opt_out or cache_name not in _indexes:
+        return None
+    match = _indexes[cache_name].search(embed(prompt))
+    if match is None or match[0] == digest:
+        return None
+    return match[0]
+
+def served(cache_name: str, digest: str, match: str) -> None:
+    """Record that `digest` was answered with the reply cached for `match`."""
+    _served[digest] = (cache_name, match)
+    SEMANTIC_HITS.labels(cache_name=cache_name).inc()
+
+def forget(cache_name: str, digest: str) -> None:
+    if cache_name in _indexes:
+        _indexes[cache_name].remove(digest)
+        SEMANTIC_INDEX_SIZE.labels(cache_name=cache_name).set(len(_indexes[cache_name]))
+
+def report_false_positive(digest: str) -> bool:
+    """
+    Flag a semantic answer as wrong; the prompt will miss the semantic layer
+    from now on. Returns False when `digest` was not served semantically.
+    """
+    entry = _served.pop(digest, None)
+    if entry is None:
+        return False
+    _opt_out[digest] = True
+    SEMANTIC_FALSE_POSITIVES.labels(cache_name=entry[0]).inc()
+    return True
+
+async def remember(redis, cache_name: str, digest: str, normalised_prompt: str, ttl: int) -> None:
+    """Index a freshly cached prompt here and persist it for the other workers."""
+    index = _index(cache_name)
+    index.add(digest, embed(normalised_prompt), time.time() + ttl)
+    SEMANTIC_INDEX_SIZE.labels(cache_name=cache_name).set(len(index))
+    await redis.setex(_key(cache_name, digest), ttl, normalised_prompt)
+
+async def rebuild(redis, batch: int = 500) -> int:
+    """Load every persisted prompt into the in-memory indexes; returns rows loaded."""
+    loaded = 0
+    keys: List[str] = []
+    async for key in redis.scan_iter(match="semantic:*", count=batch):
+        keys.append(key)
+        if len(keys) >= batch:
+            loaded += await _load(redis, keys)
+            keys = []
+    if keys:
+        loaded += await _load(redis, keys)
+    logger.info("Semantic cache index rebuilt", entries=loaded)
+    return loaded
+
+async def _load(redis, keys: Sequence[str]) -> int:
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.get(key)
+        pipe.pttl(key)
+    values = await pipe.execute()
+    now = time.time()
+    loaded = 0
+    for key, prompt, pttl in zip(keys, values[0::2], values[1::2]):
+        if prompt is None or pttl is None or pttl <= 0:
+            continue
+        _, cache_name, digest = key.split(":", 2)
+        _index(cache_name).add(digest, embed(prompt), now + pttl / 1000)
+        loaded += 1
+    for cache_name, index in _indexes.items():
+        SEMANTIC_INDEX_SIZE.labels(cache_name=cache_name).set(len(index))
+    return loaded
@@ -0,0 +1,131 @@
+"""
+Team membership for pooled quotas.
+
+`teams/<team_id>` (PRD: name, owner, members[], plan_tier) and the optional
+`orgs/<org_id>` caps are small, so the whole directory is held in memory and
+kept current by Firestore snapshot listeners; `membership()` is a dict read
+and safe to call from the synchronous quota path. Optional team fields:
+
+    org_id                          the org whose cap also applies
+    member_quota_day|week|month     a per-member cap inside the pool
+
+Org documents carry `quota_day|week|month`. With ENABLE_FIRESTORE unset
+nobody is in a team and quotas stay per-user.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import structlog
+
+from emaillm.config.pricing_loader import QuotaWindow, quota_windows
+
+logger = structlog.get_logger()
+
+ENABLED          = os.getenv("ENABLE_FIRESTORE", "false").lower() == "true"
+TEAMS_COLLECTION = "teams"
+ORGS_COLLECTION  = "orgs"
+DEFAULT_TEAM_TIER = "team"
+
+@dataclass(frozen=True)
+class Membership:
+    team_id: str
+    plan: str                                   # pricing tier of the pool
+    member_windows: Tuple[QuotaWindow, ...] = ()
+    org_id: Optional[str] = None
+    org_windows: Tuple[QuotaWindow, ...] = ()
+
+class TeamDirectory:
+    def __init__(self, db=None):
+        self._db = db
+        self._teams: Dict[str, Mapping[str, Any]] = {}
+        self._orgs: Dict[str, Tuple[QuotaWindow, ...]] = {}
+        self._members: Dict[str, Membership] = {}
+        self._watches: List = []
+        self.loaded = False
+
+    def _client(self):
+        if self._db is None:
+            from emaillm.email.outbox import get_firestore_client
+            self._db = get_firestore_client()
+        return self._db
+
+    def membership(self, email: str) -> Optional[Membership]:
+        return self._members.get((email or "").strip().lower())
+
+    def _rebuild(self) -> None:
+        members: Dict[str, Membership] = {}
+        for team_id, data in self._teams.items():
+            org_id = data.get("org_id")
+            entry = Membership(
+                team_id=team_id,
+                plan=data.get("plan_tier") or DEFAULT_TEAM_TIER,
+                member_windows=quota_windows(data, "member_quota_"),
+                org_id=org_id,
+                org_windows=self._orgs.get(org_id, ()) if org_id else (),
+            )
+            for email in data.get("members") or ():
+                email = email.strip().lower()
+                if email in members:
+                    logger.warning("Member listed in several teams", email=email, kept=members[email].team_id, ignored=team_id)
+                    continue
+                members[email] = entry
+        # one assignment: readers see the old map or the new one
+        self._members = members
+
+    def apply_teams(self, docs: Iterable) -> None:
+        self._teams = {doc.id: doc.to_dict() or {} for doc in docs}
+        self._rebuild()
+        self.loaded = True
+
+    def apply_orgs(self, docs: Iterable) -> None:
+        self._orgs = {doc.id: quota_windows(doc.to_dict() or {}) for doc in docs}
+        self._rebuild()
+
+    def load(self) -> None:
+        """One-off read of both collections (scripts, or before the listeners attach)."""
+        db = self._client()
+        self._orgs = {doc.id: quota_windows(doc.to_dict() or {}) for doc in db.collection(ORGS_COLLECTION).stream()}
+        self.apply_teams(db.collection(TEAMS_COLLECTION).stream())
+
+    def start_listener(self) -> None:
+        if self._watches:
+            return
+        db = self._client()
+        self._watches = [
+            db.collection(ORGS_COLLECTION).on_snapshot(lambda docs, changes, read_time: self.apply_orgs(docs)),
+            db.collection(TEAMS_COLLECTION).on_snapshot(lambda docs, changes, read_time: self.apply_teams(docs)),
+        ]
+
+    def stop_listener(self) -> None:
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+_directory: Optional[TeamDirectory] = None
+
+def get_directory() -> TeamDirectory:
+    global _directory
+    if _directory is None:
+        _directory = TeamDirectory()
+    return _directory
+
+def membership(email: str) -> Optional[Membership]:
+    """The sender's team (and org) for pooled quotas, or None."""
+    if not ENABLED:
+        return None
+    return get_directory().membership(email)
+
+def start_listener() -> None:
+    """Keep the team directory in step with Firestore (no-op without ENABLE_FIRESTORE)."""
+    if not ENABLED:
+        return
+    try:
+        get_directory().start_listener()
+    except Exception as e:
+        logger.warning("Team directory unavailable, quotas stay per-user", error=str(e))
+
+def stop_listener() -> None:
+    if _directory is not None:
+        _directory.stop_listener()
@@ -0,0 +1,120 @@
+"""
+Re-drive messages parked in the `emails_dlq` Firestore collection.
+
+`replay()` pages through the DLQ in document-id order, resends each page
+with bounded concurrency behind a token bucket, deletes the successes in
+batched writes and then checkpoints the last document id under
+`emails_dlq_replay/<run_id>`. Re-running with the same run id resumes after
+the checkpoint; messages that fail again stay in the DLQ for a later run.
+
+Used by `scripts/replay_dlq.py` and `POST /admin/dlq/replay`.
+"""
+
+import asyncio
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+try:
+    from google.cloud import firestore
+except ImportError:               # local dev without Firestore wheel
+    firestore = None
+
+from emaillm.core import emailer
+from emaillm.core.ratelimit import TokenBucket
+from emaillm.email.outbox import DLQ_COLLECTION, FIRESTORE_BATCH, get_firestore_client
+
+logger = structlog.get_logger()
+
+CHECKPOINT_COLLECTION = f"{DLQ_COLLECTION}_replay"
+PAGE_SIZE   = int(os.getenv("DLQ_REPLAY_PAGE_SIZE", 200))
+CONCURRENCY = int(os.getenv("DLQ_REPLAY_CONCURRENCY", 10))
+RATE        = float(os.getenv("DLQ_REPLAY_RATE", 50))       # sends per second
+
+@dataclass
+class ReplayState:
+    cursor: Optional[str] = None     # last document id fully handled
+    sent: int = 0
+    failed: int = 0
+    done: bool = False
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ReplayState":
+        data = data or {}
+        return cls(**{k: data[k] for k in ("cursor", "sent", "failed", "done") if k in data})
+
+def load_state(db, run_id: str) -> ReplayState:
+    snap = db.collection(CHECKPOINT_COLLECTION).document(run_id).get()
+    return ReplayState.from_dict(snap.to_dict() if snap.exists else None)
+
+def _save_state(db, run_id: str, state: ReplayState) -> None:
+    db.collection(CHECKPOINT_COLLECTION).document(run_id).set(asdict(state))
+
+def _page(db, cursor: Optional[str], size: int) -> List[Tuple[str, Dict[str, Any]]]:
+    collection = db.collection(DLQ_COLLECTION)
+    query = collection.order_by("__name__").limit(size)
+    if cursor is not None:
+        query = query.start_after({"__name__": collection.document(cursor)})
+    return [(snap.id, snap.to_dict()) for snap in query.stream()]
+
+def _delete(db, doc_ids: List[str]) -> None:
+    collection = db.collection(DLQ_COLLECTION)
+    for start in range(0, len(doc_ids), FIRESTORE_BATCH):
+        batch = db.batch()
+        for doc_id in doc_ids[start:start + FIRESTORE_BATCH]:
+            batch.delete(collection.document(doc_id))
+        batch.commit()
+
+async def _resend(doc: Dict[str, Any], bucket: TokenBucket, slots: asyncio.Semaphore) -> bool:
+    async with slots:
+        await bucket.acquire()
+        try:
+            await emailer.send_email(
+                to_addr=doc["to"], subject=doc["subject"],
+                body_text=doc.get("text") or "", body_html=doc.get("html"), from_addr=doc.get("from"),
+            )
+        except Exception as e:
+            logger.warning("DLQ resend failed", to=doc.get("to"), error=str(e))
+            return False
+    return True
+
+async def replay(
+    run_id: str,
+    *,
+    db=None,
+    page_size: int = PAGE_SIZE,
+    concurrency: int = CONCURRENCY,
+    rate: float = RATE,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+) -> ReplayState:
+    """Resend the DLQ from this run's checkpoint on; returns the final state."""
+    db = db if db is not None else get_firestore_client()
+    # the Firestore client is sync; keep it off the event loop
+    state = await asyncio.to_thread(load_state, db, run_id)
+    bucket = TokenBucket(rate, capacity=max(concurrency, 1))
+    slots = asyncio.Semaphore(concurrency)
+    handled = 0
+
+    while not state.done and (limit is None or handled < limit):
+        size = page_size if limit is None else min(page_size, limit - handled)
+        page = await asyncio.to_thread(_page, db, state.cursor, size)
+        if not page:
+            state.done = True
+        elif dry_run:
+            state.sent += len(page)
+        else:
+            results = await asyncio.gather(*(_resend(doc, bucket, slots) for _, doc in page))
+            sent = [doc_id for (doc_id, _), ok in zip(page, results) if ok]
+            await asyncio.to_thread(_delete, db, sent)
+            state.sent += len(sent)
+            state.failed += len(page) - len(sent)
+        if page:
+            state.cursor = page[-1][0]
+            handled += len(page)
+        if not dry_run:
+            await asyncio.to_thread(_save_state, db, run_id, state)
+        logger.info("DLQ replay progress", run_id=run_id, **asdict(state))
+    return state
@@ -0,0 +1,236 @@
+"""
+Transactional outbox for outbound replies.
+
+Request handlers only `enqueue()` a message: it is stored in the `outbox:msg`
+hash and scheduled in the `outbox:due` sorted set, scored by its next attempt
+time (ms). A background dispatcher claims due messages with a Lua script –
+pushing their score one lease ahead so concurrent dispatchers skip them,
+and never more than its SendGrid slots can send before that lease runs
+out – sends them concurrently through `core.emailer`, reschedules failures with
+jittered exponential backoff and, after the last attempt, moves them to the
+`emails_dlq` Firestore collection in batched writes. If that write fails the
+messages stay parked in the outbox – marked dead, never sent again – and
+only the DLQ write is retried, on its own backoff.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as aioredis
+import structlog
+
+try:
+    from google.cloud import firestore
+except ImportError:               # local dev without Firestore wheel
+    firestore = None
+
+from emaillm.core import emailer
+from emaillm.core.metrics import OUTBOX_ATTEMPTS
+
+logger = structlog.get_logger()
+
+_url          = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+DUE_KEY       = os.getenv("OUTBOX_KEY", "outbox:due")
+MSG_KEY       = f"{DUE_KEY.rsplit(':', 1)[0]}:msg"
+MAX_ATTEMPTS  = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 3))
+BACKOFF_BASE  = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", 2))
+BACKOFF_MAX   = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", 600))
+LEASE_MS      = int(os.getenv("OUTBOX_LEASE_MS", 60_000))   # a claimed send must finish within this
+BATCH         = int(os.getenv("OUTBOX_BATCH", 100))
+POLL_S        = float(os.getenv("OUTBOX_POLL_SECONDS", 0.5))
+# run a dispatcher in this process (API and worker); any number may run at once
+DISPATCHER_ENABLED = os.getenv("OUTBOX_DISPATCHER", "true").lower() == "true"
+
+DLQ_COLLECTION = "emails_dlq"
+FIRESTORE_BATCH = 500            # Firestore's limit on writes per batch
+
+_redis = aioredis.Redis.from_url(_url, decode_responses=True)
+_dispatcher: "Optional[asyncio.Task[None]]" = None
+
+Message = Dict[str, Any]
+
+# KEYS[1] due zset, KEYS[2] message hash; ARGV now_ms, limit, lease_until_ms
+_CLAIM_LUA = """
+local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local out = {}
+for _, id in ipairs(ids) do
+    local msg = redis.call('hget', KEYS[2], id)
+    if msg then
+        redis.call('zadd', KEYS[1], ARGV[3], id)
+        out[#out + 1] = msg
+    else
+        redis.call('zrem', KEYS[1], id)
+    end
+end
+return out
+"""
+
+@lru_cache
+def get_firestore_client():
+    try:
+        return firestore.Client()
+    except Exception:
+        # Allow local runs with emulator only
+        if os.getenv("FIRESTORE_EMULATOR_HOST"):
+            return firestore.Client(project="test-project")
+        raise
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+def backoff(attempts: int) -> float:
+    """Seconds until the next try: exponential, capped, with equal jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def enqueue(
+    *, to_addr: str, subject: str, body_text: str,
+    body_html: Optional[str] = None, max_attempts: int = MAX_ATTEMPTS,
+    from_addr: Optional[str] = None,
+) -> str:
+    """Store a reply for delivery and return its outbox id; never waits on SendGrid."""
+    msg: Message = {
+        "id": uuid.uuid4().hex,
+        "to": to_addr,
+        "from": from_addr,
+        "subject": subject,
+        "text": body_text,
+        "html": body_html,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "error": None,
+        "created": time.time(),
+    }
+    pipe = _redis.pipeline(transaction=True)
+    pipe.hset(MSG_KEY, msg["id"], json.dumps(msg))
+    pipe.zadd(DUE_KEY, {msg["id"]: _now_ms()})
+    await pipe.execute()
+    return msg["id"]
+
+def lease_capacity() -> int:
+    """
+    Most messages one pass can send within LEASE_MS: SENDGRID_MAX_CONCURRENCY
+    at a time, each taking up to the SendGrid timeout (twice that plus the
+    hold window when coalescing, whose rejected batches are re-sent one by
+    one), with one round to spare for the bookkeeping.
+    """
+    per_send = emailer.SENDGRID_TIMEOUT
+    if emailer.COALESCE_WINDOW_MS > 0:
+        per_send = 2 * per_send + emailer.COALESCE_WINDOW_MS / 1000
+    rounds = int(LEASE_MS / 1000 // per_send) - 1
+    return max(rounds, 1) * emailer.SENDGRID_MAX_CONCURRENCY
+
+async def claim_due(limit: int = BATCH) -> List[Message]:
+    """Lease up to `limit` due messages to this dispatcher (capped so they finish within the lease)."""
+    limit = min(limit, lease_capacity())
+    now = _now_ms()
+    raw = await _redis.eval(_CLAIM_LUA, 2, DUE_KEY, MSG_KEY, now, limit, now + LEASE_MS)
+    return [json.loads(m) for m in raw]
+
+async def _deliver(msg: Message) -> Optional[str]:
+    """Send one message; return the error text on failure."""
+    try:
+        # in-flight requests are bounded by SENDGRID_MAX_CONCURRENCY, and
+        # identical replies in the batch can coalesce into one request
+        await emailer.send_email(
+            to_addr=msg["to"], subject=msg["subject"],
+            body_text=msg["text"], body_html=msg.get("html"), from_addr=msg.get("from"),
+        )
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+def _write_dlq(messages: List[Message]) -> None:
+    db = get_firestore_client()
+    collection = db.collection(DLQ_COLLECTION)
+    for start in range(0, len(messages), FIRESTORE_BATCH):
+        batch = db.batch()
+        for msg in messages[start:start + FIRESTORE_BATCH]:
+            batch.set(collection.document(msg["id"]), {
+                "to": msg["to"],
+                "from": msg.get("from"),
+                "subject": msg["subject"],
+                "html": msg.get("html"),
+                "text": msg["text"],
+                "error": msg["error"],
+                "attempts": msg["attempts"],
+                "timestamp": firestore.SERVER_TIMESTAMP,
+            })
+        batch.commit()
+
+async def dispatch_once(limit: int = BATCH) -> int:
+    """Claim and send one batch of due messages; returns how many were claimed."""
+    messages = await claim_due(limit)
+    if not messages:
+        return 0
+    # parked after a failed DLQ write: out of attempts, only the write is retried
+    dead: List[Message] = [m for m in messages if m.get("dead")]
+    sending = [m for m in messages if not m.get("dead")]
+    errors = await asyncio.gather(*(_deliver(m) for m in sending))
+
+    done: List[str] = []
+    pipe = _redis.pipeline(transaction=False)
+    for msg, error in zip(sending, errors):
+        if error is None:
+            done.append(msg["id"])
+            OUTBOX_ATTEMPTS.labels(outcome="sent").inc()
+            continue
+        msg["attempts"] += 1
+        msg["error"] = error[:500]
+        if msg["attempts"] >= msg.get("max_attempts", MAX_ATTEMPTS):
+            dead.append(msg)
+            continue
+        OUTBOX_ATTEMPTS.labels(outcome="retry").inc()
+        logger.warning("Outbox send failed, retrying", id=msg["id"], attempts=msg["attempts"], error=error)
+        pipe.hset(MSG_KEY, msg["id"], json.dumps(msg))
+        pipe.zadd(DUE_KEY, {msg["id"]: _now_ms() + int(backoff(msg["attempts"]) * 1000)})
+
+    if dead:
+        try:
+            # the Firestore client is sync; keep it off the event loop
+            await asyncio.to_thread(_write_dlq, dead)
+        except Exception as e:
+            # park them in the outbox so they are never resent; a later pass retries the write
+            logger.error("Outbox DLQ write failed", count=len(dead), error=str(e))
+            for msg in dead:
+                msg["dead"] = True
+                msg["dlq_failures"] = msg.get("dlq_failures", 0) + 1
+                pipe.hset(MSG_KEY, msg["id"], json.dumps(msg))
+                pipe.zadd(DUE_KEY, {msg["id"]: _now_ms() + int(backoff(msg["dlq_failures"]) * 1000)})
+        else:
+            OUTBOX_ATTEMPTS.labels(outcome="dead").inc(len(dead))
+            logger.error("Outbox messages moved to DLQ", count=len(dead))
+            done.extend(m["id"] for m in dead)
+    if done:
+        pipe.zrem(DUE_KEY, *done)
+        pipe.hdel(MSG_KEY, *done)
+    await pipe.execute()
+    return len(messages)
+
+async def _run_dispatcher() -> None:
+    while True:
+        try:
+            # a full batch means more are probably due – go again without sleeping
+            if await dispatch_once() < min(BATCH, lease_capacity()):
+                await asyncio.sleep(POLL_S)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Outbox dispatcher failed", error=str(e))
+            await asyncio.sleep(1)
+
+def start_dispatcher() -> "asyncio.Task[None]":
+    """Start (once per event loop) the background task that drains the outbox."""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.done():
+        _dispatcher = asyncio.get_running_loop().create_task(_run_dispatcher())
+    return _dispatcher
+
+def get_redis() -> "aioredis.Redis":
+    return _redis
@@ -1,63 +1,39 @@
-import os
-import time
-try:
-    from sendgrid import SendGridAPIClient
-except ImportError:               # local dev without SendGrid wheel
-    SendGridAPIClient = None
-try:
-    from sendgrid.helpers.mail import Mail
-except ImportError:               # local dev without SendGrid wheel
-    Mail = None
-from functools import lru_cache
-try:
-    from google.cloud import firestore
-except ImportError:               # local dev without Firestore wheel
-    firestore = None
-import os
+from emaillm.core import render
+from emaillm.email import outbox
+# DLQ handling lives with the outbox dispatcher; re-exported for callers of this module
+from emaillm.email.outbox import DLQ_COLLECTION, get_firestore_client  # noqa: F401
 
-SENDGRID_API_KEY = os.getenv("SENDGRID_SIGNING_KEY")
+FROM_ADDR = "no-reply@emaillm.com"
 
-DLQ_COLLECTION = "emails_dlq"
 
-@lru_cache
-def get_firestore_client():
-    try:
-        return firestore.Client()
-    except Exception:
-        # Allow local runs with emulator only
-        if os.getenv("FIRESTORE_EMULATOR_HOST"):
-            return firestore.Client(project="test-project")
-        raise
+async def send_email(to, subject, html, text, max_retries=3):
+    """
+    Queue a reply in the outbox and return its id.
 
-
-def send_email(to, subject, html, text, max_retries=3):
-    message = Mail(
-        from_email="no-reply@emaillm.com",
-        to_emails=to,
+    Delivery, retries with backoff and the move to `emails_dlq` after
+    `max_retries` failed attempts happen in the outbox dispatcher, so the
+    caller never waits on SendGrid.
+    """
+    return await outbox.enqueue(
+        to_addr=to,
         subject=subject,
-        html_content=html,
-        plain_text_content=text,
+        body_text=text,
+        body_html=html,
+        max_attempts=max_retries,
+        from_addr=FROM_ADDR,
+    )
+
+
+async def send_overquota_notice(to, retry_after):
+    """Queue the "quota exceeded" notice (templates/overquota_email.html)."""
+    hours = max(1, round(retry_after / 3600))
+    return await outbox.enqueue(
+        to_addr=to,
+        subject="Your EmailLM quota is used up",
+        body_text=(
+            "You have exceeded your usage quota for your current pricing plan. "
+            f"Please upgrade your plan or wait until your quota resets (in about {hours} h)."
+        ),
+        body_html=render.render_template("overquota_email.html"),
+        from_addr=FROM_ADDR,
     )
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            sg = SendGridAPIClient(SENDGRID_API_KEY)
-            response = sg.send(message)
-            if response.status_code >= 200 and response.status_code < 300:
-                return response
-            else:
-                raise Exception(f"SendGrid error: {response.status_code}")
-        except Exception as e:
-            attempt += 1
-            if attempt == max_retries:
-                # Move to DLQ
-                get_firestore_client().collection(DLQ_COLLECTION).add({
-                    "to": to,
-                    "subject": subject,
-                    "html": html,
-                    "text": text,
-                    "error": str(e),
-                    "timestamp": firestore.SERVER_TIMESTAMP,
-                })
-                raise
-            time.sleep(2 ** attempt)  # exponential backoff
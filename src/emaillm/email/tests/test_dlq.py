@@ -0,0 +1,102 @@
+# allows running without heavy wheels
+from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
+
+import asyncio
+from unittest.mock import patch, AsyncMock
+
+from emaillm.email import dlq
+
+class _Snap:
+    def __init__(self, doc_id, data):
+        self.id, self._data = doc_id, data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class _Doc:
+    def __init__(self, store, doc_id):
+        self._store, self.id = store, doc_id
+
+    def get(self):
+        return _Snap(self.id, self._store.get(self.id))
+
+    def set(self, data):
+        self._store[self.id] = dict(data)
+
+class _Query:
+    def __init__(self, store, after=None, size=None):
+        self._store, self._after, self._size = store, after, size
+
+    def order_by(self, field):
+        assert field == "__name__"
+        return self
+
+    def limit(self, size):
+        return _Query(self._store, self._after, size)
+
+    def start_after(self, values):
+        return _Query(self._store, values["__name__"].id, self._size)
+
+    def stream(self):
+        ids = sorted(i for i in self._store if self._after is None or i > self._after)
+        return [_Snap(i, self._store[i]) for i in ids[:self._size]]
+
+class _Collection(_Query):
+    def document(self, doc_id):
+        return _Doc(self._store, doc_id)
+
+class _Batch:
+    def __init__(self, db):
+        self._db, self._ops = db, []
+
+    def delete(self, doc):
+        self._ops.append(doc)
+
+    def commit(self):
+        self._db.commits += 1
+        for doc in self._ops:
+            doc._store.pop(doc.id, None)
+
+class FakeFirestore:
+    """Just enough of the Firestore client for paging, batches and checkpoints."""
+
+    def __init__(self):
+        self.collections, self.commits = {}, 0
+
+    def collection(self, name):
+        return _Collection(self.collections.setdefault(name, {}))
+
+    def batch(self):
+        return _Batch(self)
+
+def _seed(db, n, bad=()):
+    docs = db.collections.setdefault(dlq.DLQ_COLLECTION, {})
+    for i in range(n):
+        to = f"bad{i}@x.com" if i in bad else f"u{i}@x.com"
+        docs[f"m{i:03d}"] = {"to": to, "subject": "Re: hi", "text": "hello", "html": None}
+
+async def _send(*, to_addr, **kw):
+    if to_addr.startswith("bad"):
+        raise RuntimeError("SendGrid 400")
+
+@patch("emaillm.email.dlq.emailer.send_email", new_callable=AsyncMock, side_effect=_send)
+def test_replay_deletes_successes_and_keeps_failures(mock_send):
+    db = FakeFirestore()
+    _seed(db, 5, bad={2})
+    state = asyncio.run(dlq.replay("r1", db=db, page_size=2, rate=1000))
+    assert (state.sent, state.failed, state.done) == (4, 1, True)
+    assert list(db.collections[dlq.DLQ_COLLECTION]) == ["m002"]
+    assert db.collections[dlq.CHECKPOINT_COLLECTION]["r1"]["cursor"] == "m004"
+    assert mock_send.await_count == 5
+
+@patch("emaillm.email.dlq.emailer.send_email", new_callable=AsyncMock, side_effect=_send)
+def test_replay_resumes_from_checkpoint(mock_send):
+    db = FakeFirestore()
+    _seed(db, 5, bad={0})
+    first = asyncio.run(dlq.replay("r2", db=db, page_size=2, rate=1000, limit=2))
+    assert (first.cursor, first.done) == ("m001", False)
+    # the failed m000 is behind the cursor, so the resumed run does not retry it
+    second = asyncio.run(dlq.replay("r2", db=db, page_size=2, rate=1000))
+    assert (second.sent, second.failed, second.done) == (4, 1, True)
+    assert mock_send.await_count == 5
@@ -1,30 +1,150 @@
 # allows running without heavy wheels
 from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
 
+import asyncio
+import json
+
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+from emaillm.email import outbox
 from emaillm.email.send_email import send_email
 
-@patch("emaillm.email.send_email.SendGridAPIClient")
-def test_send_email_success(mock_sendgrid):
-    mock_instance = mock_sendgrid.return_value
-    mock_instance.send.return_value.status_code = 202
-    send_email("test@example.com", "Test", "<b>hi</b>", "hi")
-    mock_instance.send.assert_called_once()
-
-@patch("emaillm.email.send_email.SendGridAPIClient")
-def test_send_email_retries_and_dlq(mock_sendgrid):
-    mock_instance = mock_sendgrid.return_value
-    # Always fail
-    mock_instance.send.side_effect = Exception("fail!")
-    # Patch get_firestore_client to return a MagicMock with a collection().add() method
-    import emaillm.email.send_email as send_email_mod
+@patch("emaillm.email.outbox.enqueue", new_callable=AsyncMock, return_value="abc")
+def test_send_email_success(mock_enqueue):
+    assert asyncio.run(send_email("test@example.com", "Test", "<b>hi</b>", "hi")) == "abc"
+    mock_enqueue.assert_awaited_once_with(
+        to_addr="test@example.com", subject="Test", body_text="hi",
+        body_html="<b>hi</b>", max_attempts=3, from_addr="no-reply@emaillm.com",
+    )
+
+def _message(attempts, max_attempts=3):
+    return {"id": "m1", "to": "test@example.com", "subject": "Test", "text": "hi",
+            "html": "<b>hi</b>", "attempts": attempts, "max_attempts": max_attempts, "error": None}
+
+def _pipeline(redis):
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    redis.pipeline = MagicMock(return_value=pipe)
+    return pipe
+
+@patch("emaillm.email.outbox.enqueue", new_callable=AsyncMock, return_value="n1")
+def test_overquota_notice_uses_template(mock_enqueue):
+    from emaillm.email.send_email import send_overquota_notice
+    assert asyncio.run(send_overquota_notice("bob@example.com", 5 * 3600)) == "n1"
+    kwargs = mock_enqueue.call_args.kwargs
+    assert kwargs["to_addr"] == "bob@example.com"
+    assert "Quota Exceeded" in kwargs["body_html"]
+    assert "about 5 h" in kwargs["body_text"]
+
+@patch("emaillm.email.outbox.emailer.send_email", new_callable=AsyncMock, side_effect=Exception("fail!"))
+def test_send_email_retries_with_backoff(mock_send):
+    redis = MagicMock()
+    redis.eval = AsyncMock(return_value=[json.dumps(_message(attempts=0))])
+    pipe = _pipeline(redis)
+    with patch.object(outbox, "_redis", redis):
+        assert asyncio.run(outbox.dispatch_once()) == 1
+    mock_send.assert_awaited_once()
+    stored = json.loads(pipe.hset.call_args.args[2])
+    assert stored["attempts"] == 1 and stored["error"] == "fail!"
+    pipe.zadd.assert_called_once()
+    pipe.zrem.assert_not_called()
+
+@patch("emaillm.email.outbox.emailer.send_email", new_callable=AsyncMock, side_effect=Exception("fail!"))
+def test_send_email_retries_and_dlq(mock_send):
+    redis = MagicMock()
+    redis.eval = AsyncMock(return_value=[json.dumps(_message(attempts=2))])
+    pipe = _pipeline(redis)
     mock_firestore_client = MagicMock()
-    mock_collection = mock_firestore_client.collection.return_value
-    mock_collection.add = MagicMock()
-    send_email_mod.get_firestore_client.cache_clear()
-    send_email_mod.get_firestore_client = MagicMock(return_value=mock_firestore_client)
-    with pytest.raises(Exception):
-        send_email("test@example.com", "Test", "<b>hi</b>", "hi", max_retries=3)
-    assert mock_instance.send.call_count == 3
-    mock_collection.add.assert_called_once()
+    mock_batch = mock_firestore_client.batch.return_value
+    with patch.object(outbox, "_redis", redis), \
+         patch.object(outbox, "get_firestore_client", return_value=mock_firestore_client):
+        asyncio.run(outbox.dispatch_once())
+    mock_firestore_client.collection.assert_called_once_with(outbox.DLQ_COLLECTION)
+    mock_batch.set.assert_called_once()
+    assert mock_batch.set.call_args.args[1]["attempts"] == 3
+    mock_batch.commit.assert_called_once()
+    pipe.zrem.assert_called_once_with(outbox.DUE_KEY, "m1")
+    pipe.hdel.assert_called_once_with(outbox.MSG_KEY, "m1")
+
+@patch("emaillm.email.outbox.emailer.send_email", new_callable=AsyncMock, side_effect=Exception("fail!"))
+def test_failed_dlq_write_parks_the_message_without_resending(mock_send):
+    redis = MagicMock()
+    redis.eval = AsyncMock(return_value=[json.dumps(_message(attempts=2))])
+    pipe = _pipeline(redis)
+    broken = MagicMock()
+    broken.batch.return_value.commit.side_effect = Exception("firestore down")
+    with patch.object(outbox, "_redis", redis), \
+         patch.object(outbox, "get_firestore_client", return_value=broken):
+        asyncio.run(outbox.dispatch_once())
+        parked = json.loads(pipe.hset.call_args.args[2])
+        assert parked["dead"] and parked["attempts"] == 3 and parked["dlq_failures"] == 1
+        pipe.zrem.assert_not_called()
+
+        # next pass: only the DLQ write is retried, SendGrid is not called again
+        redis.eval = AsyncMock(return_value=[json.dumps(parked)])
+        pipe = _pipeline(redis)
+        broken.batch.return_value.commit.side_effect = None
+        asyncio.run(outbox.dispatch_once())
+    assert mock_send.await_count == 1
+    pipe.zrem.assert_called_once_with(outbox.DUE_KEY, "m1")
+
+def test_backoff_grows_and_is_capped():
+    assert 1 <= outbox.backoff(1) <= 2
+    assert 4 <= outbox.backoff(3) <= 8
+    assert outbox.backoff(50) <= outbox.BACKOFF_MAX
+
+class _FakeOutboxRedis:
+    """Due zset + message hash, with the claim script run in Python."""
+
+    def __init__(self):
+        self.due, self.msgs = {}, {}
+
+    async def eval(self, _script, _nkeys, _due_key, _msg_key, now, limit, lease_until):
+        ids = sorted((i for i, score in self.due.items() if score <= now), key=self.due.get)[:limit]
+        for i in ids:
+            self.due[i] = lease_until
+        return [self.msgs[i] for i in ids]
+
+    def pipeline(self, transaction=True):
+        ops = []
+        pipe = MagicMock()
+        pipe.hset = lambda _key, i, raw: ops.append(lambda: self.msgs.__setitem__(i, raw))
+        pipe.zadd = lambda _key, mapping: ops.append(lambda: self.due.update(mapping))
+        pipe.zrem = lambda _key, *ids: ops.append(lambda: [self.due.pop(i, None) for i in ids])
+        pipe.hdel = lambda _key, *ids: ops.append(lambda: [self.msgs.pop(i, None) for i in ids])
+
+        async def execute():
+            for op in ops:
+                op()
+        pipe.execute = execute
+        return pipe
+
+def test_slow_batch_is_not_resent_by_a_second_dispatcher():
+    sent = []
+    slots = asyncio.Semaphore(2)
+
+    async def slow_send(**kw):
+        async with slots:
+            await asyncio.sleep(0.05)       # every send takes the full timeout
+            sent.append(kw["to_addr"])
+
+    redis = _FakeOutboxRedis()
+
+    async def run():
+        for n in range(10):
+            await outbox.enqueue(to_addr=f"u{n}@example.com", subject="s", body_text="t")
+        first = asyncio.create_task(outbox.dispatch_once())
+        await asyncio.sleep(0.16)           # past the first pass's lease
+        while await outbox.dispatch_once():
+            pass
+        await first
+
+    with patch.object(outbox, "_redis", redis), \
+         patch.object(outbox, "LEASE_MS", 150), \
+         patch.object(outbox.emailer, "SENDGRID_TIMEOUT", 0.05), \
+         patch.object(outbox.emailer, "SENDGRID_MAX_CONCURRENCY", 2), \
+         patch.object(outbox.emailer, "COALESCE_WINDOW_MS", 0), \
+         patch.object(outbox.emailer, "send_email", side_effect=slow_send):
+        asyncio.run(run())
+    assert sorted(sent) == sorted(f"u{n}@example.com" for n in range(10))
+    assert not redis.due and not redis.msgs
@@ -1,3 +1,7 @@
 class OverQuotaError(Exception):
     """Raised when a user exceeds their allowed quota."""
     pass
+
+class ProviderUnavailableError(Exception):
+    """Raised when every provider in a model's fallback chain failed or is tripped."""
+    pass
@@ -1,16 +1,22 @@
-from typing import Optional, Dict, Any
-from email.utils import parseaddr
+from collections import deque
+from typing import Iterable, Optional, Dict, Any
 
 from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.responses import Response
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import structlog
 
-from emaillm.core.metrics import QUOTA_EXCEEDED
-from emaillm.core.quota import check_and_consume
+from emaillm.core.envelope import get_envelope, sniff_sender
+from emaillm.core import envelope as envelope_mod, idempotency, plan_resolver, quota as quota_mod
+from emaillm.core.metrics import QUOTA_EXCEEDED, QUOTA_NOTICES, QUOTA_SHED
+from emaillm.core.quota import QuotaResult, consume_async
+from emaillm.email.send_email import send_overquota_notice
 
 logger = structlog.get_logger()
 
+INBOUND_PATH = "/webhook/inbound"
+
 class OverQuotaError(Exception):
     """Raised when a user exceeds their plan’s rolling quota."""
 
@@ -31,89 +37,210 @@ def enforce_quota(plan: str, key: str, amount: int = 1, *, r=None):
 
 __all__ = ["enforce_quota", "OverQuotaError", "get_plan"]
 
-def get_plan(user_email: str) -> str:
-    """Stub pricing-plan lookup used in tests (real logic TBD)."""
-    return "free"
+async def get_plan(user_email: str) -> str:
+    """Pricing-plan slug for a sender (cached Firestore lookup, see core/plan_resolver)."""
+    return await plan_resolver.resolve(user_email)
+
+def over_quota_response(quota: QuotaResult) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": {
+            "error": "quota_exceeded",
+            "level": quota.level,
+            "message": "Quota exhausted – upgrade your plan or wait for the quota to reset"
+        }},
+        headers={
+            "Retry-After": str(quota.retry_after),
+            "X-RateLimit-Remaining": str(quota.remaining),
+            "X-RateLimit-Reset": str(quota.reset_at),
+        }
+    )
+
+async def notify_over_quota(user_id: str, quota: QuotaResult) -> None:
+    """E-mail the over-quota notice, at most once per sender per quota window."""
+    if "@" not in user_id or user_id == "unknown@example.com":
+        return
+    try:
+        if not await quota_mod.claim_notice(user_id, quota):
+            QUOTA_NOTICES.labels(outcome="suppressed").inc()
+            return
+        await send_overquota_notice(user_id, quota.retry_after)
+        QUOTA_NOTICES.labels(outcome="sent").inc()
+    except Exception as e:
+        QUOTA_NOTICES.labels(outcome="error").inc()
+        logger.error("Over-quota notice failed", user_id=user_id, error=str(e))
+
+async def read_body(receive: Receive) -> bytes:
+    """The whole request body, read once (raises ClientDisconnect if the client goes away)."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnect()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+def body_message(body: bytes) -> Message:
+    """A whole request body as one `http.request` message."""
+    return {"type": "http.request", "body": body, "more_body": False}
+
+def replay(chunks: Iterable[Message], receive: Receive) -> Receive:
+    """A receive channel that yields `chunks` (messages already received) in order, then defers to `receive`."""
+    pending = deque(chunks)
+
+    async def replayed() -> Message:
+        if pending:
+            return pending.popleft()
+        return await receive()
+    return replayed
+
+def shed_blocked(scope: Scope, first: Message) -> Optional[Response]:
+    """The 429 for a sender already known to be over quota, from the first body chunk alone."""
+    if first["type"] != "http.request":
+        return None
+    headers = dict(scope.get("headers") or ())
+    content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+    sender = sniff_sender(content_type, first.get("body", b""))
+    blocked = quota_mod.blocked(sender) if sender else None
+    if blocked is None:
+        return None
+    QUOTA_SHED.labels(stage="pre_parse").inc()
+    return over_quota_response(blocked)
+
+async def check_inbound(request: Request) -> Optional[Response]:
+    """The 429 for an over-quota inbound post, or None to let it through."""
+    try:
+        # Parsed once here and reused by the route via request.state
+        envelope = await get_envelope(request)
+    except HTTPException:
+        # Let the route report the malformed request (get_envelope raises the same error there)
+        return None
+    sender_email = envelope.sender
+    if not sender_email or "@" not in sender_email:
+        logger.warning("Invalid or missing 'from' field in request", from_field=envelope.from_addr)
+        # Use a default user ID for rate limiting purposes instead of failing
+        user_id = "unknown@example.com"
+    else:
+        user_id = sender_email
+
+    blocked = quota_mod.blocked(user_id)
+    if blocked is not None:
+        QUOTA_SHED.labels(stage="post_parse").inc()
+        envelope.discard()
+        return over_quota_response(blocked)
+
+    # SendGrid retries of a delivery we already have are answered without charging quota
+    idem_key = None
+    try:
+        idem_key = idempotency.key_for(envelope)
+        claim = await idempotency.claim(idem_key)
+    except Exception as e:
+        logger.warning("Idempotency check unavailable, processing anyway", error=str(e))
+        idem_key = None
+    else:
+        if not claim.owned:
+            envelope.discard()
+            return idempotency.replay_response(claim)
+    # the route completes (or fails) the claim
+    request.state.idem_key = idem_key
+
+    plan = None
+    try:
+        plan = await get_plan(user_id)
+        
+        # Check and consume quota
+        quota = await consume_async(user_id, plan=plan)
+    except Exception as e:
+        # Log the error but don't block the request
+        logger.error(
+            "Error in quota check",
+            error=str(e),
+            user_id=user_id,
+            path=request.url.path,
+            method=request.method
+        )
+        # Continue with the request even if quota check fails
+        return None
+    
+    if not quota.allowed:
+        # Log quota exceeded event
+        logger.warning(
+            "Quota exceeded",
+            user_id=user_id,
+            plan=plan,
+            level=quota.level,
+            path=request.url.path,
+            method=request.method,
+            retry_after=quota.retry_after
+        )
+        
+        # Record metric
+        QUOTA_EXCEEDED.labels(
+            user_id=user_id or "unknown",
+            quota_type=plan or "unknown"
+        ).inc()
+
+        await quota_mod.remember_block(user_id, quota)
+        await notify_over_quota(user_id, quota)
+        if idem_key:
+            # let the retry after the reset process it
+            await idempotency.fail(idem_key, "quota_exceeded")
+        envelope.discard()
+        return over_quota_response(quota)
+    return None
 
-class QuotaMiddleware(BaseHTTPMiddleware):
+class QuotaMiddleware:
     """
     Middleware to enforce rate limits and quotas for API requests.
     
     This middleware checks if the user has sufficient quota before processing the request.
     If quota is exceeded, it returns a 429 Too Many Requests response.
+
+    Plain ASGI: repeat offenders are turned away on the first body chunk,
+    before the rest is received; otherwise the inbound body is read once and
+    replayed to the route (in streaming mode the route uses the envelope
+    parsed here instead), and responses pass straight through without being
+    copied.
     """
-    
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        # Skip quota check for certain paths
-        if request.url.path == "/metrics" or request.method == "OPTIONS":
-            return await call_next(request)
-        
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Only the inbound webhook is metered; /metrics, OPTIONS and the rest pass through
+        if scope["type"] != "http" or scope["path"] != INBOUND_PATH or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        first = await receive()
+        response = shed_blocked(scope, first)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+        receive = replay([first], receive)
+
+        drained = False
+        if envelope_mod.STREAMING:
+            # the parser consumes the stream; the route reads request.state.envelope
+            async def tracked() -> Message:
+                nonlocal drained
+                message = await receive()
+                drained = drained or (message["type"] == "http.request" and not message.get("more_body", False))
+                return message
+
+            request = Request(scope, tracked)
+            downstream = receive
+        else:
+            try:
+                body = await read_body(receive)
+            except ClientDisconnect:
+                return
+            request = Request(scope, replay([body_message(body)], receive))
+            downstream = replay([body_message(body)], receive)
+
         try:
-            # For inbound email webhook
-            if request.url.path == "/webhook/inbound":
-                form = await request.form()
-                from_field = form.get("from", "")
-                # Parse email using the same method as in inbound_email.py
-                sender_email = parseaddr(from_field)[1]
-                if not sender_email or "@" not in sender_email:
-                    logger.warning("Invalid or missing 'from' field in request", from_field=from_field)
-                    # Use a default user ID for rate limiting purposes instead of failing
-                    user_id = "unknown@example.com"
-                else:
-                    user_id = sender_email.lower()
-                
-                try:
-                    # Get user's plan (in a real app, this would come from a user database)
-                    plan = get_plan(user_id)
-                    
-                    # Check and consume quota
-                    has_quota = check_and_consume(user_id, plan=plan)
-                    
-                    if not has_quota:
-                        # Log quota exceeded event
-                        logger.warning(
-                            "Quota exceeded",
-                            user_id=user_id,
-                            plan=plan,
-                            path=request.url.path,
-                            method=request.method
-                        )
-                        
-                        # Record metric
-                        QUOTA_EXCEEDED.labels(
-                            user_id=user_id or "unknown",
-                            quota_type=plan or "unknown"
-                        ).inc()
-                        
-                        raise HTTPException(
-                            status_code=429,
-                            detail={
-                                "error": "quota_exceeded",
-                                "message": "Quota exhausted – upgrade your plan or wait for the quota to reset"
-                            }
-                        )
-                except Exception as e:
-                    # Log the error but don't block the request
-                    logger.error(
-                        "Error in quota check",
-                        error=str(e),
-                        user_id=user_id,
-                        path=request.url.path,
-                        method=request.method
-                    )
-                    # Continue with the request even if quota check fails
-                    pass
-            
-            # For other endpoints, you can add additional quota checks here
-            # For example, for API endpoints with API keys
-            
-            # If we get here, quota check passed - proceed with the request
-            return await call_next(request)
-            
-        except HTTPException as http_exc:
-            # Re-raise HTTP exceptions (like our 429)
-            raise http_exc
-            
+            response = await check_inbound(request)
         except Exception as e:
             # Log unexpected errors but don't block the request
             logger.error(
@@ -123,4 +250,18 @@ class QuotaMiddleware(BaseHTTPMiddleware):
                 method=request.method
             )
             # Continue with the request even if quota check fails
-            return await call_next(request)
+            response = None
+
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        if drained:
+            # nothing left to read; an empty body keeps the route from waiting on it
+            downstream = replay([body_message(b"")], receive)
+        try:
+            await self.app(scope, downstream, send)
+        finally:
+            envelope = getattr(request.state, "envelope", None)
+            if envelope is not None:
+                envelope.discard()
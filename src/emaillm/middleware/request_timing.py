@@ -0,0 +1,70 @@
+import time
+
+import structlog
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from emaillm.core.metrics import REQUEST_DURATION, REQUEST_IN_PROGRESS
+
+logger = structlog.get_logger()
+
+class RequestTimingMiddleware:
+    """
+    Track request timing and metrics (REQUEST_DURATION, REQUEST_IN_PROGRESS).
+
+    Plain ASGI: the status code is read off `http.response.start` as it goes
+    by, so the response is never wrapped, buffered or copied.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Skip metrics endpoint
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path = scope["path"]
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        # Track in-progress requests
+        REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).inc()
+
+        start_time = time.time()
+        try:
+            await self.app(scope, receive, send_wrapper)
+
+            # Log the request
+            logger.info(
+                "Request completed",
+                method=method,
+                path=path,
+                status_code=status_code,
+                duration_seconds=time.time() - start_time
+            )
+        except Exception as e:
+            logger.error(
+                "Request failed",
+                method=method,
+                path=path,
+                status_code=status_code,
+                error=str(e),
+                duration_seconds=time.time() - start_time
+            )
+            raise
+        finally:
+            # Record metrics
+            duration = time.time() - start_time
+            REQUEST_DURATION.labels(
+                method=method,
+                endpoint=path,
+                status_code=status_code
+            ).observe(duration)
+            REQUEST_IN_PROGRESS.labels(method=method, endpoint=path).dec()
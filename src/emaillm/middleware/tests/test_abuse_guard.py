@@ -0,0 +1,43 @@
+# allows running without heavy wheels
+from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from emaillm.core.abuse import AbuseGuard
+from emaillm.middleware.abuse_guard import AbuseGuardMiddleware
+
+def _client(limits):
+    app = FastAPI()
+    seen = []
+
+    @app.post("/webhook/inbound")
+    async def inbound(request: Request):
+        form = await request.form()
+        seen.append(form.get("from"))
+        return {"status": "accepted"}
+
+    app.add_middleware(AbuseGuardMiddleware, guard=AbuseGuard(limits, window_s=60))
+    return TestClient(app), seen
+
+def test_flooding_domain_gets_cheap_429_and_others_pass():
+    client, seen = _client({"ip": 0, "domain": 3, "timestamp": 0})
+    codes = [client.post("/webhook/inbound", data={"from": f"u{i}@flood.example"}).status_code for i in range(5)]
+    assert codes == [200, 200, 200, 429, 429]
+    # the body chunk used for sniffing still reaches the route intact
+    assert seen == ["u0@flood.example", "u1@flood.example", "u2@flood.example"]
+    assert client.post("/webhook/inbound", data={"from": "bob@fine.example"}).status_code == 200
+
+def test_replayed_signed_delivery_is_refused_before_the_body():
+    client, seen = _client({"ip": 0, "domain": 0, "timestamp": 1})
+    signed = {"X-Twilio-Email-Event-Webhook-Timestamp": "1700000000"}
+    # many deliveries signed in the same second are not replays
+    for i in range(5):
+        headers = {**signed, "X-Twilio-Email-Event-Webhook-Signature": f"sig-{i}"}
+        assert client.post("/webhook/inbound", data={"from": "a@b.c"}, headers=headers).status_code == 200
+    resp = client.post("/webhook/inbound", data={"from": "a@b.c"},
+                       headers={**signed, "X-Twilio-Email-Event-Webhook-Signature": "sig-0"})
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "60"
+    assert resp.json()["detail"]["error"] == "rate_limited"
+    assert len(seen) == 5
@@ -2,7 +2,7 @@
 from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
 
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from emaillm.middleware.quota_enforcement import enforce_quota, OverQuotaError
 
 # Helper to mock Firestore user doc
@@ -13,6 +13,13 @@ class MockUserDoc:
     def to_dict(self):
         return self._data
 
+@pytest.fixture(autouse=True)
+def _no_cached_blocks():
+    from emaillm.core import quota
+    quota._blocked.clear()
+    yield
+    quota._blocked.clear()
+
 @pytest.fixture
 def proceed():
     return MagicMock(return_value="ok")
@@ -28,3 +35,206 @@ def test_starter_user_under_monthly(get_plan, proceed):
     # starter plan: quota_month = 100
     get_plan.return_value = MagicMock(quota_week=None, quota_month=100)
     enforce_quota("starter", "test-user")
+
+def _app():
+    from fastapi import FastAPI
+    from emaillm.middleware.quota_enforcement import QuotaMiddleware
+    app = FastAPI()
+    app.add_middleware(QuotaMiddleware)
+
+    @app.post("/webhook/inbound")
+    async def inbound():
+        return {"status": "accepted"}
+    return app
+
+@patch("emaillm.middleware.quota_enforcement.notify_over_quota", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_over_quota_returns_429_with_retry_after(consume, notify):
+    import time
+    from fastapi.testclient import TestClient
+    from emaillm.core.quota import QuotaResult
+    consume.return_value = QuotaResult(allowed=False, remaining=0, reset_at=int(time.time()) + 120)
+    resp = TestClient(_app()).post("/webhook/inbound", data={"from": "Bob <bob@example.com>"})
+    assert resp.status_code == 429
+    assert resp.json()["detail"]["error"] == "quota_exceeded"
+    assert 110 <= int(resp.headers["Retry-After"]) <= 120
+    assert resp.headers["X-RateLimit-Remaining"] == "0"
+    consume.assert_awaited_once_with("bob@example.com", plan="free")
+
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_under_quota_passes_through(consume):
+    from fastapi.testclient import TestClient
+    from emaillm.core.quota import QuotaResult
+    consume.return_value = QuotaResult(allowed=True, remaining=5, reset_at=0)
+    resp = TestClient(_app()).post("/webhook/inbound", data={"from": "bob@example.com"})
+    assert resp.status_code == 200
+
+@patch("emaillm.middleware.quota_enforcement.notify_over_quota", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.get_envelope")
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_repeat_offender_is_shed_before_parsing(consume, get_envelope, notify):
+    import time
+    from fastapi.testclient import TestClient
+    from emaillm.core.envelope import get_envelope as real_get_envelope
+    from emaillm.core.metrics import QUOTA_SHED
+    from emaillm.core.quota import QuotaResult
+    consume.return_value = QuotaResult(allowed=False, remaining=0, reset_at=int(time.time()) + 120, level="team")
+    get_envelope.side_effect = real_get_envelope
+    client = TestClient(_app())
+    shed = QUOTA_SHED.labels(stage="pre_parse")._value.get()
+
+    first = client.post("/webhook/inbound", data={"from": "Bob <bob@example.com>"})
+    assert first.status_code == 429 and first.json()["detail"]["level"] == "team"
+    notify.assert_awaited_once()
+
+    for _ in range(3):
+        again = client.post("/webhook/inbound", files={"from": (None, "bob@example.com"), "attachment": ("a.bin", b"x" * 4096)})
+        assert again.status_code == 429
+        assert again.json()["detail"]["level"] == "team"
+        assert 110 <= int(again.headers["Retry-After"]) <= 120
+    # neither the parser nor the quota store saw the repeats
+    assert get_envelope.call_count == 1 and consume.call_count == 1
+    assert QUOTA_SHED.labels(stage="pre_parse")._value.get() == shed + 3
+    notify.assert_awaited_once()
+
+@patch("emaillm.middleware.quota_enforcement.send_overquota_notice", new_callable=AsyncMock)
+@patch("emaillm.core.quota.claim_notice", new_callable=AsyncMock, side_effect=[True, False])
+def test_over_quota_notice_sent_once_per_window(claim_notice, send_notice):
+    import asyncio
+    import time
+    from emaillm.core.quota import QuotaResult
+    from emaillm.middleware.quota_enforcement import notify_over_quota
+    denied = QuotaResult(allowed=False, remaining=0, reset_at=int(time.time()) + 7200)
+
+    async def run():
+        await notify_over_quota("bob@example.com", denied)
+        await notify_over_quota("bob@example.com", denied)
+        await notify_over_quota("unknown@example.com", denied)
+
+    asyncio.run(run())
+    send_notice.assert_awaited_once_with("bob@example.com", denied.retry_after)
+    assert claim_notice.call_count == 2
+
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_route_gets_the_buffered_body_and_parsed_envelope(consume):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from emaillm.core.quota import QuotaResult
+    from emaillm.middleware.quota_enforcement import QuotaMiddleware
+    consume.return_value = QuotaResult(allowed=True, remaining=5, reset_at=0)
+    app = FastAPI()
+    app.add_middleware(QuotaMiddleware)
+
+    @app.post("/webhook/inbound")
+    async def inbound(request: Request):
+        body = await request.body()
+        return {"bytes": len(body), "from": request.state.envelope.from_addr}
+
+    payload = "from=bob%40example.com&to=ask%40emaillm.ai&text=" + "x" * 100_000
+    resp = TestClient(app).post("/webhook/inbound", content=payload,
+                                headers={"content-type": "application/x-www-form-urlencoded"})
+    assert resp.json() == {"bytes": len(payload), "from": "bob@example.com"}
+
+@patch("emaillm.core.envelope.STREAMING", True)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_streaming_route_reuses_envelope_without_waiting_for_body(consume):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from emaillm.core.quota import QuotaResult
+    from emaillm.middleware.quota_enforcement import QuotaMiddleware
+    consume.return_value = QuotaResult(allowed=True, remaining=5, reset_at=0)
+    app = FastAPI()
+    app.add_middleware(QuotaMiddleware)
+
+    @app.post("/webhook/inbound")
+    async def inbound(request: Request):
+        return {"rest": len(await request.body()), "from": request.state.envelope.from_addr}
+
+    resp = TestClient(app).post("/webhook/inbound", files={"from": (None, "bob@example.com"), "to": (None, "ask@emaillm.ai")})
+    assert resp.json() == {"rest": 0, "from": "bob@example.com"}
+
+@patch("emaillm.middleware.quota_enforcement.idempotency.claim", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_sendgrid_retry_is_answered_without_charging_quota(consume, claim):
+    from fastapi.testclient import TestClient
+    from emaillm.core import idempotency
+    client = TestClient(_app())
+    claim.return_value = idempotency.Claim(owned=False, state=idempotency.DONE,
+                                           outcome={"status_code": 200, "body": {"status": "accepted"}})
+    resp = client.post("/webhook/inbound", data={"from": "bob@example.com", "message_id": "<m1@x>"})
+    assert resp.status_code == 200 and resp.json() == {"status": "accepted"}
+
+    # still running elsewhere: a non-2xx so SendGrid retries instead of dropping it
+    claim.return_value = idempotency.Claim(owned=False, state=idempotency.IN_PROGRESS)
+    resp = client.post("/webhook/inbound", data={"from": "bob@example.com", "message_id": "<m1@x>"})
+    assert resp.status_code == 409 and resp.headers["Retry-After"] == str(idempotency.LOCK_TTL)
+    consume.assert_not_called()
+
+@patch("emaillm.middleware.quota_enforcement.notify_over_quota", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.idempotency.fail", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.idempotency.claim", new_callable=AsyncMock)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_over_quota_releases_the_claim(consume, claim, fail, notify):
+    import time
+    from fastapi.testclient import TestClient
+    from emaillm.core import idempotency
+    from emaillm.core.quota import QuotaResult
+    claim.return_value = idempotency.Claim(owned=True)
+    consume.return_value = QuotaResult(allowed=False, remaining=0, reset_at=int(time.time()) + 60)
+    resp = TestClient(_app()).post("/webhook/inbound", data={"from": "bob@example.com", "message_id": "<m2@x>"})
+    assert resp.status_code == 429
+    fail.assert_awaited_once_with("idem:inbound:mid:m2@x", "quota_exceeded")
+
+@patch("emaillm.core.envelope.STREAMING", True)
+@patch("emaillm.core.envelope.MAX_BYTES", 100)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_streamed_body_over_the_limit_is_reported_as_413(consume):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from emaillm.core.envelope import get_envelope
+    from emaillm.middleware.quota_enforcement import QuotaMiddleware
+    app = FastAPI()
+    app.add_middleware(QuotaMiddleware)
+
+    @app.post("/webhook/inbound")
+    async def inbound(request: Request):
+        envelope = await get_envelope(request)
+        return {"from": envelope.from_addr}
+
+    def chunks():
+        yield b"From: bob@example.com\r\nTo: ask@emaillm.ai\r\nSubject: big\r\n\r\n"
+        for _ in range(10):
+            yield b"x" * 40
+
+    resp = TestClient(app).post("/webhook/inbound", content=chunks(), headers={"content-type": "message/rfc822"})
+    assert resp.status_code == 413
+    consume.assert_not_called()
+
+@patch("emaillm.core.envelope.STREAMING", True)
+@patch("emaillm.middleware.quota_enforcement.consume_async", new_callable=AsyncMock)
+def test_streamed_repeat_offender_is_shed_on_the_first_chunk(consume):
+    import asyncio
+    import time
+    from emaillm.core import quota
+    from emaillm.core.quota import QuotaResult
+    from emaillm.middleware.quota_enforcement import QuotaMiddleware
+    asyncio.run(quota.remember_block("bob@example.com",
+                                     QuotaResult(allowed=False, remaining=0, reset_at=int(time.time()) + 60)))
+    route = AsyncMock()
+    chunks = [b"From: bob@example.com\r\nTo: ask@emaillm.ai\r\n\r\n", b"x" * 4096, b"x" * 4096]
+    received, sent = [], []
+
+    async def receive():
+        received.append(chunks.pop(0))
+        return {"type": "http.request", "body": received[-1], "more_body": bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/webhook/inbound", "query_string": b"",
+             "headers": [(b"content-type", b"message/rfc822")]}
+    asyncio.run(QuotaMiddleware(route)(scope, receive, send))
+    assert sent[0]["status"] == 429
+    assert len(received) == 1           # the rest of the body was never read
+    route.assert_not_called()
+    consume.assert_not_called()
@@ -0,0 +1,40 @@
+# allows running without heavy wheels
+from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from emaillm.core.metrics import REQUEST_DURATION, REQUEST_IN_PROGRESS
+from emaillm.middleware.request_timing import RequestTimingMiddleware
+
+def _count(method, path, status):
+    for metric in REQUEST_DURATION.collect():
+        for sample in metric.samples:
+            if (sample.name.endswith("_count") and sample.labels["endpoint"] == path
+                    and sample.labels["status_code"] == str(status) and sample.labels["method"] == method):
+                return sample.value
+    return 0
+
+def test_records_duration_by_status_and_releases_in_progress():
+    app = FastAPI()
+    app.add_middleware(RequestTimingMiddleware)
+
+    @app.get("/timed")
+    async def timed():
+        return {"ok": True}
+
+    @app.get("/teapot")
+    async def teapot():
+        raise HTTPException(status_code=418)
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    client = TestClient(app, raise_server_exceptions=False)
+    before = (_count("GET", "/timed", 200), _count("GET", "/teapot", 418), _count("GET", "/boom", 500))
+    client.get("/timed")
+    client.get("/teapot")
+    assert client.get("/boom").status_code == 500
+    assert (_count("GET", "/timed", 200), _count("GET", "/teapot", 418), _count("GET", "/boom", 500)) == tuple(b + 1 for b in before)
+    assert REQUEST_IN_PROGRESS.labels(method="GET", endpoint="/timed")._value.get() == 0
@@ -0,0 +1,80 @@
+import asyncio
+import hmac
+import logging
+import os
+import uuid
+from dataclasses import asdict
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from pydantic import BaseModel, Field
+
+from emaillm.core import abuse
+from emaillm.email import dlq
+
+router = APIRouter(prefix="/admin")
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# run_id -> running replay task (per process); finished runs are read back from their checkpoint
+_runs: Dict[str, "asyncio.Task[dlq.ReplayState]"] = {}
+
+class ReplayRequest(BaseModel):
+    run_id: Optional[str] = None        # reuse to resume from its checkpoint
+    rate: float = Field(dlq.RATE, gt=0)
+    concurrency: int = Field(dlq.CONCURRENCY, gt=0)
+    limit: Optional[int] = Field(None, gt=0)
+    dry_run: bool = False
+
+def require_admin(authorization: Optional[str]) -> None:
+    # no token configured = admin endpoints are off
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def _finished(run_id: str, task: "asyncio.Task[dlq.ReplayState]") -> None:
+    # progress is checkpointed in Firestore; don't keep every finished task around
+    if _runs.get(run_id) is task:
+        del _runs[run_id]
+    if not task.cancelled() and task.exception() is not None:
+        logging.getLogger("emaillm").error(">> DLQ replay %s failed: %s", run_id, task.exception())
+
+@router.post("/dlq/replay", status_code=202)
+async def start_dlq_replay(body: ReplayRequest, authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
+    run_id = body.run_id or f"admin-{uuid.uuid4().hex[:8]}"
+    running = _runs.get(run_id)
+    if running is not None and not running.done():
+        raise HTTPException(status_code=409, detail=f"Replay {run_id} is already running")
+
+    task = _runs[run_id] = asyncio.get_running_loop().create_task(dlq.replay(
+        run_id,
+        rate=body.rate,
+        concurrency=body.concurrency,
+        limit=body.limit,
+        dry_run=body.dry_run,
+    ))
+    task.add_done_callback(lambda t: _finished(run_id, t))
+    logging.getLogger("emaillm").info(">> DLQ replay %s started", run_id)
+    return {"run_id": run_id, "status": "started"}
+
+@router.get("/dlq/replay/{run_id}")
+async def dlq_replay_status(run_id: str, authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
+    task = _runs.get(run_id)
+    state = await asyncio.to_thread(dlq.load_state, dlq.get_firestore_client(), run_id)
+    status = "running" if task is not None else ("finished" if state.done else "checkpointed")
+    return {"run_id": run_id, "status": status, **asdict(state)}
+
+@router.get("/abuse/top")
+async def abuse_top(k: int = Query(20, ge=1, le=500), authorization: Optional[str] = Header(None)):
+    """Heaviest IPs, sender domains and signature timestamps seen by this process."""
+    require_admin(authorization)
+    guard = abuse.get_guard()
+    return {
+        "window_seconds": guard.window_s,
+        "limits": guard.limits,
+        "top": guard.top(k),
+    }
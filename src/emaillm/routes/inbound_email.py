@@ -2,14 +2,9 @@ import os
 import hmac
 import hashlib
 import base64
-import json
 import logging
-import email.utils
-from email import policy
-from email.parser import BytesParser, Parser
-from email import message_from_bytes, message_from_string
 
-from fastapi import APIRouter, Request, HTTPException, UploadFile, Form, status
+from fastapi import APIRouter, Request, HTTPException
 from starlette.responses import JSONResponse
 
 try:
@@ -25,12 +20,19 @@ logging.basicConfig(level=logging.INFO,
 # project helpers
 from emaillm.core.routing import route_email
 from emaillm.core.llm import call_llm
-from emaillm.core.emailer import send_email
+from emaillm.core.render import render_reply
+from emaillm.email.send_email import send_email
+from emaillm.core import envelope as envelope_mod, idempotency, jobs
+from emaillm.core.envelope import InboundEnvelope, get_envelope
+from emaillm.middleware.quota_enforcement import get_plan
 
 router = APIRouter()
 
 SENDGRID_SIGNING_KEY = os.getenv("SENDGRID_SIGNING_KEY", "")
 ENABLE_DB = os.getenv("ENABLE_FIRESTORE", "false").lower() == "true"
+# "inline" answers inside the webhook; "queue" acks with 202 and leaves the
+# LLM round trip to `python -m emaillm.worker`
+INBOUND_MODE = os.getenv("INBOUND_MODE", "inline").lower()
 
 def verify_sendgrid_signature(request: Request, body: bytes) -> bool:
     signature = request.headers.get("X-Twilio-Email-Event-Webhook-Signature")
@@ -45,6 +47,12 @@ def verify_sendgrid_signature(request: Request, body: bytes) -> bool:
     except Exception:
         return False
 
+def verify_streamed_signature(request: Request) -> bool:
+    """Check the signature against the MAC computed while the body streamed in."""
+    signature = request.headers.get("X-Twilio-Email-Event-Webhook-Signature")
+    computed = getattr(request.state, "body_signature", None)
+    return bool(signature and computed) and hmac.compare_digest(signature, computed)
+
 @router.post("/webhook/inbound")
 async def inbound_email(request: Request):
     logger = logging.getLogger("emaillm")
@@ -53,236 +61,101 @@ async def inbound_email(request: Request):
     headers = dict(request.headers)
     logger.warning(">> Raw request headers: %s", headers)
     
-    # Get content type for request processing
-    content_type = headers.get("content-type", "")
-    
-    # Only read body for signature verification if needed
-    body = b''
-    if SENDGRID_SIGNING_KEY:
-        body = await request.body()
-        logger.warning(">> Raw request body (first 500 bytes): %s", body[:500])
-        if not verify_sendgrid_signature(request, body):
-            raise HTTPException(status_code=401, detail="Invalid signature")
-    
+    # QuotaMiddleware claims the delivery before charging quota; None if Redis was unavailable
+    claimed = hasattr(request.state, "idem_key")
+    idem_key = getattr(request.state, "idem_key", None)
     try:
-        content_type = content_type.lower()
-        payload = {}
-        
-        # Handle raw email (message/rfc822)
-        if "message/rfc822" in content_type:
-            try:
-                msg = BytesParser(policy=policy.default).parsebytes(body)
-                payload['from'] = msg.get('from', '')
-                payload['to'] = msg.get('to', '')
-                payload['subject'] = msg.get('subject', '')
-                
-                # Extract text/plain part
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == 'text/plain':
-                            payload['text'] = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                            break
-                    else:
-                        payload['text'] = ''
-                else:
-                    payload['text'] = msg.get_payload(decode=True).decode('utf-8', errors='replace')
-                    
-                logger.info("Processed raw email from %s to %s", payload.get('from'), payload.get('to'))
-                
-            except Exception as e:
-                logger.error("Error parsing raw email: %s", str(e), exc_info=True)
-                raise HTTPException(status_code=400, detail=f"Error parsing raw email: {e}")
-        
-        # Handle multipart/form-data (SendGrid's default)
-        elif "multipart/form-data" in content_type:
-            from starlette.datastructures import FormData, UploadFile
-            
-            # Log boundary and content type
-            logger.warning(">> Content-Type: %s", content_type)
-            
-            try:
-                # Try to parse the form data
-                form = await request.form()
-                logger.warning(">> Form data parsed successfully")
-                
-                # Log all form parts
-                for part in form.multi_items():
-                    k, v = part
-                    logger.warning(
-                        ">> Form part - key: %s, type: %s, value: %s",
-                        k,
-                        type(v).__name__,
-                        str(v)[:100] + '...' if isinstance(v, (str, bytes)) else v
-                    )
-                
-                # Handle raw email upload
-                if 'email' in form and hasattr(form['email'], 'file'):
-                    email_content = await form['email'].read()
-                    msg = BytesParser(policy=policy.default).parsebytes(email_content)
-                    
-                    # Extract headers
-                    payload['from'] = msg.get('from', '')
-                    payload['to'] = msg.get('to', '')
-                    payload['subject'] = msg.get('subject', '')
-                    
-                    # Extract body
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == 'text/plain':
-                                payload['text'] = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                                break
-                        else:
-                            payload['text'] = ''
-                    else:
-                        payload['text'] = msg.get_payload(decode=True).decode('utf-8', errors='replace')
-                else:
-                    # Process standard form fields
-                    wanted = {"from", "to", "subject", "text", "html"}
-                    for k, v in form.multi_items():
-                        kl = k.lower()
-                        if kl not in wanted:
-                            continue
-                        if isinstance(v, UploadFile):
-                            payload[kl] = await v.read()
-                        elif isinstance(v, bytes):
-                            payload[kl] = v.decode(errors="replace")
-                        elif not isinstance(v, str):
-                            payload[kl] = str(v)
-                        else:
-                            payload[kl] = v
-                
-                if not payload:
-                    logger.warning("No recognized email fields found in form data")
-                    raise HTTPException(
-                        status_code=422,
-                        detail="No recognised e-mail fields in form-data"
-                    )
-                    
-            except Exception as form_error:
-                logger.error("Error parsing form data: %s", str(form_error), exc_info=True)
-                raise HTTPException(
-                    status_code=422,
-                    detail=f"Error processing form data: {str(form_error)}"
-                )
-            
-            logger.debug("Form data received: %s", list(payload.keys()))
-            
-        # Handle JSON data (for testing)
-        elif "application/json" in content_type:
-            try:
-                # If we already read the body, parse it directly
-                if body:
-                    payload = json.loads(body.decode())
-                else:
-                    payload = await request.json()
-                logger.debug("JSON data received: %s", list(payload.keys()))
-            except json.JSONDecodeError as e:
-                logger.error("Error parsing JSON: %s", str(e))
-                raise HTTPException(status_code=422, detail="Invalid JSON data")
-        
-        # Handle URL-encoded form data
-        elif "application/x-www-form-urlencoded" in content_type:
-            try:
-                form_data = await request.form()
-                payload = dict(form_data)
-                
-                # Try to parse the 'email' field as raw email if present
-                if 'email' in payload and isinstance(payload['email'], str):
-                    try:
-                        msg = BytesParser(policy=policy.default).parsebytes(payload['email'].encode())
-                        payload['from'] = msg.get('from', '')
-                        payload['to'] = msg.get('to', '')
-                        payload['subject'] = msg.get('subject', '')
-                        payload['text'] = ''
-                        
-                        if msg.is_multipart():
-                            for part in msg.walk():
-                                if part.get_content_type() == 'text/plain':
-                                    payload['text'] = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                                    break
-                        else:
-                            payload['text'] = msg.get_payload(decode=True).decode('utf-8', errors='replace')
-                    except Exception as e:
-                        logger.warning("Failed to parse email field: %s", str(e))
-                        
-            except Exception as e:
-                logger.error("Error parsing form data: %s", str(e), exc_info=True)
-                raise HTTPException(status_code=400, detail="Invalid form data")
-        
-        # If we still don't have a payload, try to parse as raw email
-        if not payload:
-            try:
-                msg = message_from_bytes(body, policy=policy.default)
-                payload['from'] = msg.get('from', '')
-                payload['to'] = msg.get('to', '')
-                payload['subject'] = msg.get('subject', '')
-                
-                # Extract text/plain part
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == 'text/plain':
-                            payload['text'] = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                            break
-                    else:
-                        payload['text'] = ''
-                else:
-                    payload['text'] = msg.get_payload(decode=True).decode('utf-8', errors='replace')
-                    
-                logger.info("Processed raw email from %s to %s", payload.get('from'), payload.get('to'))
-                
-            except Exception as e:
-                logger.error(f"Unsupported content type: {content_type}")
-                logger.error(f"Failed to parse as raw email: {e}")
-                raise HTTPException(status_code=400, detail=f"Unsupported content type: {content_type}")
-        
-        # Log the received payload (without large binary data)
-        log_payload = {k: v for k, v in payload.items() if not isinstance(v, (bytes, bytearray))}
-        if 'email' in payload and isinstance(payload['email'], (bytes, bytearray)):
-            log_payload['email'] = f'<binary data {len(payload["email"])} bytes>'
-        logger.info(f"Received webhook payload: {json.dumps(log_payload, default=str, indent=2)}")
-        
-        # Extract email fields with fallbacks
-        from_email = payload.get('from', '')
-        to_email = payload.get('to', '')
-        subject = payload.get('subject', '')
-        text = payload.get('text', '')
-        
-        # Parse email addresses (handle "Name <email@example.com>" format)
-        if from_email:
-            from_email = email.utils.parseaddr(from_email)[1] or from_email
-        if to_email:
-            to_email = email.utils.parseaddr(to_email)[1] or to_email
+        # Only read body for signature verification if needed
+        if SENDGRID_SIGNING_KEY and envelope_mod.STREAMING:
+            # the streaming parser MACs the body while reading it
+            await get_envelope(request)
+            if not verify_streamed_signature(request):
+                raise HTTPException(status_code=401, detail="Invalid signature")
+        elif SENDGRID_SIGNING_KEY:
+            body = await request.body()
+            logger.warning(">> Raw request body (first 500 bytes): %s", body[:500])
+            if not verify_sendgrid_signature(request, body):
+                raise HTTPException(status_code=401, detail="Invalid signature")
+
+        # Parsed once – QuotaMiddleware has usually done it already
+        envelope = await get_envelope(request)
+        logger.info(
+            "Received webhook envelope: from=%s to=%s subject=%r message_id=%s attachments=%d",
+            envelope.from_addr, envelope.to_addr, envelope.subject,
+            envelope.message_id, len(envelope.attachments),
+        )
         
         # Validate required fields
-        if not from_email:
+        if not envelope.from_addr:
             logger.warning("Missing or invalid 'from' field in request")
             raise HTTPException(status_code=400, detail="Missing or invalid 'from' field")
             
-        if not to_email:
+        if not envelope.to_addr:
             logger.warning("Missing or invalid 'to' field in request")
             raise HTTPException(status_code=400, detail="Missing or invalid 'to' field")
         
-        # Process the email
-        # 1️⃣  Choose the model
-        model = route_email(payload.get("subject", ""), payload.get("text", ""))
-        logger.info(">> Routed to: %s", model)
-
-        # 2️⃣  Generate reply
-        reply_text = call_llm(model, payload)
-        logger.info(">> LLM reply length=%d chars", len(reply_text))
+        # SendGrid re-posts slow or failed deliveries – answer retries from the first outcome
+        if not claimed:
+            idem_key = idempotency.key_for(envelope)
+            try:
+                claim = await idempotency.claim(idem_key)
+            except Exception as e:
+                logger.warning("Idempotency check unavailable, processing anyway: %s", e)
+                idem_key = None
+            else:
+                if not claim.owned:
+                    return idempotency.replay_response(claim)
 
-        # 3️⃣  Send email via SendGrid
-        send_email(
-            to_addr=from_email,
-            subject=f"Re: {subject or ''}",
-            body_text=reply_text,
-        )
-        logger.info(">> Reply sent to %s", from_email)
+        if INBOUND_MODE == "queue":
+            # the plan picks the job's lane, so paid mail isn't queued behind a free-tier backlog
+            job_id = await jobs.enqueue(envelope.to_job(), plan=await get_plan(envelope.sender))
+            logger.info(">> Queued job %s for %s", job_id, envelope.from_addr)
+            body, status_code = {"status": "queued", "job_id": job_id}, 202
+        else:
+            await process_inbound(envelope)
+            body, status_code = {"status": "accepted"}, 200
 
-        return JSONResponse({"status": "accepted"}, status_code=200)
+        if idem_key:
+            await idempotency.complete(idem_key, {"status_code": status_code, "body": body})
+        return JSONResponse(body, status_code=status_code)
         
-    except HTTPException:
+    except HTTPException as e:
+        # a rejected post must not hold the claim taken in QuotaMiddleware
+        if idem_key:
+            await idempotency.fail(idem_key, str(e.detail))
         raise  # Re-raise HTTP exceptions
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
+        if idem_key:
+            await idempotency.fail(idem_key, str(e))
         raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        # spooled attachments are not needed past the request
+        if getattr(request.state, "envelope", None) is not None:
+            request.state.envelope.discard()
+
+
+async def process_inbound(envelope: InboundEnvelope) -> None:
+    """Route, answer and reply to one inbound e-mail (shared by the webhook and the worker)."""
+    logger = logging.getLogger("emaillm")
+
+    # 1️⃣  Choose the model
+    model = route_email(envelope.subject, envelope.text)
+    logger.info(">> Routed to: %s", model)
+
+    # 2️⃣  Generate reply – premium plans are scheduled ahead of free-tier floods
+    plan = await get_plan(envelope.sender)
+    reply_text = await call_llm(model, envelope.as_payload(), user_id=envelope.sender, plan=plan)
+    logger.info(">> LLM reply length=%d chars", len(reply_text))
+
+    # 3️⃣  Render text + HTML bodies (cached per reply)
+    rendered = render_reply(reply_text)
+
+    # 4️⃣  Hand the reply to the outbox; the dispatcher delivers it via SendGrid
+    outbox_id = await send_email(
+        to=envelope.from_addr,
+        subject=f"Re: {envelope.subject}",
+        html=rendered.html,
+        text=rendered.text,
+    )
+    logger.info(">> Reply %s queued for %s", outbox_id, envelope.from_addr)
@@ -0,0 +1,57 @@
+# allows running without heavy wheels
+from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
+
+from unittest.mock import patch, AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from emaillm.email.dlq import ReplayState
+from emaillm.routes import admin
+from emaillm.routes.admin import router
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+@patch("emaillm.routes.admin.ADMIN_TOKEN", "")
+def test_admin_disabled_without_token():
+    assert client.post("/admin/dlq/replay", json={}).status_code == 404
+
+@patch("emaillm.routes.admin.ADMIN_TOKEN", "s3cret")
+def test_admin_rejects_bad_token():
+    response = client.post("/admin/dlq/replay", json={}, headers={"Authorization": "Bearer nope"})
+    assert response.status_code == 401
+
+@patch("emaillm.routes.admin.ADMIN_TOKEN", "s3cret")
+@patch("emaillm.routes.admin.dlq.get_firestore_client")
+@patch("emaillm.routes.admin.dlq.load_state", return_value=ReplayState(cursor="m9", sent=9, done=True))
+@patch("emaillm.routes.admin.dlq.replay", new_callable=AsyncMock, return_value=ReplayState(cursor="m9", sent=9, done=True))
+def test_admin_starts_replay_and_reports_it(mock_replay, mock_load, mock_db):
+    headers = {"Authorization": "Bearer s3cret"}
+    response = client.post("/admin/dlq/replay", json={"run_id": "r1", "rate": 5}, headers=headers)
+    assert response.status_code == 202
+    assert response.json() == {"run_id": "r1", "status": "started"}
+    assert mock_replay.await_args.args == ("r1",)
+    assert mock_replay.await_args.kwargs["rate"] == 5
+
+    status = client.get("/admin/dlq/replay/r1", headers=headers).json()
+    assert status["status"] == "finished" and status["sent"] == 9
+    assert "r1" not in admin._runs          # finished runs are read back from the checkpoint
+
+@patch("emaillm.routes.admin.ADMIN_TOKEN", "s3cret")
+@patch("emaillm.routes.admin.dlq.replay", new_callable=AsyncMock)
+def test_admin_rejects_replay_that_could_not_progress(mock_replay):
+    headers = {"Authorization": "Bearer s3cret"}
+    for body in ({"concurrency": 0}, {"rate": 0}, {"rate": -1}, {"limit": 0}):
+        assert client.post("/admin/dlq/replay", json=body, headers=headers).status_code == 422
+    mock_replay.assert_not_called()
+
+@patch("emaillm.routes.admin.ADMIN_TOKEN", "s3cret")
+@patch("emaillm.routes.admin.abuse._guard", None)
+def test_admin_lists_heavy_hitters():
+    from emaillm.core import abuse
+    for _ in range(3):
+        abuse.get_guard().check("domain", "flood.example")
+    abuse.get_guard().check("domain", "fine.example")
+    body = client.get("/admin/abuse/top?k=1", headers={"Authorization": "Bearer s3cret"}).json()
+    assert body["top"]["domain"] == [{"key": "flood.example", "count": 3, "error": 0}]
@@ -3,7 +3,7 @@ from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-impor
 
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from emaillm.routes.inbound_email import router
 from fastapi import FastAPI
 
@@ -16,10 +16,10 @@ def client():
 
 @patch("emaillm.routes.inbound_email.ENABLE_DB", True)
 @patch("emaillm.routes.inbound_email.firestore.Client")
-@patch("emaillm.routes.inbound_email.send_email")
+@patch("emaillm.routes.inbound_email.send_email", new_callable=AsyncMock)
 
 @patch("emaillm.routes.inbound_email.verify_sendgrid_signature", return_value=True)
-@patch("emaillm.routes.inbound_email.call_llm", return_value="OK")
+@patch("emaillm.routes.inbound_email.call_llm", new_callable=AsyncMock, return_value="OK")
 def test_inbound_email_success(
     mock_call_llm,          # innermost (5)
     mock_verify,            # 4
@@ -40,3 +40,36 @@ def test_inbound_email_success(
     assert response.json()["status"] == "accepted"
     mock_firestore.return_value.collection.return_value.add.assert_called_once_with(payload)
     
+
+@patch("emaillm.routes.inbound_email.INBOUND_MODE", "queue")
+@patch("emaillm.routes.inbound_email.jobs.enqueue", new_callable=AsyncMock, return_value="1-0")
+@patch("emaillm.routes.inbound_email.call_llm")
+def test_inbound_email_queue_mode_acks_without_llm(mock_call_llm, mock_enqueue, client):
+    payload = {"from": "sender@example.com", "to": "to@example.com", "subject": "Hi", "text": "Hello"}
+    response = client.post("/webhook/inbound", json=payload)
+    assert response.status_code == 202
+    assert response.json() == {"status": "queued", "job_id": "1-0"}
+    mock_enqueue.assert_awaited_once_with(
+        {"from": "sender@example.com", "to": "to@example.com", "subject": "Hi", "text": "Hello", "message_id": ""},
+        plan="free",
+    )
+    mock_call_llm.assert_not_called()
+
+
+@patch("emaillm.routes.inbound_email.idempotency.complete", new_callable=AsyncMock)
+@patch("emaillm.routes.inbound_email.idempotency.claim", new_callable=AsyncMock)
+@patch("emaillm.routes.inbound_email.call_llm", new_callable=AsyncMock)
+def test_inbound_email_retry_replays_first_outcome(mock_call_llm, mock_claim, mock_complete, client):
+    from emaillm.core import idempotency
+    mock_claim.return_value = idempotency.Claim(
+        owned=False, state=idempotency.DONE,
+        outcome={"status_code": 200, "body": {"status": "accepted"}},
+    )
+    payload = {"from": "sender@example.com", "to": "to@example.com", "subject": "Hi",
+               "text": "Hello", "message_id": "<m1@example.com>"}
+    response = client.post("/webhook/inbound", json=payload)
+    assert response.status_code == 200
+    assert response.json() == {"status": "accepted"}
+    mock_claim.assert_awaited_once_with("idem:inbound:mid:m1@example.com")
+    mock_call_llm.assert_not_called()
+    mock_complete.assert_not_called()
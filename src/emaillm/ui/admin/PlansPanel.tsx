@@ -5,7 +5,7 @@ import { Button, Box } from "@mui/material";
 
 interface Plan {
   id: string;
-  price_cents: number;
+  price_cents: number | null;
   quota_month?: number;
   quota_week?: number;
   features: string[];
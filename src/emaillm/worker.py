@@ -0,0 +1,89 @@
+"""
+Inbound worker pool: `python -m emaillm.worker`
+
+Runs INBOUND_WORKER_CONCURRENCY consumers against the Redis Streams filled by
+`/webhook/inbound` in queue mode (INBOUND_MODE=queue), one per plan tier,
+read by weight (see core/jobs). Each consumer acks a job only after the reply
+went out, so a crash leaves it pending until another consumer reclaims it.
+The default runs as many consumers as the LLM scheduler has slots, so the
+scheduler always has calls from every tier to choose between.
+"""
+
+import asyncio
+import os
+import signal
+import socket
+
+import structlog
+
+from emaillm.core import cache, http, jobs, plan_resolver, render, scheduler, semantic, teams
+from emaillm.config import pricing_loader
+from emaillm.core.envelope import InboundEnvelope
+from emaillm.email import outbox
+from emaillm.routes.inbound_email import process_inbound
+
+logger = structlog.get_logger()
+
+CONCURRENCY      = int(os.getenv("INBOUND_WORKER_CONCURRENCY", scheduler.CONCURRENCY))
+BLOCK_MS         = int(os.getenv("INBOUND_WORKER_BLOCK_MS", 5000))
+RECLAIM_EVERY_S  = float(os.getenv("INBOUND_RECLAIM_INTERVAL_SECONDS", 30))
+
+async def handle(entry_id: str, job: jobs.Job, stream: str = jobs.STREAM) -> bool:
+    """Process one job; return True when it was acked."""
+    try:
+        await process_inbound(InboundEnvelope.from_job(job))
+    except Exception as e:
+        # leave it pending – it is retried once CLAIM_IDLE_MS has passed
+        logger.error("Inbound job failed", entry_id=entry_id, error=str(e))
+        return False
+    await jobs.ack(entry_id, stream)
+    return True
+
+async def consume(consumer: str, stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    next_reclaim = 0.0
+    while not stop.is_set():
+        try:
+            if loop.time() >= next_reclaim:
+                next_reclaim = loop.time() + RECLAIM_EVERY_S
+                for stream, entry_id, job in await jobs.reclaim(consumer):
+                    await handle(entry_id, job, stream)
+            for stream, entry_id, job in await jobs.read(consumer, count=1, block_ms=BLOCK_MS):
+                await handle(entry_id, job, stream)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Inbound consumer error", consumer=consumer, error=str(e))
+            await asyncio.sleep(1)
+
+async def run(concurrency: int = CONCURRENCY) -> None:
+    await jobs.ensure_group()
+    render.load_templates()
+    plan_resolver.start_listener()
+    teams.start_listener()
+    plans_watcher = pricing_loader.start_watcher()
+    listener = cache.start_invalidation_listener()
+    dispatcher = outbox.start_dispatcher() if outbox.DISPATCHER_ENABLED else None
+    if semantic.ENABLED:
+        await semantic.rebuild(cache.get_redis())
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info("Inbound worker started", consumers=concurrency, streams=sorted(jobs.lanes()))
+    try:
+        await asyncio.gather(*(consume(f"{prefix}-{i}", stop) for i in range(concurrency)))
+    finally:
+        listener.cancel()
+        plans_watcher.cancel()
+        plan_resolver.stop_listener()
+        teams.stop_listener()
+        if dispatcher is not None:
+            dispatcher.cancel()
+        await http.aclose_all()
+    logger.info("Inbound worker stopped")
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -20,6 +20,10 @@ if "google.cloud.firestore" not in sys.modules:
             if name not in self._collections:
                 self._collections[name] = MagicMock()
             return self._collections[name]
+
+        def get_all(self, refs):
+            # nothing is stored: every document reads as missing
+            return [types.SimpleNamespace(id=getattr(ref, "id", None), exists=False, to_dict=lambda: None) for ref in refs]
     fs_stub.Client = Client
     cloud_mod.firestore = fs_stub                  # attr access google.cloud.firestore
     sys.modules["google.cloud.firestore"] = fs_stub
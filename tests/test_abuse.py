@@ -0,0 +1,66 @@
+import random
+
+from emaillm.core.abuse import AbuseGuard, HeavyHitters, SpaceSaving, client_ip, delivery_key
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def test_space_saving_keeps_the_heavy_hitters_in_a_noisy_stream():
+    summary = SpaceSaving(capacity=32)
+    rng = random.Random(7)
+    stream = ["10.0.0.1"] * 500 + ["10.0.0.2"] * 300 + [f"198.51.{rng.randrange(256)}.{i}" for i in range(5000)]
+    rng.shuffle(stream)
+    for key in stream:
+        summary.add(key)
+    assert len(summary) == 32
+    for key, true_count in (("10.0.0.1", 500), ("10.0.0.2", 300)):
+        count, error = summary.count(key)
+        assert count - error <= true_count <= count
+
+def test_sliding_window_forgets_old_traffic():
+    clock = Clock()
+    hitters = HeavyHitters(window_s=60, capacity=8, clock=clock)
+    for _ in range(100):
+        hitters.hit("a")
+    clock.now += 90          # half of the previous window still overlaps
+    assert 45 <= hitters.hit("a") <= 56
+    clock.now += 200
+    assert hitters.hit("a") == 1
+
+def test_guard_only_blocks_keys_over_their_limit():
+    guard = AbuseGuard({"ip": 5, "domain": 0, "timestamp": 5}, window_s=60, clock=Clock())
+    assert [guard.check("ip", "203.0.113.9") for _ in range(5)] == [None] * 5
+    verdict = guard.check("ip", "203.0.113.9")
+    assert verdict.dimension == "ip" and verdict.retry_after == 60
+    assert guard.check("ip", "203.0.113.10") is None
+    assert all(guard.check("domain", "example.com") is None for _ in range(50))   # 0 = no limit
+    assert guard.top(1)["domain"] == [{"key": "example.com", "count": 50, "error": 0}]
+
+def test_allowlisted_domains_are_counted_but_never_refused():
+    guard = AbuseGuard({"ip": 0, "domain": 3, "timestamp": 0}, window_s=60, clock=Clock(),
+                       exempt={"domain": {"gmail.com"}})
+    assert all(guard.check("domain", "gmail.com") is None for _ in range(10))
+    assert guard.top(1)["domain"][0]["key"] == "gmail.com"
+    assert [guard.check("domain", "flood.example") is None for _ in range(4)] == [True, True, True, False]
+
+def test_delivery_key_needs_timestamp_and_signature():
+    assert delivery_key("1700000000", "") is None
+    assert delivery_key("1700000000", "sig-a") != delivery_key("1700000000", "sig-b")
+    assert delivery_key("1700000000", "sig-a").startswith("1700000000:")
+
+def test_evicted_keys_cannot_frame_a_normal_sender():
+    guard = AbuseGuard({"ip": 10, "domain": 10, "timestamp": 10}, window_s=60, capacity=4, clock=Clock())
+    for i in range(1000):
+        guard.check("ip", f"198.51.100.{i}")
+    # a newcomer inherits a large error term, but is judged on count - error
+    assert guard.check("ip", "192.0.2.1") is None
+
+def test_client_ip_honours_trusted_proxy_hops(monkeypatch):
+    scope = {"client": ("10.1.1.1", 5000),
+             "headers": [(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7, 35.191.0.1")]}
+    assert client_ip(scope) == "10.1.1.1"
+    monkeypatch.setattr("emaillm.core.abuse.TRUSTED_PROXIES", 2)
+    assert client_ip(scope) == "203.0.113.7"
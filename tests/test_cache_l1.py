@@ -0,0 +1,43 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from emaillm.core import cache
+
+def _redis(value, pttl):
+    r = MagicMock()
+    r.pipeline.return_value.execute = AsyncMock(return_value=[json.dumps(value), pttl])
+    r.delete = AsyncMock()
+    r.publish = AsyncMock()
+    return r
+
+def test_l2_hit_is_served_from_l1_afterwards():
+    cache._l1.clear()
+    r = _redis("cached answer", 60_000)
+    compute = AsyncMock()
+    with patch.object(cache, "_redis", r):
+        first = asyncio.run(cache.get_or_set("hot prompt", compute, "t"))
+        second = asyncio.run(cache.get_or_set("HOT   prompt", compute, "t"))
+    assert first == second == ("cached answer", True)
+    r.pipeline.assert_called_once()
+    compute.assert_not_awaited()
+
+def test_l1_respects_byte_and_entry_bounds():
+    l1 = cache._L1Cache(max_bytes=10, max_entries=2)
+    l1["a"] = ("1234", 60)
+    l1["b"] = ("1234", 60)
+    l1["c"] = ("12", 60)
+    assert len(l1) == 2 and "a" not in l1
+    l1["d"] = ("123456", 60)
+    assert "b" not in l1 and l1.currsize <= 10
+
+def test_invalidate_drops_l1_and_notifies_peers():
+    cache._l1.clear()
+    key = f"cache:t:{cache._digest('p')}"
+    cache._l1_store(key, json.dumps("old"), 60)
+    r = _redis("old", 60_000)
+    with patch.object(cache, "_redis", r):
+        asyncio.run(cache.invalidate("p", "t"))
+    assert key not in cache._l1
+    r.delete.assert_awaited_once_with(key)
+    r.publish.assert_awaited_once_with(cache._INVALIDATE_CHANNEL, key)
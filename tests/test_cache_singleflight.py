@@ -0,0 +1,116 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from emaillm.core import cache
+
+def _redis(leader=True, stored=None):
+    cache._l1.clear()
+    values = iter(stored or [None] * 100)
+    r = MagicMock()
+    r.get = AsyncMock(side_effect=lambda key: next(values))
+    r.pipeline.return_value.execute = AsyncMock(side_effect=lambda: [next(values), -2])
+    r.set = AsyncMock(return_value=leader)
+    r.setex = AsyncMock()
+    r.eval = AsyncMock()
+    r.publish = AsyncMock()
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.get_message = AsyncMock(return_value={"type": "message"})
+    pubsub.aclose = AsyncMock()
+    r.pubsub.return_value = pubsub
+    return r
+
+def test_concurrent_misses_compute_once():
+    calls = []
+    async def compute(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_set("Same  prompt", compute, "t") for _ in range(20)))
+
+    r = _redis()
+    with patch.object(cache, "_redis", r):
+        results = asyncio.run(run())
+    assert calls == ["Same  prompt"]
+    assert [v for v, _ in results] == ["answer"] * 20
+    assert sum(1 for _, cached in results if not cached) == 1
+    r.setex.assert_awaited_once()
+    r.publish.assert_awaited_once()
+    assert not cache._inflight
+
+def test_follower_waits_for_other_worker():
+    compute = AsyncMock(return_value="mine")
+    r = _redis(leader=False, stored=[None, None, json.dumps("theirs")])
+    with patch.object(cache, "_redis", r):
+        value, was_cached = asyncio.run(cache.get_or_set("hello", compute, "t"))
+    assert (value, was_cached) == ("theirs", True)
+    compute.assert_not_awaited()
+
+def test_leader_failure_propagates_to_local_followers():
+    async def compute(prompt):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("llm down")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_set("x", compute, "t") for _ in range(3)),
+                                    return_exceptions=True)
+
+    with patch.object(cache, "_redis", _redis()):
+        results = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) for e in results)
+
+def test_leader_renews_its_lease_while_computing():
+    async def compute(prompt):
+        await asyncio.sleep(0.05)       # longer than the lease
+        return "slow answer"
+
+    r = _redis()
+    r.eval = AsyncMock(return_value=1)
+    with patch.object(cache, "_redis", r), patch.object(cache, "_lease_ms", 30):
+        value, was_cached = asyncio.run(cache.get_or_set("slow", compute, "t"))
+    assert (value, was_cached) == ("slow answer", False)
+    scripts = [c.args[0] for c in r.eval.await_args_list]
+    assert scripts.count(cache._RENEW_LUA) >= 2
+    assert scripts[-1] == cache._RELEASE_LUA
+
+def test_follower_keeps_waiting_while_the_lease_is_held():
+    compute = AsyncMock(return_value="mine")
+    r = _redis(leader=False, stored=[None, None, None, json.dumps("theirs")])
+    r.pubsub.return_value.get_message = AsyncMock(return_value=None)
+    r.exists = AsyncMock(return_value=1)
+    with patch.object(cache, "_redis", r), patch.object(cache, "_wait_s", 0):
+        value, was_cached = asyncio.run(cache.get_or_set("hello", compute, "t"))
+    assert (value, was_cached) == ("theirs", True)
+    r.exists.assert_awaited_with("cache:t:" + cache._digest("hello") + ":lease")
+    compute.assert_not_awaited()
+
+def test_follower_computes_once_the_lease_lapses():
+    compute = AsyncMock(return_value="mine")
+    r = _redis(leader=False)
+    r.pubsub.return_value.get_message = AsyncMock(return_value=None)
+    r.exists = AsyncMock(return_value=0)
+    with patch.object(cache, "_redis", r), patch.object(cache, "_wait_s", 0):
+        value, was_cached = asyncio.run(cache.get_or_set("hello", compute, "t"))
+    assert (value, was_cached) == ("mine", False)
+
+def test_local_followers_compute_themselves_when_the_leader_fails():
+    calls = []
+    async def compute(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise RuntimeError("llm down")
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_set("y", compute, "t") for _ in range(3)),
+                                    return_exceptions=True)
+
+    with patch.object(cache, "_redis", _redis()):
+        results = asyncio.run(run())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [("answer", False), ("answer", False)]
+    assert len(calls) == 3
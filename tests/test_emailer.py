@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from emaillm.core import emailer, http
+
+def _run_with(handler, *sends):
+    async def run():
+        http._clients["sendgrid"] = httpx.AsyncClient(
+            base_url="https://api.sendgrid.test", transport=httpx.MockTransport(handler)
+        )
+        try:
+            return await asyncio.gather(*(emailer.send_email(**kw) for kw in sends))
+        finally:
+            await http.aclose_all()
+    return asyncio.run(run())
+
+def test_send_email_reuses_pooled_client():
+    seen = []
+    def handler(request):
+        seen.append(json.loads(request.content))
+        return httpx.Response(202)
+
+    _run_with(
+        handler,
+        dict(to_addr="a@x.com", subject="Re: hi", body_text="hello"),
+        dict(to_addr="b@x.com", subject="Re: hi", body_text="hello", body_html="<p>hello</p>"),
+    )
+    assert [p["personalizations"][0]["to"][0]["email"] for p in seen] == ["a@x.com", "b@x.com"]
+    assert [c["type"] for c in seen[1]["content"]] == ["text/plain", "text/html"]
+
+def test_send_email_raises_on_sendgrid_error():
+    with pytest.raises(RuntimeError, match="SendGrid 429"):
+        _run_with(lambda request: httpx.Response(429), dict(to_addr="a@x.com", subject="s", body_text="t"))
+
+def test_identical_replies_are_coalesced_into_one_call(monkeypatch):
+    monkeypatch.setattr(emailer, "COALESCE_WINDOW_MS", 20)
+    seen = []
+    def handler(request):
+        seen.append(json.loads(request.content))
+        return httpx.Response(202)
+
+    _run_with(
+        handler,
+        *(dict(to_addr=f"u{i}@x.com", subject="Re: score", body_text="2-1") for i in range(3)),
+        dict(to_addr="v@x.com", subject="Re: weather", body_text="sunny"),
+    )
+    assert sorted(len(p["personalizations"]) for p in seen) == [1, 3]
+
+def test_rejected_batch_falls_back_to_per_recipient_results(monkeypatch):
+    monkeypatch.setattr(emailer, "COALESCE_WINDOW_MS", 20)
+    def handler(request):
+        recipients = [p["to"][0]["email"] for p in json.loads(request.content)["personalizations"]]
+        return httpx.Response(400 if "bad@x.com" in recipients else 202)
+
+    async def run():
+        http._clients["sendgrid"] = httpx.AsyncClient(
+            base_url="https://api.sendgrid.test", transport=httpx.MockTransport(handler)
+        )
+        try:
+            return await asyncio.gather(
+                *(emailer.send_email(to_addr=addr, subject="s", body_text="t") for addr in ("ok@x.com", "bad@x.com")),
+                return_exceptions=True,
+            )
+        finally:
+            await http.aclose_all()
+
+    ok, bad = asyncio.run(run())
+    assert ok is None
+    assert isinstance(bad, emailer.SendGridError) and bad.status_code == 400
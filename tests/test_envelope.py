@@ -0,0 +1,63 @@
+import asyncio
+from email.message import EmailMessage
+from unittest.mock import patch
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from emaillm.core import envelope as env
+
+def _mime():
+    msg = EmailMessage()
+    msg["From"] = "Bob <Bob@Example.com>"
+    msg["To"] = "manutd@emaillm.com"
+    msg["Subject"] = "score?"
+    msg["Message-ID"] = "<abc@example.com>"
+    msg.set_content("what's the score")
+    msg.add_alternative("<p>what's the score</p>", subtype="html")
+    msg.add_attachment(b"x" * 10, maintype="image", subtype="png", filename="a.png")
+    return msg.as_bytes()
+
+def test_parse_mime_extracts_envelope():
+    e = env.parse_mime(_mime())
+    assert (e.from_addr, e.sender, e.to_addr) == ("Bob@Example.com", "bob@example.com", "manutd@emaillm.com")
+    assert e.text.strip() == "what's the score"
+    assert "<p>" in e.html
+    assert e.message_id == "<abc@example.com>"
+    assert e.attachments == (env.Attachment("a.png", "image/png", 10),)
+
+def _app():
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def parse_first(request: Request, call_next):
+        request.state.seen = (await env.get_envelope(request)).sender
+        return await call_next(request)
+
+    @app.post("/inbound")
+    async def inbound(request: Request):
+        e = await env.get_envelope(request)
+        return {"from": e.from_addr, "text": e.text, "message_id": e.message_id,
+                "attachments": len(e.attachments)}
+    return app
+
+def test_every_content_type_is_parsed_once():
+    client = TestClient(_app())
+    with patch.object(env, "parse_inbound", wraps=env.parse_inbound) as parse:
+        raw = client.post("/inbound", content=_mime(), headers={"content-type": "message/rfc822"})
+        form = client.post("/inbound", data={"from": "a@b.com", "text": "hi",
+                                             "headers": "Message-ID: <m1@b.com>\n"},
+                           files={"attachment1": ("f.txt", b"abc", "text/plain")})
+        urlenc = client.post("/inbound", data={"email": _mime().decode()})
+        body = client.post("/inbound", json={"from": "a@b.com", "text": "hi"})
+    assert raw.json() == {"from": "Bob@Example.com", "text": "what's the score\n",
+                          "message_id": "<abc@example.com>", "attachments": 1}
+    assert form.json() == {"from": "a@b.com", "text": "hi", "message_id": "<m1@b.com>", "attachments": 1}
+    assert urlenc.json()["message_id"] == "<abc@example.com>"
+    assert body.json()["from"] == "a@b.com"
+    assert parse.call_count == 4
+
+def test_envelope_round_trips_through_job():
+    e = env.parse_mime(_mime())
+    back = env.InboundEnvelope.from_job(e.to_job())
+    assert (back.from_addr, back.subject, back.text, back.message_id) == (e.from_addr, e.subject, e.text, e.message_id)
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from emaillm.core import idempotency
+from emaillm.core.envelope import InboundEnvelope
+
+class _FakeRedis:
+    """Just enough of SET NX / GET / the takeover script for the marker logic."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def eval(self, script, numkeys, key, expected, value, ttl):
+        if self.data.get(key) != expected:
+            return 0
+        self.data[key] = value
+        return 1
+
+def test_key_prefers_message_id_and_falls_back_to_digest():
+    a = InboundEnvelope("A@x.com", "to@emaillm.com", "Hi", "body", message_id="<ABC@mail>")
+    b = InboundEnvelope("a@x.com", "to@emaillm.com", "Other", "text", message_id="abc@mail")
+    assert idempotency.key_for(a) == idempotency.key_for(b) == "idem:inbound:mid:abc@mail"
+
+    c = InboundEnvelope("a@x.com", "to@emaillm.com", "Hi", "body")
+    d = InboundEnvelope("A@X.com", "to@emaillm.com", "Hi", "body")
+    e = InboundEnvelope("a@x.com", "to@emaillm.com", "Hi", "other body")
+    assert idempotency.key_for(c) == idempotency.key_for(d) != idempotency.key_for(e)
+
+def test_duplicate_gets_original_outcome():
+    r = _FakeRedis()
+    outcome = {"status_code": 200, "body": {"status": "accepted"}}
+
+    async def scenario():
+        first = await idempotency.claim("k")
+        running = await idempotency.claim("k")
+        await idempotency.complete("k", outcome)
+        return first, running, await idempotency.claim("k")
+
+    with patch.object(idempotency, "_redis", r):
+        first, running, done = asyncio.run(scenario())
+    assert first.owned
+    assert not running.owned and running.state == idempotency.IN_PROGRESS
+    assert not done.owned and done.state == idempotency.DONE and done.outcome == outcome
+
+def test_failed_delivery_is_retried_once():
+    r = _FakeRedis()
+
+    async def scenario():
+        await idempotency.claim("k")
+        await idempotency.fail("k", "llm down")
+        return await idempotency.claim("k"), await idempotency.claim("k")
+
+    with patch.object(idempotency, "_redis", r):
+        retry, concurrent = asyncio.run(scenario())
+    assert retry.owned
+    assert not concurrent.owned
+    assert json.loads(r.data["k"])["state"] == idempotency.IN_PROGRESS
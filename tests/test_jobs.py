@@ -0,0 +1,82 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+from emaillm.core import jobs
+from emaillm import worker
+
+def test_enqueue_serialises_job():
+    r = AsyncMock()
+    r.xadd.return_value = "1-0"
+    with patch.object(jobs, "_redis", r):
+        assert asyncio.run(jobs.enqueue({"from": "a@b.com", "text": "hi"})) == "1-0"
+    stream, fields = r.xadd.call_args.args
+    assert stream == jobs.STREAM
+    assert json.loads(fields["job"]) == {"from": "a@b.com", "text": "hi"}
+
+def test_reclaim_dead_letters_after_max_deliveries():
+    r = AsyncMock()
+    job = {"job": json.dumps({"from": "a@b.com"})}
+    r.xautoclaim.side_effect = lambda stream, *a, **kw: (
+        ["0-0", [("1-0", job), ("2-0", job)], []] if stream == jobs.STREAM else ["0-0", [], []]
+    )
+    r.xpending_range.side_effect = [
+        [{"times_delivered": 2}],
+        [{"times_delivered": jobs.MAX_DELIVERIES + 1}],
+    ]
+    with patch.object(jobs, "_redis", r):
+        claimed = asyncio.run(jobs.reclaim("c1"))
+    assert claimed == [(jobs.STREAM, "1-0", {"from": "a@b.com"})]
+    r.xadd.assert_called_once()
+    assert r.xadd.call_args.args[0] == jobs.DEAD_STREAM
+    r.xack.assert_called_once_with(jobs.STREAM, jobs.GROUP, "2-0")
+
+@patch("emaillm.worker.jobs.ack", new_callable=AsyncMock)
+def test_worker_acks_only_processed_jobs(ack):
+    job = {"from": "a@b.com", "to": "x@emaillm.com", "subject": "s", "text": "t"}
+    with patch("emaillm.worker.process_inbound", new_callable=AsyncMock) as process:
+        assert asyncio.run(worker.handle("1-0", job)) is True
+        process.side_effect = RuntimeError("llm down")
+        assert asyncio.run(worker.handle("2-0", job)) is False
+    ack.assert_awaited_once_with("1-0", jobs.STREAM)
+
+class _FakeStreams:
+    """XADD / non-blocking XREADGROUP over in-memory streams (one consumer group)."""
+
+    def __init__(self):
+        self.streams = {}
+        self.seq = 0
+
+    async def xadd(self, stream, fields, maxlen=None, approximate=True):
+        self.seq += 1
+        self.streams.setdefault(stream, []).append((f"{self.seq}-0", fields))
+        return f"{self.seq}-0"
+
+    async def xreadgroup(self, group, consumer, streams, count=1, block=None):
+        resp = []
+        for stream in streams:
+            pending = self.streams.get(stream, [])
+            if pending:
+                taken, self.streams[stream] = pending[:count], pending[count:]
+                resp.append([stream, taken])
+        return resp
+
+def test_queue_mode_reads_premium_ahead_of_a_free_backlog():
+    import random
+    r = _FakeStreams()
+
+    async def run():
+        for i in range(500):
+            await jobs.enqueue({"from": f"f{i}@x.com"}, plan="free")
+        for i in range(20):
+            await jobs.enqueue({"from": f"p{i}@x.com"}, plan="premium")
+        rng = random.Random(3)
+        return [(await jobs.read("c1", rng=rng))[0] for _ in range(40)]
+
+    with patch.object(jobs, "_redis", r):
+        order = asyncio.run(run())
+    premium = [job for stream, _, job in order if stream == jobs.stream_for("premium")]
+    # FIFO would have served 40 free jobs first; the weighted lanes drain premium early
+    assert jobs.stream_for("free") == jobs.STREAM != jobs.stream_for("premium")
+    assert len(premium) == 20
+    assert premium[0] == {"from": "p0@x.com"}
@@ -0,0 +1,88 @@
+import asyncio
+import os
+from email.message import EmailMessage
+from unittest.mock import patch
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from emaillm.core import envelope as env
+from emaillm.core import mime_stream
+
+def _mime(attachment=b"\x89PNG" + bytes(range(256)) * 40):
+    msg = EmailMessage()
+    msg["From"] = "Bob <bob@example.com>"
+    msg["To"] = "manutd@emaillm.com"
+    msg["Subject"] = "score?"
+    msg["Message-ID"] = "<abc@example.com>"
+    msg.set_content("what's the score, café?")
+    msg.add_alternative("<p>what's the score</p>", subtype="html")
+    msg.add_attachment(attachment, maintype="image", subtype="png", filename="a.png")
+    return msg
+
+def _feed(collector, raw, size):
+    for i in range(0, len(raw), size):
+        collector.write(raw[i:i + size])
+    collector.close()
+    return collector
+
+def test_streamed_mime_matches_whole_message_parse_for_any_chunking():
+    for linesep in ("\n", "\r\n"):
+        raw = _mime().as_bytes(policy=_mime().policy.clone(linesep=linesep))
+        whole = env.parse_mime(raw)
+        for size in (1, 7, 64, 4096, len(raw)):
+            c = _feed(mime_stream.MimeCollector(), raw, size)
+            fields = c.fields()
+            try:
+                assert fields["text"] == whole.text
+                assert fields["html"] == whole.html
+                assert fields["message_id"] == "<abc@example.com>"
+                (name, ctype, length, path), = c.spooled
+                assert (name, ctype, length) == ("a.png", "image/png", whole.attachments[0].size)
+                with open(path, "rb") as f:
+                    assert f.read().startswith(b"\x89PNG")
+            finally:
+                mime_stream.discard(c.spooled)
+            assert not os.path.exists(path)
+
+def test_text_is_capped_in_memory():
+    msg = EmailMessage()
+    msg["From"] = "a@b.com"
+    msg.set_content("x" * 5000)
+    with patch.object(mime_stream, "MAX_TEXT_BYTES", 1000):
+        c = _feed(mime_stream.MimeCollector(), msg.as_bytes(), 333)
+    assert len(c.fields()["text"]) == 1000
+
+def _app():
+    app = FastAPI()
+
+    @app.post("/inbound")
+    async def inbound(request: Request):
+        e = await env.get_envelope(request)
+        out = {"from": e.from_addr, "text": e.text.strip(), "attachments": [a.size for a in e.attachments],
+               "signature": request.state.body_signature}
+        e.discard()
+        return out
+    return app
+
+@patch.object(env, "STREAMING", True)
+def test_streaming_endpoint_handles_form_and_raw_and_enforces_cap(monkeypatch):
+    monkeypatch.setenv("SENDGRID_SIGNING_KEY", "c2VjcmV0")
+    client = TestClient(_app())
+    raw = _mime().as_bytes()
+    headers = {"X-Twilio-Email-Event-Webhook-Timestamp": "1700000000"}
+
+    form = client.post("/inbound", headers=headers,
+                       data={"from": "a@b.com", "text": "hi"},
+                       files={"attachment1": ("f.txt", b"abc", "text/plain")})
+    assert form.json()["from"] == "a@b.com"
+    assert form.json()["attachments"] == [3]
+    assert form.json()["signature"]
+
+    sendgrid_raw = client.post("/inbound", files={"email": (None, raw)})
+    assert sendgrid_raw.json()["text"] == "what's the score, café?"
+    assert len(sendgrid_raw.json()["attachments"]) == 1
+
+    with patch.object(env, "MAX_BYTES", 1024):
+        too_big = client.post("/inbound", content=raw, headers={"content-type": "message/rfc822"})
+    assert too_big.status_code == 413
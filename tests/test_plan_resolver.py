@@ -0,0 +1,122 @@
+from tests._stubs import *   # noqa: F401  pylint: disable=unused-wildcard-import
+
+import asyncio
+import types
+
+from emaillm.core.plan_resolver import PlanResolver
+
+class _Snap:
+    def __init__(self, doc_id, data):
+        self.id, self._data = doc_id, data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class _Collection:
+    def __init__(self, db, name):
+        self._db, self.name = db, name
+
+    def document(self, doc_id):
+        return types.SimpleNamespace(collection=self.name, id=doc_id)
+
+    def on_snapshot(self, callback):
+        self._db.listeners[self.name] = callback
+        # like Firestore, start with every existing document as ADDED
+        added = types.SimpleNamespace(name="ADDED")
+        docs = [_Snap(doc_id, data) for doc_id, data in self._db.data.get(self.name, {}).items()]
+        callback(docs, [types.SimpleNamespace(type=added, document=d) for d in docs], None)
+        return types.SimpleNamespace(unsubscribe=lambda: self._db.listeners.pop(self.name, None))
+
+class FakeFirestore:
+    """users/ + subscriptions/ documents, `get_all` and `on_snapshot`."""
+
+    def __init__(self, **collections):
+        self.data = {name: dict(docs) for name, docs in collections.items()}
+        self.get_all_calls = []
+        self.listeners = {}
+        self.fail = False
+
+    def collection(self, name):
+        return _Collection(self, name)
+
+    def get_all(self, refs):
+        refs = list(refs)
+        self.get_all_calls.append([r.id for r in refs])
+        if self.fail:
+            raise RuntimeError("firestore unavailable")
+        return [_Snap(r.id, self.data.get(r.collection, {}).get(r.id)) for r in refs]
+
+    def push(self, collection, doc_id, data, kind="MODIFIED"):
+        self.data.setdefault(collection, {})[doc_id] = data
+        change = types.SimpleNamespace(type=types.SimpleNamespace(name=kind), document=_Snap(doc_id, data))
+        self.listeners[collection]([], [change], None)
+
+def _db():
+    return FakeFirestore(
+        users={
+            "pat@x.com": {"tier": "premium"},
+            "sam@x.com": {"tier": "free", "stripe_cust_id": "cus_1"},
+        },
+        subscriptions={"cus_1": {"tier": "starter"}},
+    )
+
+def test_concurrent_misses_share_one_get_all_and_are_cached():
+    db = _db()
+    resolver = PlanResolver(db, batch_ms=5)
+
+    async def run():
+        first = await resolver.resolve_many(["Pat@x.com", "sam@x.com", "nobody@x.com", "pat@x.com"])
+        second = await resolver.resolve_many(["pat@x.com", "nobody@x.com"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {"Pat@x.com": "premium", "sam@x.com": "starter", "nobody@x.com": "free", "pat@x.com": "premium"}
+    assert second == {"pat@x.com": "premium", "nobody@x.com": "free"}
+    # one batch for the users, one for the linked subscription; the repeat is all cache
+    assert db.get_all_calls == [["pat@x.com", "sam@x.com", "nobody@x.com"], ["cus_1"]]
+
+def test_negative_entries_expire_sooner():
+    db = _db()
+    resolver = PlanResolver(db, negative_ttl_s=0.01, batch_ms=0)
+
+    async def run():
+        await resolver.resolve("new@x.com")
+        db.data["users"]["new@x.com"] = {"tier": "premium"}
+        await asyncio.sleep(0.02)
+        return await resolver.resolve("new@x.com")
+
+    assert asyncio.run(run()) == "premium"
+    assert len(db.get_all_calls) == 2
+
+def test_listener_pushes_tier_changes():
+    db = _db()
+    resolver = PlanResolver(db, batch_ms=0)
+    resolver.start_listener()
+
+    async def run():
+        before = await resolver.resolve_many(["pat@x.com", "sam@x.com"])
+        db.push("users", "pat@x.com", {"tier": "free"})
+        db.push("subscriptions", "cus_1", {"tier": "premium"})
+        after = await resolver.resolve_many(["pat@x.com", "sam@x.com"])
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert before == {"pat@x.com": "premium", "sam@x.com": "starter"}
+    assert after == {"pat@x.com": "free", "sam@x.com": "premium"}
+    # the initial snapshot was not cached (both senders were fetched); the changes were applied in place
+    assert len(db.get_all_calls) == 2
+    resolver.stop_listener()
+    assert db.listeners == {}
+
+def test_lookup_errors_fall_back_to_default_without_caching():
+    db = _db()
+    db.fail = True
+    resolver = PlanResolver(db, batch_ms=0)
+
+    async def run():
+        down = await resolver.resolve("pat@x.com")
+        db.fail = False
+        return down, await resolver.resolve("pat@x.com")
+
+    assert asyncio.run(run()) == ("free", "premium")
@@ -0,0 +1,52 @@
+import os
+import json
+
+from emaillm.config import pricing_loader
+from emaillm.config.pricing_loader import parse_plans
+
+PLANS = {
+    "free": {"price_cents": 0, "quota_week": 10, "quota_month": 40, "features": ["basic_llm"]},
+    "premium": {"price_cents": 2000, "quota_month": 500, "features": ["priority_queue"]},
+}
+
+def test_snapshot_precomputes_windows_and_features():
+    snap = parse_plans(PLANS)
+    free = snap.get("free")
+    assert [(w.name, w.limit, w.seconds) for w in free.windows] == [("week", 10, 604800), ("month", 40, 2592000)]
+    assert free.longest_window == 2592000
+    assert snap.has_feature("premium", "priority_queue")
+    assert not snap.has_feature("free", "priority_queue")
+    assert not snap.has_feature("nope", "priority_queue")
+    assert snap.get_or_default("nope") is free
+
+def test_reload_swaps_snapshot_only_when_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "plans.json"
+    path.write_text(json.dumps(PLANS))
+    monkeypatch.setattr(pricing_loader, "_snapshot", pricing_loader._read_file(str(path)))
+    before = pricing_loader.current()
+    assert not pricing_loader.reload_if_changed(str(path))
+
+    v2 = dict(PLANS, free=dict(PLANS["free"], quota_week=5))
+    path.write_text(json.dumps(v2))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert pricing_loader.reload_if_changed(str(path))
+    assert pricing_loader.current().get("free").windows[0].limit == 5
+    assert before.get("free").windows[0].limit == 10        # old snapshot untouched
+
+    # a broken edit keeps the plans in force
+    path.write_text("{not json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2_000_000))
+    assert not pricing_loader.reload_if_changed(str(path))
+    assert pricing_loader.current().get("free").windows[0].limit == 5
+
+def test_firestore_snapshot_takes_over():
+    old = pricing_loader._snapshot
+    try:
+        doc = lambda tier, data: type("Doc", (), {"id": tier, "to_dict": lambda self: data})()
+        pricing_loader._on_firestore([doc(t, d) for t, d in PLANS.items()], [], "t1")
+        assert pricing_loader.current().source == "firestore"
+        assert "premium" in pricing_loader.current()
+        # the file watcher stands down while Firestore is the source
+        assert not pricing_loader.reload_if_changed()
+    finally:
+        pricing_loader._snapshot = old
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import httpx
+
+from emaillm.core import http
+from emaillm.core.providers import GPT41
+
+def _completion(request):
+    body = json.loads(request.content)
+    assert body["messages"] == [{"role": "user", "content": "score?"}]
+    return httpx.Response(200, json={
+        "choices": [{"message": {"content": "  2-1  "}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+    })
+
+def test_gpt41_chat_is_async_and_uses_pooled_client(monkeypatch):
+    calls = []
+    def handler(request):
+        calls.append(request.url.path)
+        return _completion(request)
+
+    async def run():
+        http._clients["openai"] = httpx.AsyncClient(
+            base_url="https://api.test/v1", transport=httpx.MockTransport(handler)
+        )
+        try:
+            provider = GPT41()
+            return await asyncio.gather(provider.chat("score?"), provider.chat("score?"))
+        finally:
+            await http.aclose_all()
+
+    assert asyncio.run(run()) == ["2-1", "2-1"]
+    assert calls == ["/v1/chat/completions"] * 2
+
+def test_get_client_reuses_one_client_per_name():
+    async def run():
+        try:
+            a = http.get_client("x", base_url="https://a.test")
+            b = http.get_client("x", base_url="https://a.test")
+            return a is b
+        finally:
+            await http.aclose_all()
+    assert asyncio.run(run())
@@ -1,4 +1,5 @@
 from emaillm.core.quota import check_and_consume
+from emaillm.config.pricing_loader import current as current_plans
 import time
 import uuid
 
@@ -12,10 +13,10 @@ def test_quota_happy_path():
     user = f"test-{uuid.uuid4().hex[:8]}@example.com"
     plan = "free"
     clear_usage(plan, user)
-    # Should allow 30 times
-    for _ in range(30):
+    # Should allow 10 times (free: 10 / week)
+    for _ in range(10):
         assert check_and_consume(user, plan=plan) is True
-    # 31st should block
+    # 11th should block
     assert check_and_consume(user, plan=plan) is False
 
 def test_quota_block_case():
@@ -23,7 +24,52 @@ def test_quota_block_case():
     plan = "free"
     clear_usage(plan, user)
     # Fill up quota
-    for _ in range(30):
+    for _ in range(10):
         assert check_and_consume(user, plan=plan) is True
     # Next call should block
     assert check_and_consume(user, plan=plan) is False
+
+def test_quota_reports_remaining_and_reset():
+    from emaillm.core.quota import consume
+    user = f"reset-{uuid.uuid4().hex[:8]}@example.com"
+    plan = "free"
+    clear_usage(plan, user)
+    week, month = current_plans().get(plan).windows
+    first = consume(user, plan=plan)
+    # the weekly window has the least headroom, so it is the one reported
+    assert first.allowed and first.remaining == week.limit - 1
+    assert first.reset_at - int(time.time()) <= week.seconds
+    assert r.ttl(_key(plan, user)) > 0
+
+def test_bucket_estimate_weights_straddling_bucket():
+    from emaillm.core.quota import bucket_estimate
+    # window 10h, 1h buckets, now = 10.5h: bucket 0 is half inside the window
+    counts = {0: 4, 5: 3, 10: 1, -1: 50}
+    assert bucket_estimate(counts, now=37_800, window=36_000, size=3600) == 4 * 0.5 + 3 + 1
+
+def test_bucket_mode_blocks_and_migrates_zset(monkeypatch):
+    import emaillm.core.quota as quota
+    monkeypatch.setattr(quota, "QUOTA_MODE", "buckets")
+    user = f"bucket-{uuid.uuid4().hex[:8]}@example.com"
+    plan = "free"
+    limit = min(w.limit for w in current_plans().get(plan).windows)
+    clear_usage(plan, user)
+    r.delete(quota._bucket_key(plan, user))
+    # five questions recorded by the old ZSET mode carry over
+    r.zadd(_key(plan, user), {uuid.uuid4().hex: int(time.time()) for _ in range(5)})
+    for _ in range(limit - 5):
+        assert check_and_consume(user, plan=plan) is True
+    assert check_and_consume(user, plan=plan) is False
+    assert not r.exists(_key(plan, user))
+    assert r.ttl(quota._bucket_key(plan, user)) > 0
+
+def test_consume_async_runs_the_script_without_blocking(monkeypatch):
+    import asyncio
+    from unittest.mock import AsyncMock
+    from emaillm.core import quota
+    script = AsyncMock(return_value=[1, 9, 0, 1])
+    monkeypatch.setattr(quota, "QUOTA_MODE", "zset")
+    monkeypatch.setattr(quota, "_aconsume", script)
+    result = asyncio.run(quota.consume_async("async@example.com", plan="free"))
+    assert result.allowed and result.remaining == 9 and result.level == "user"
+    assert script.await_args.kwargs["keys"] == ["quota:free:async@example.com"]
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from emaillm.core import http
+from emaillm.core.providers import OpenAICompatible
+from emaillm.core.ratelimit import DistributedRateLimiter, RateLimitTimeout, TokenBucket, parse_reset
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=100, capacity=5)
+    assert all(bucket.try_acquire() for _ in range(5))
+    assert not bucket.try_acquire()
+
+    async def drain():
+        start = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(drain()) == pytest.approx(0.1, abs=0.05)
+
+def test_parse_reset_durations():
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1.5s") == 1.5
+    assert parse_reset("250ms") == 0.25
+    assert parse_reset("3") == 3
+    assert parse_reset(None) is None
+
+def test_distributed_limiter_waits_for_reservation_or_times_out():
+    redis = MagicMock()
+    redis.eval = AsyncMock(side_effect=[[1, 40, -1, 900], [0, 5000, -3, 900]])
+    limiter = DistributedRateLimiter("p", rpm=60, tpm=1000, max_wait_s=1, redis=redis)
+
+    async def run():
+        with patch("emaillm.core.ratelimit.asyncio.sleep", new_callable=AsyncMock) as sleep:
+            await limiter.acquire(100)
+            sleep.assert_awaited_once_with(0.04)
+        with pytest.raises(RateLimitTimeout):
+            await limiter.acquire(100)
+
+    asyncio.run(run())
+    # rpm/s and tpm/s go to the script as per-millisecond refill rates
+    args = redis.eval.call_args_list[0].args
+    assert args[4:10] == (60 / 60_000, 60, 1000 / 60_000, 1000, 100, 1000)
+
+def test_provider_adapts_to_headers_and_429():
+    headers = {"x-ratelimit-limit-requests": "3000", "x-ratelimit-remaining-requests": "0", "retry-after": "2"}
+
+    async def run():
+        http._clients["p"] = httpx.AsyncClient(
+            base_url="https://api.test/v1",
+            transport=httpx.MockTransport(lambda request: httpx.Response(429, headers=headers)),
+        )
+        provider = OpenAICompatible("p", rpm=500, tpm=30_000)
+        provider.ratelimit.acquire = AsyncMock()
+        provider.ratelimit.throttled = AsyncMock()
+        provider.ratelimit._redis = MagicMock()
+        provider.ratelimit._redis.pipeline.return_value.execute = AsyncMock()
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await provider.chat("hi")
+        finally:
+            await http.aclose_all()
+        return provider.ratelimit
+
+    limiter = asyncio.run(run())
+    assert limiter.rpm == 3000
+    limiter.throttled.assert_awaited_once_with(2.0)
+
+def test_provider_with_only_one_budget_gets_a_limiter():
+    only_rpm = OpenAICompatible("p", rpm=500)
+    only_tpm = OpenAICompatible("p", tpm=30_000)
+    assert only_rpm.ratelimit is not None and (only_rpm.ratelimit.rpm, only_rpm.ratelimit.tpm) == (500, 0)
+    assert only_tpm.ratelimit is not None and (only_tpm.ratelimit.rpm, only_tpm.ratelimit.tpm) == (0, 30_000)
+    assert OpenAICompatible("p").ratelimit is None
+
+def test_tokens_only_limiter_drains_the_token_budget_on_429():
+    redis = MagicMock()
+    redis.eval = AsyncMock(side_effect=[[1, 0, -1, 900], 1])
+    redis.pipeline.return_value.execute = AsyncMock()
+    limiter = DistributedRateLimiter("p", rpm=0, tpm=6000, redis=redis)
+
+    async def run():
+        await limiter.acquire(100)
+        # a request limit reported by the provider doesn't switch the request budget on
+        await limiter.observe({"x-ratelimit-limit-requests": "3000", "x-ratelimit-remaining-requests": "5"})
+        await limiter.throttled(2.0)
+
+    asyncio.run(run())
+    assert limiter.rpm == 0
+    redis.pipeline.return_value.eval.assert_not_called()
+    assert redis.eval.call_args.args[2:] == ("ratelimit:p:tokens", -200.0)
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+
+from emaillm.core import registry
+from emaillm.core.providers import StubProvider
+from emaillm.core.registry import CLOSED, HALF_OPEN, OPEN, ProviderHealth, ProviderRegistry
+from emaillm.exceptions import ProviderUnavailableError
+
+def _registry(primary, backup):
+    reg = ProviderRegistry(default_chain=["primary", "backup"])
+    reg.register("primary", primary)
+    reg.register("backup", backup)
+    reg.route("Gemini", ["primary", "backup"])
+    return reg
+
+def test_falls_back_and_opens_circuit_on_sustained_failures():
+    primary = StubProvider("primary", latency_ms=1, error_rate=1.0, seed=1)
+    backup = StubProvider("backup", latency_ms=1, reply="from backup")
+    reg = _registry(primary, backup)
+
+    async def run(n):
+        return [await reg.complete("Gemini", "hi") for _ in range(n)]
+
+    assert asyncio.run(run(registry.MAX_CONSECUTIVE + 3)) == ["from backup"] * (registry.MAX_CONSECUTIVE + 3)
+    assert reg.health("primary").state == OPEN
+    # once open, the failing provider is no longer called
+    assert primary.calls == registry.MAX_CONSECUTIVE
+
+def test_all_providers_down_raises():
+    reg = _registry(StubProvider("primary", latency_ms=0, error_rate=1.0), StubProvider("backup", latency_ms=0, error_rate=1.0))
+    with pytest.raises(ProviderUnavailableError, match="primary.*backup"):
+        asyncio.run(reg.complete("Gemini", "hi"))
+
+def test_breaker_half_opens_after_cooldown_with_a_single_probe():
+    health = ProviderHealth("p")
+    for i in range(registry.MAX_CONSECUTIVE):
+        health.record(0.1, ok=False, now=100.0 + i)
+    assert health.state == OPEN
+    assert not health.allow(now=101.0)
+
+    later = 100.0 + registry.COOLDOWN_S + 5
+    assert health.allow(now=later) and health.state == HALF_OPEN
+    assert not health.allow(now=later)          # probe already in flight
+    health.record(0.1, ok=True, now=later)
+    assert health.state == CLOSED
+
+def test_error_rate_trips_breaker_within_window():
+    health = ProviderHealth("p", window_s=60)
+    pattern = [True, False] * registry.MIN_REQUESTS
+    for i, ok in enumerate(pattern):
+        health.record(0.2, ok=ok, now=float(i))
+    assert health.state == OPEN
+    assert health.latency_quantile(0.5, now=float(len(pattern))) == pytest.approx(0.2)
+
+def test_load_registry_skips_providers_without_keys(tmp_path, monkeypatch):
+    monkeypatch.delenv("NOPE_API_KEY", raising=False)
+    cfg = tmp_path / "providers.json"
+    cfg.write_text(json.dumps({
+        "providers": {
+            "real": {"type": "openai", "api_key_env": "NOPE_API_KEY"},
+            "local": {"type": "stub", "latency_ms": 1, "reply": "offline"},
+        },
+        "routes": {"Grok": ["real", "local"]},
+        "default": ["local"],
+    }))
+    reg = registry.load_registry(str(cfg))
+    assert reg.chain("Grok") == ["local"]
+    assert asyncio.run(reg.complete("Anything", "hi")) == "offline"
+
+def test_cancelled_probe_gives_the_half_open_slot_back():
+    slow = StubProvider("primary", latency_ms=5000)
+    reg = _registry(slow, StubProvider("backup", latency_ms=0))
+    health = reg.health("primary")
+    for i in range(registry.MAX_CONSECUTIVE):
+        health.record(0.1, ok=False)
+    health.opened_at -= registry.COOLDOWN_S + 1
+
+    async def run():
+        probe = asyncio.create_task(reg.complete("Gemini", "hi"))
+        await asyncio.sleep(0.01)
+        assert health.state == HALF_OPEN and health.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(run())
+    assert not health.probing and health.allow()
+
+def test_provider_over_latency_budget_is_tried_last():
+    reg = _registry(StubProvider("primary", latency_ms=0), StubProvider("backup", latency_ms=0, reply="from backup"))
+    assert reg.ordered("Gemini") == ["primary", "backup"]
+    health = reg.health("primary")
+    health.latency_budget_s = 2.0
+    for _ in range(registry.MIN_REQUESTS):
+        health.record(5.0, ok=True)
+    assert reg.ordered("Gemini") == ["backup", "primary"]
+    assert asyncio.run(reg.complete("Gemini", "hi")) == "from backup"
+    health.latency_budget_s = 0          # budget off: configured order again
+    assert reg.ordered("Gemini") == ["primary", "backup"]
+
+def test_own_rate_limit_budget_does_not_trip_the_breaker():
+    from unittest.mock import AsyncMock
+    from emaillm.core.ratelimit import RateLimitTimeout
+    primary = StubProvider("primary", latency_ms=0)
+    primary.chat = AsyncMock(side_effect=RateLimitTimeout("primary: budget needs 30s"))
+    reg = _registry(primary, StubProvider("backup", latency_ms=0, reply="from backup"))
+
+    async def run(n):
+        return [await reg.complete("Gemini", "hi") for _ in range(n)]
+
+    assert asyncio.run(run(registry.MAX_CONSECUTIVE + 3)) == ["from backup"] * (registry.MAX_CONSECUTIVE + 3)
+    assert reg.health("primary").state == CLOSED
+    assert primary.chat.await_count == registry.MAX_CONSECUTIVE + 3
@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+from emaillm.core import render
+
+def test_markdown_becomes_html_and_text_keeps_source():
+    out = render.render_reply("**Arsenal** won:\n\n- 2-1\n- at home")
+    assert "<strong>Arsenal</strong>" in out.html
+    assert "<li>2-1</li>" in out.html
+    assert "emaillm.com/pricing" in out.html
+    assert out.text.startswith("**Arsenal** won:")
+    assert "Powered by EmailLM" in out.text
+
+def test_model_html_and_unsafe_links_are_neutralised():
+    out = render.render_reply("<script>alert(1)</script> [x](javascript:alert(1))")
+    assert "<script>" not in out.html
+    assert "&lt;script&gt;" in out.html
+    assert 'href="javascript:' not in out.html
+
+def test_rendered_reply_is_cached_by_digest():
+    answer = "cached *once*"
+    first = render.render_reply(answer)
+    with patch.object(render, "markdown_to_html") as md:
+        assert render.render_reply(answer) is first
+    md.assert_not_called()
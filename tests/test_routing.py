@@ -0,0 +1,46 @@
+import pytest
+
+from emaillm.core.routing import RoutingEngine, Rule, _trie_pattern, route_email
+
+@pytest.mark.parametrize("subject, body, model", [
+    ("Google Sheets", "", "Gemini"),
+    ("pivot tables", "in Excel please", "Copilot"),
+    ("deploy", "my AWS lambda times out", "Titan"),
+    ("", "best open  source licence?", "Mixtral"),
+    ("is this ethical", "", "Claude 3"),
+    ("", "saw it on x.com", "Grok"),
+    ("hello", "what's the score?", "GPT-4 Turbo"),
+    # priorities keep the old if-chain order
+    ("google office", "", "Gemini"),
+])
+def test_default_rules_match_legacy_routing(subject, body, model):
+    assert route_email(subject, body) == model
+
+def test_keywords_match_whole_words_only():
+    assert route_email("new laws", "") == "GPT-4 Turbo"
+    assert route_email("police officer", "") == "GPT-4 Turbo"
+    assert route_email("", "an AWS-hosted app") == "Titan"
+
+def test_regex_rules_priority_and_scan_window():
+    engine = RoutingEngine(
+        [
+            Rule("Low", priority=1, keywords=("invoice",)),
+            Rule("High", priority=9, patterns=(r"\bINC-\d{4}\b",)),
+        ],
+        default="Default",
+        scan_bytes=64,
+    )
+    assert engine.route("invoice for INC-1234", "") == "High"
+    assert engine.route("", "invoice") == "Low"
+    assert engine.route("", "x" * 100 + " INC-1234") == "Default"
+
+def test_thousands_of_keywords_compile_into_one_pattern():
+    rules = [Rule(f"m{i}", priority=i, keywords=(f"topic{i}", f"topic{i} extra")) for i in range(3000)]
+    engine = RoutingEngine(rules, default="Default")
+    assert engine.route("", "about topic2999 extra and topic17") == "m2999"
+    assert engine.route("", "topic30000") == "Default"
+
+def test_trie_pattern_keeps_prefixes():
+    import re
+    regex = re.compile(r"(?<!\w)" + _trie_pattern(["lamb", "lambda", "lab"]) + r"(?!\w)")
+    assert [m.group(0) for m in regex.finditer("lab lamb lambda lambdas")] == ["lab", "lamb", "lambda"]
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+from emaillm.core.scheduler import FairScheduler, Tier
+
+def _scheduler(max_wait_s: float = 60.0) -> FairScheduler:
+    return FairScheduler(
+        concurrency=4,
+        tiers={
+            "premium": Tier("premium", weight=8, max_concurrency=4),
+            "free": Tier("free", weight=1, max_concurrency=2),
+        },
+        max_wait_s=max_wait_s,
+    )
+
+def test_premium_overtakes_a_free_flood():
+    sched = _scheduler()
+    done = []
+
+    async def job(plan, i):
+        async with sched.slot(plan):
+            await asyncio.sleep(0.01)
+        done.append((plan, i, time.monotonic()))
+
+    async def run():
+        start = time.monotonic()
+        flood = [asyncio.create_task(job("free", i)) for i in range(100)]
+        await asyncio.sleep(0.025)
+        premium = [asyncio.create_task(job("premium", i)) for i in range(6)]
+        await asyncio.gather(*flood, *premium)
+        return start
+
+    start = asyncio.run(run())
+    premium_done = [t for plan, _, t in done if plan == "premium"]
+    # the free pool holds at most 2 of 4 slots, so premium never waits behind the flood
+    assert max(premium_done) - start < 0.2
+    assert len(done) == 106
+    assert sched.running == 0
+
+def test_free_pool_is_capped_below_global_concurrency():
+    sched = _scheduler()
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with sched.slot("free"):
+            peak = max(peak, sched.tiers["free"].running)
+            await asyncio.sleep(0.005)
+
+    async def run():
+        await asyncio.gather(*(job() for _ in range(10)))
+
+    asyncio.run(run())
+    assert peak == 2
+
+def test_weighted_order_and_starvation_protection():
+    async def order(max_wait_s):
+        sched = FairScheduler(
+            concurrency=1,
+            tiers={"premium": Tier("premium", 8, 1), "free": Tier("free", 1, 1)},
+            max_wait_s=max_wait_s,
+        )
+        served = []
+
+        async def job(plan):
+            async with sched.slot(plan):
+                served.append(plan)
+                await asyncio.sleep(0.002)
+
+        blocker = asyncio.create_task(job("premium"))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(job("free"))]
+        tasks += [asyncio.create_task(job("premium")) for _ in range(16)]
+        await asyncio.gather(blocker, *tasks)
+        return served
+
+    # weight 8:1 – the free call queued first still yields to a run of premium calls
+    assert asyncio.run(order(60.0)).index("free") > 5
+    # but once it has waited past max_wait it goes next
+    assert asyncio.run(order(0.0)).index("free") == 1
+
+def test_cancelled_waiter_gives_up_its_place():
+    sched = FairScheduler(concurrency=1, tiers={"free": Tier("free", 1, 1)})
+
+    async def run():
+        async with sched.slot("free"):
+            waiter = asyncio.create_task(sched.slot("unknown-plan").__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+        await asyncio.sleep(0)
+        async with sched.slot("free"):
+            return sched.running
+
+    assert asyncio.run(run()) == 1
+    assert sched.running == 0
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+
+from emaillm.core import cache, semantic
+
+def test_paraphrases_are_close_and_topics_are_not():
+    a = semantic.embed(cache._normalise("What's the score for Man Utd today?"))
+    b = semantic.embed(cache._normalise("man utd score today"))
+    c = semantic.embed(cache._normalise("weather forecast for london tomorrow"))
+    assert float(a @ b) >= semantic.THRESHOLD
+    assert float(a @ c) < 0.3
+
+def test_index_batch_search_skips_expired_rows():
+    index = semantic.SemanticIndex(dim=64, max_entries=3)
+    now = time.time()
+    vecs = np.eye(64, dtype=np.float32)
+    index.add("fresh", vecs[0], now + 60)
+    index.add("stale", vecs[1], now - 1)
+    assert index.search_many(vecs[:3], threshold=0.9, now=now) == [("fresh", 1.0), None, None]
+    assert index.evict_expired(now) == 1 and "stale" not in index
+
+def test_index_evicts_soonest_expiry_when_full():
+    index = semantic.SemanticIndex(dim=8, max_entries=2)
+    now = time.time()
+    vecs = np.eye(8, dtype=np.float32)
+    index.add("a", vecs[0], now + 10)
+    index.add("b", vecs[1], now + 100)
+    index.add("c", vecs[2], now + 50)
+    assert len(index) == 2 and "a" not in index
+
+@patch.object(semantic, "ENABLED", True)
+def test_get_or_set_answers_near_duplicate_and_counts_false_positive():
+    cache._l1.clear()
+    semantic._indexes.clear()
+    r = MagicMock()
+    r.pipeline.return_value.execute = AsyncMock(return_value=[None, -2])
+    r.set = AsyncMock(return_value=True)
+    r.setex = AsyncMock()
+    r.eval = AsyncMock()
+    r.publish = AsyncMock()
+    r.delete = AsyncMock()
+    r.get = AsyncMock(return_value=json.dumps("United won 2-1"))
+    compute = AsyncMock(return_value="United won 2-1")
+
+    with patch.object(cache, "_redis", r):
+        asyncio.run(cache.get_or_set("What's the score for Man Utd today?", compute, "t"))
+        cache._l1.clear()
+        value, was_cached = asyncio.run(cache.get_or_set("man utd score today", compute, "t"))
+        assert (value, was_cached) == ("United won 2-1", True)
+        compute.assert_awaited_once()
+
+        asyncio.run(cache.invalidate("man utd score today", "t"))
+    assert semantic.lookup("t", cache._digest("man utd score today"), "man utd score today") is None
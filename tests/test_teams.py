@@ -0,0 +1,44 @@
+import types
+
+import pytest
+
+from emaillm.core import quota, teams
+
+def _doc(doc_id, data):
+    return types.SimpleNamespace(id=doc_id, to_dict=lambda: data)
+
+@pytest.fixture
+def directory(monkeypatch):
+    d = teams.TeamDirectory(db=object())
+    d.apply_orgs([_doc("acme", {"quota_month": 5000})])
+    d.apply_teams([
+        _doc("t1", {"members": ["Ann@x.com", "bo@x.com"], "member_quota_week": 50, "org_id": "acme"}),
+        _doc("t2", {"members": ["cy@x.com", "bo@x.com"], "plan_tier": "premium"}),
+    ])
+    monkeypatch.setattr(teams, "ENABLED", True)
+    monkeypatch.setattr(teams, "_directory", d)
+    return d
+
+def test_membership_from_team_documents(directory):
+    ann = teams.membership("ann@x.com")
+    assert (ann.team_id, ann.plan, ann.org_id) == ("t1", "team", "acme")
+    assert [(w.name, w.limit) for w in ann.member_windows] == [("week", 50)]
+    assert [(w.name, w.limit) for w in ann.org_windows] == [("month", 5000)]
+    assert teams.membership("bo@x.com").team_id == "t1"      # first team listing wins
+    assert teams.membership("nobody@x.com") is None
+
+    directory.apply_teams([_doc("t1", {"members": ["bo@x.com"]})])
+    assert teams.membership("ann@x.com") is None
+
+def test_quota_levels_stack_user_team_and_org(directory):
+    levels = quota.quota_levels("ann@x.com", plan="free")
+    assert [(lv.name, lv.owner) for lv in levels] == [("user", "ann@x.com"), ("team", "team:t1"), ("org", "acme")]
+    assert quota._level_args(levels) == [1, 604800, 50, 1, 2592000, 10000, 1, 2592000, 5000]
+
+    # no member cap and no org: the pool is the only level
+    assert [(lv.name, lv.plan) for lv in quota.quota_levels("cy@x.com")] == [("team", "premium")]
+    assert [(lv.name, lv.plan) for lv in quota.quota_levels("solo@x.com", plan="starter")] == [("user", "starter")]
+
+def test_disabled_directory_keeps_quotas_per_user(monkeypatch):
+    monkeypatch.setattr(teams, "ENABLED", False)
+    assert teams.membership("ann@x.com") is None